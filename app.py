@@ -1,25 +1,118 @@
-from flask import Flask, render_template, request, redirect, url_for, jsonify, session
+from flask import Flask, render_template, request, redirect, url_for, jsonify, session, g, Response, abort
+import base64
+import hashlib
 import json
 import os
-from datetime import datetime
-from generator import Generator
+import time
+from datetime import date, datetime, timedelta, timezone
+from werkzeug.http import is_resource_modified
+import dataset
+import metrics
+from debug_sink import DirectoryDebugSink
+from decision_trace import LEVELS, DecisionTrace
+from generator import WEEKDAYS, Generator, apply_official_schedule, data_version
+from jobs import FINISHED, JobQueue
+from generation_cache import GenerationCache, cache_key
+from ledger import LEDGER_FILENAME, WINDOWS, entries_for, new_commit_id, shared_ledger, undo_changes, window
+from roster_import import default_school_year, import_roster
+from schedule import Schedule
+from schedule_store import ScheduleStore
 
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-here-change-in-production'
 
 DATA_DIR = 'data'
 
+# Seed used when the form does not give one: the same date gives the same result
+DEFAULT_SEED = 0
+
+# (schedule, substitutions text) of recent generations, see generation_cache.py
+generation_cache = GenerationCache()
+
+# Generated schedules waiting for /ufficializza; the session only holds their id
+schedule_store = ScheduleStore(os.environ.get('SCHEDULE_STORE') or os.path.join(DATA_DIR, 'schedules.sqlite3'))
+
+# Longest date range /genera plans in background
+MAX_RANGE_DAYS = 366
+
+# Record collections served a page at a time by /api/<name>: the query
+# parameters filtering on an indexed column, with their type, the date
+# column filtered by dal/al/anno/mese, and the sort order
+API_COLLECTIONS = {
+    'assenze': {'filename': 'assenze.json', 'filters': {'collaboratore_id': int},
+                'dates': 'data', 'order': 'data', 'descending': True},
+    'turnazioni': {'filename': 'turnazioni.json',
+                   'filters': {'collaboratore_id': int, 'giorno_settimana': str, 'anno': int, 'mese': str},
+                   'dates': None, 'order': 'id', 'descending': False},
+    'coperture-fisse': {'filename': 'coperture_fisse.json',
+                        'filters': {'collaboratore_id': int, 'giorno_settimana': str},
+                        'dates': None, 'order': 'id', 'descending': False},
+}
+API_PAGE_SIZE = 50
+API_MAX_PAGE_SIZE = 500
+
+
+def plan_range_job(params, report):
+    '''Job planning every school day from params['dal'] to params['al'], see jobs.py.'''
+    start, end = date.fromisoformat(params['dal']), date.fromisoformat(params['al'])
+    generator = Generator(seed=params.get('seed'), fairness=params.get('equita'))
+    school_days = generator.school_days()
+    report(0, sum(1 for offset in range((end - start).days + 1)
+                  if WEEKDAYS[(start + timedelta(days=offset)).weekday()] in school_days))
+    giorni = []
+    for record in generator.generate_range(start, end):
+        giorni.append({'data': record['data'], 'giorno': record['giorno'], 'sostituzioni': record['sostituzioni']})
+        report(len(giorni))
+    return {'giorni': giorni}
+
+
+# Generations too long for a request; JOBS_MAX_RUNNING caps how many run at once, in all workers.
+# Importing the app starts nothing: every gunicorn worker starts the queue
+# once forked (see gunicorn.conf.py), any other process on its first submit
+job_queue = JobQueue(os.environ.get('JOBS_DB') or os.path.join(DATA_DIR, 'jobs.sqlite3'),
+                     {'intervallo': plan_range_job},
+                     max_running=int(os.environ.get('JOBS_MAX_RUNNING') or 2))
+
+# Set GENERATION_DEBUG_DIR to have every generation's intermediate data dumped there
+debug_sink = DirectoryDebugSink(os.environ['GENERATION_DEBUG_DIR']) if os.environ.get('GENERATION_DEBUG_DIR') else None
+
+@app.before_request
+def start_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def observe_latency(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        # The rule, not the URL, keeps ids out of the labels
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        metrics.REQUEST_SECONDS.observe(time.perf_counter() - started, route=route,
+                                        method=request.method, status=response.status_code)
+    return response
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 def load_json(filename):
-    filepath = os.path.join(DATA_DIR, filename)
-    if os.path.exists(filepath):
-        with open(filepath, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    return [] if filename != 'orari_pomeriggio.json' else {}
+    # Served from the shared cache, parsed again only when the file changes
+    try:
+        return dataset.load(filename, DATA_DIR)
+    except FileNotFoundError:
+        return [] if filename != 'orari_pomeriggio.json' else {}
 
 def save_json(filename, data):
-    filepath = os.path.join(DATA_DIR, filename)
-    with open(filepath, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    dataset.save(filename, data, DATA_DIR)
+
+def insert_json(filename, record):
+    # The storage hands out the id, never reusing one
+    return dataset.insert(filename, record, DATA_DIR)
+
+def update_json(filename, record_id, changes):
+    return dataset.update(filename, record_id, changes, DATA_DIR)
+
+def delete_json(filename, record_id):
+    return dataset.delete(filename, record_id, DATA_DIR)
 
 @app.route('/')
 def index():
@@ -28,23 +121,19 @@ def index():
 @app.route('/luoghi', methods=['GET', 'POST'])
 def luoghi():
     if request.method == 'POST':
-        luoghi_data = load_json('luoghi.json')
-
         nome = request.form.get('nome')
         descrizione = request.form.get('descrizione')
         min_collaboratori = int(request.form.get('min_collaboratori', 1))
         no_cleaning_needed = request.form.get('no_cleaning_needed') == 'on'
 
         luogo = {
-            'id': len(luoghi_data) + 1,
             'nome': nome,
             'descrizione': descrizione,
             'min_collaboratori': min_collaboratori,
             'no_cleaning_needed': no_cleaning_needed
         }
 
-        luoghi_data.append(luogo)
-        save_json('luoghi.json', luoghi_data)
+        insert_json('luoghi.json', luogo)
 
         return redirect(url_for('luoghi'))
 
@@ -53,16 +142,12 @@ def luoghi():
 
 @app.route('/luoghi/elimina/<int:id>', methods=['POST'])
 def elimina_luogo(id):
-    luoghi_data = load_json('luoghi.json')
-    luoghi_data = [l for l in luoghi_data if l['id'] != id]
-    save_json('luoghi.json', luoghi_data)
+    delete_json('luoghi.json', id)
     return redirect(url_for('luoghi'))
 
 @app.route('/collaboratori', methods=['GET', 'POST'])
 def collaboratori():
     if request.method == 'POST':
-        collaboratori_data = load_json('collaboratori.json')
-
         nome = request.form.get('nome')
         cognome = request.form.get('cognome')
         luogo_id = int(request.form.get('luogo_id')) if request.form.get('luogo_id') else None
@@ -85,7 +170,6 @@ def collaboratori():
         no_overtime_allowed = request.form.get('no_overtime_allowed') == 'on'
 
         collaboratore = {
-            'id': len(collaboratori_data) + 1,
             'nome': nome,
             'cognome': cognome,
             'luogo_id': luogo_id,
@@ -97,8 +181,7 @@ def collaboratori():
             'no_overtime_allowed': no_overtime_allowed
         }
 
-        collaboratori_data.append(collaboratore)
-        save_json('collaboratori.json', collaboratori_data)
+        insert_json('collaboratori.json', collaboratore)
 
         return redirect(url_for('collaboratori'))
 
@@ -108,9 +191,7 @@ def collaboratori():
 
 @app.route('/collaboratori/elimina/<int:id>', methods=['POST'])
 def elimina_collaboratore(id):
-    collaboratori_data = load_json('collaboratori.json')
-    collaboratori_data = [c for c in collaboratori_data if c['id'] != id]
-    save_json('collaboratori.json', collaboratori_data)
+    delete_json('collaboratori.json', id)
     return redirect(url_for('collaboratori'))
 
 @app.route('/collaboratori/modifica/<int:id>', methods=['GET', 'POST'])
@@ -124,12 +205,13 @@ def modifica_collaboratore(id):
         return redirect(url_for('collaboratori'))
 
     if request.method == 'POST':
-        # Update collaboratore data
-        collaboratore['nome'] = request.form.get('nome')
-        collaboratore['cognome'] = request.form.get('cognome')
-        collaboratore['luogo_id'] = int(request.form.get('luogo_id')) if request.form.get('luogo_id') else None
-        collaboratore['luogo_secondario_id'] = int(request.form.get('luogo_secondario_id')) if request.form.get('luogo_secondario_id') else None
-        collaboratore['fisso_nel_luogo'] = request.form.get('fisso_nel_luogo') == 'on'
+        # Update collaboratore data; the loaded record is shared, collect the changes apart
+        changes = {}
+        changes['nome'] = request.form.get('nome')
+        changes['cognome'] = request.form.get('cognome')
+        changes['luogo_id'] = int(request.form.get('luogo_id')) if request.form.get('luogo_id') else None
+        changes['luogo_secondario_id'] = int(request.form.get('luogo_secondario_id')) if request.form.get('luogo_secondario_id') else None
+        changes['fisso_nel_luogo'] = request.form.get('fisso_nel_luogo') == 'on'
 
         # Update orari settimanali
         orari_settimanali = {}
@@ -142,14 +224,14 @@ def modifica_collaboratore(id):
                     'inizio': inizio,
                     'fine': fine
                 }
-        collaboratore['orari_settimanali'] = orari_settimanali
+        changes['orari_settimanali'] = orari_settimanali
 
         # Update new fields
-        collaboratore['ultima_sostituzione'] = request.form.get('ultima_sostituzione') or None
-        collaboratore['straordinari_svolti'] = int(request.form.get('straordinari_svolti', 0))
-        collaboratore['no_overtime_allowed'] = request.form.get('no_overtime_allowed') == 'on'
+        changes['ultima_sostituzione'] = request.form.get('ultima_sostituzione') or None
+        changes['straordinari_svolti'] = int(request.form.get('straordinari_svolti', 0))
+        changes['no_overtime_allowed'] = request.form.get('no_overtime_allowed') == 'on'
 
-        save_json('collaboratori.json', collaboratori_data)
+        update_json('collaboratori.json', id, changes)
         return redirect(url_for('collaboratori'))
 
     return render_template('modifica_collaboratore.html', collaboratore=collaboratore, luoghi=luoghi_data)
@@ -157,34 +239,28 @@ def modifica_collaboratore(id):
 @app.route('/coperture-fisse', methods=['GET', 'POST'])
 def coperture_fisse():
     if request.method == 'POST':
-        coperture_data = load_json('coperture_fisse.json')
-
         collaboratore_id = int(request.form.get('collaboratore_id'))
         giorno_settimana = request.form.get('giorno_settimana')
         luogo_coperto_id = int(request.form.get('luogo_coperto_id'))
 
         copertura = {
-            'id': len(coperture_data) + 1,
             'collaboratore_id': collaboratore_id,
             'giorno_settimana': giorno_settimana,
             'luogo_coperto_id': luogo_coperto_id
         }
 
-        coperture_data.append(copertura)
-        save_json('coperture_fisse.json', coperture_data)
+        insert_json('coperture_fisse.json', copertura)
 
         return redirect(url_for('coperture_fisse'))
 
-    coperture_data = load_json('coperture_fisse.json')
+    # The list itself is loaded a page at a time from /api/coperture-fisse
     collaboratori_data = load_json('collaboratori.json')
     luoghi_data = load_json('luoghi.json')
-    return render_template('coperture_fisse.html', coperture=coperture_data, collaboratori=collaboratori_data, luoghi=luoghi_data)
+    return render_template('coperture_fisse.html', collaboratori=collaboratori_data, luoghi=luoghi_data)
 
 @app.route('/coperture-fisse/elimina/<int:id>', methods=['POST'])
 def elimina_copertura(id):
-    coperture_data = load_json('coperture_fisse.json')
-    coperture_data = [c for c in coperture_data if c['id'] != id]
-    save_json('coperture_fisse.json', coperture_data)
+    delete_json('coperture_fisse.json', id)
     return redirect(url_for('coperture_fisse'))
 
 @app.route('/orari-pomeriggio', methods=['GET', 'POST'])
@@ -214,8 +290,6 @@ def orari_pomeriggio():
 @app.route('/turnazioni', methods=['GET', 'POST'])
 def turnazioni():
     if request.method == 'POST':
-        turnazioni_data = load_json('turnazioni.json')
-
         collaboratore_id = int(request.form.get('collaboratore_id'))
         giorno_settimana = request.form.get('giorno_settimana')
         mese = request.form.get('mese')
@@ -224,7 +298,6 @@ def turnazioni():
         ora_ingresso_alternativa = request.form.get('ora_ingresso_alternativa') if fa_pomeriggio else None
 
         turnazione = {
-            'id': len(turnazioni_data) + 1,
             'collaboratore_id': collaboratore_id,
             'giorno_settimana': giorno_settimana,
             'mese': mese,
@@ -233,27 +306,22 @@ def turnazioni():
             'ora_ingresso_alternativa': ora_ingresso_alternativa
         }
 
-        turnazioni_data.append(turnazione)
-        save_json('turnazioni.json', turnazioni_data)
+        insert_json('turnazioni.json', turnazione)
 
         return redirect(url_for('turnazioni'))
 
-    turnazioni_data = load_json('turnazioni.json')
+    # The list itself is loaded a page at a time from /api/turnazioni
     collaboratori_data = load_json('collaboratori.json')
-    return render_template('turnazioni.html', turnazioni=turnazioni_data, collaboratori=collaboratori_data)
+    return render_template('turnazioni.html', collaboratori=collaboratori_data)
 
 @app.route('/turnazioni/elimina/<int:id>', methods=['POST'])
 def elimina_turnazione(id):
-    turnazioni_data = load_json('turnazioni.json')
-    turnazioni_data = [t for t in turnazioni_data if t['id'] != id]
-    save_json('turnazioni.json', turnazioni_data)
+    delete_json('turnazioni.json', id)
     return redirect(url_for('turnazioni'))
 
 @app.route('/assenze', methods=['GET', 'POST'])
 def assenze():
     if request.method == 'POST':
-        assenze_data = load_json('assenze.json')
-
         collaboratore_id = int(request.form.get('collaboratore_id'))
         data = request.form.get('data')
         tutto_giorno = request.form.get('tutto_giorno') == 'on'
@@ -261,7 +329,6 @@ def assenze():
         ora_fine = request.form.get('ora_fine') if not tutto_giorno else None
 
         assenza = {
-            'id': len(assenze_data) + 1,
             'collaboratore_id': collaboratore_id,
             'data': data,
             'tutto_giorno': tutto_giorno,
@@ -269,20 +336,17 @@ def assenze():
             'ora_fine': ora_fine
         }
 
-        assenze_data.append(assenza)
-        save_json('assenze.json', assenze_data)
+        insert_json('assenze.json', assenza)
 
         return redirect(url_for('assenze'))
 
-    assenze_data = load_json('assenze.json')
+    # The list itself is loaded a page at a time from /api/assenze
     collaboratori_data = load_json('collaboratori.json')
-    return render_template('assenze.html', assenze=assenze_data, collaboratori=collaboratori_data)
+    return render_template('assenze.html', collaboratori=collaboratori_data)
 
 @app.route('/assenze/elimina/<int:id>', methods=['POST'])
 def elimina_assenza(id):
-    assenze_data = load_json('assenze.json')
-    assenze_data = [a for a in assenze_data if a['id'] != id]
-    save_json('assenze.json', assenze_data)
+    delete_json('assenze.json', id)
     return redirect(url_for('assenze'))
 
 @app.route('/genera', methods=['GET', 'POST'])
@@ -301,82 +365,283 @@ def genera():
         giorni_settimana = ['lunedi', 'martedi', 'mercoledi', 'giovedi', 'venerdi', 'sabato', 'domenica']
         weekday = giorni_settimana[data.weekday()]
 
-        generator = Generator()
-        sostituzioni = generator.generate(
-            day=day,
-            month=month,
-            year=year,
-            weekday=weekday
-        )
-
-        # Store the schedule data in session for the "Ufficializza" action
-        # Read the schedule from the JSON file that was just written
-        with open('final_schedule_after_substitutions.json', 'r') as f:
-            schedule = json.load(f)
-
-        session['last_schedule'] = schedule
-        session['last_date'] = data_str
-
-        return render_template('genera.html', sostituzioni=sostituzioni, generato=True)
+        seed_str = (request.form.get('seed') or '').strip()
+        try:
+            seed = int(seed_str) if seed_str else DEFAULT_SEED
+        except ValueError:
+            return render_template('genera.html', sostituzioni=None, generato=False,
+                                   errore=f"Seed non valido: {seed_str}")
+
+        # Optional decision trace, shown under the result
+        trace_level = LEVELS.get(request.form.get('traccia') or '')
+
+        # Optional window of the ledger to rank candidates by their recent load
+        fairness = request.form.get('equita') or None
+        if fairness is not None and fairness not in WINDOWS:
+            return render_template('genera.html', sostituzioni=None, generato=False,
+                                   errore=f"Finestra di equità non valida: {fairness}")
+
+        # With a final date, plan the whole range in background
+        fine_str = request.form.get('al')
+        if fine_str and fine_str != data_str:
+            fine = datetime.strptime(fine_str, '%Y-%m-%d')
+            if not 0 < (fine - data).days < MAX_RANGE_DAYS:
+                return render_template('genera.html', sostituzioni=None, generato=False,
+                                       errore=f"La data finale deve seguire quella iniziale di al massimo {MAX_RANGE_DAYS - 1} giorni")
+            job_queue.start()
+            job_id = job_queue.submit('intervallo', {'dal': data_str, 'al': fine_str, 'seed': seed, 'equita': fairness})
+            return redirect(url_for('elaborazione', job_id=job_id))
+
+        def generate():
+            trace = DecisionTrace(trace_level) if trace_level is not None else None
+            generator = Generator(debug_sink=debug_sink, seed=seed, trace=trace, fairness=fairness)
+            result = generator.generate(
+                day=day,
+                month=month,
+                year=year,
+                weekday=weekday
+            )
+            # JSON keys are strings: the cached schedule looks like the stored one
+            schedule = {str(key): value for key, value in result.schedule.to_dict().items()}
+            return schedule, result.substitutions_text, trace.events() if trace is not None else None
+
+        # An unchanged dataset gives the same result for the same date and seed
+        key = cache_key(data_str, seed, data_version(day=data_str), fairness=fairness)
+        if trace_level is None:
+            schedule, sostituzioni, _ = generation_cache.get_or_compute(key, generate)
+            eventi = None
+        else:
+            # Only an actual generation records a trace
+            schedule, sostituzioni, eventi = generate()
+            generation_cache.put(key, (schedule, sostituzioni, None))
+
+        # Keep the schedule for the "Ufficializza" action, the session only gets its id
+        session['last_schedule_id'] = schedule_store.put({'schedule': schedule, 'date': data_str})
+
+        return render_template('genera.html', sostituzioni=sostituzioni, generato=True, seed=seed, eventi=eventi)
 
     return render_template('genera.html', sostituzioni=None, generato=False)
 
+@app.route('/elaborazioni/<job_id>')
+def elaborazione(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        abort(404)
+    return render_template('elaborazione.html', job=job, finito=job['status'] in FINISHED)
+
+@app.route('/elaborazioni/<job_id>/stato')
+def stato_elaborazione(job_id):
+    job = job_queue.get(job_id, with_result=request.args.get('risultato') == '1')
+    if job is None:
+        return jsonify({'success': False, 'message': 'Elaborazione inesistente'}), 404
+    return jsonify(job)
+
+@app.route('/elaborazioni/<job_id>/eventi')
+def eventi_elaborazione(job_id):
+    '''Server-Sent Events with the state of a job, one per change, until it finishes.'''
+    def stream():
+        last = None
+        idle = 0.0
+        while True:
+            job = job_queue.get(job_id, with_result=False)
+            if job is None:
+                return
+            state = (job['status'], job['fatti'], job['totale'], job['annullamento'])
+            if state != last:
+                yield f"data: {json.dumps(job)}\n\n"
+                last, idle = state, 0.0
+            elif idle >= 15:
+                # Keeps proxies from closing a quiet connection
+                yield ": attesa\n\n"
+                idle = 0.0
+            if job['status'] in FINISHED:
+                return
+            time.sleep(0.5)
+            idle += 0.5
+
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/elaborazioni/<job_id>/annulla', methods=['POST'])
+def annulla_elaborazione(job_id):
+    if not job_queue.cancel(job_id):
+        return jsonify({'success': False, 'message': 'Elaborazione già conclusa o inesistente'}), 400
+    return jsonify({'success': True, 'message': 'Annullamento richiesto'})
+
+def encode_cursor(after):
+    return base64.urlsafe_b64encode(json.dumps(after).encode('utf-8')).decode('ascii') if after else None
+
+def decode_cursor(token):
+    try:
+        return json.loads(base64.urlsafe_b64decode(token.encode('ascii')))
+    except ValueError:
+        raise ValueError("Cursore non valido") from None
+
+def api_period(args):
+    '''(first, last) ISO day asked by dal/al and anno (with an optional mese 1-12), None when open.'''
+    first = date.fromisoformat(args['dal']) if args.get('dal') else None
+    last = date.fromisoformat(args['al']) if args.get('al') else None
+    if args.get('anno'):
+        year, month = int(args['anno']), int(args['mese']) if args.get('mese') else None
+        if month is None:
+            start, end = date(year, 1, 1), date(year, 12, 31)
+        else:
+            start = date(year, month, 1)
+            end = date(year + month // 12, month % 12 + 1, 1) - timedelta(days=1)
+        first, last = max(first or start, start), min(last or end, end)
+    return (first.isoformat() if first else None), (last.isoformat() if last else None)
+
+@app.route('/api/<collezione>')
+def api_elenco(collezione):
+    '''
+    One page of a record collection as JSON: {'elementi': [...], 'cursore':
+    token for the next page, or null}. Filters on the indexed columns only,
+    never reads the whole collection; the ETag is the revision of the
+    collection, so an unchanged page costs a 304.
+    '''
+    spec = API_COLLECTIONS.get(collezione)
+    if spec is None:
+        abort(404)
+    filename = spec['filename']
+    # Not fingerprint(): that would read every partition of assenze
+    version = hashlib.sha256(dataset.revision(filename, DATA_DIR).encode('utf-8')).hexdigest()[:32]
+    modified = datetime.fromtimestamp(int(dataset.modified(filename, DATA_DIR)), timezone.utc)
+    if not is_resource_modified(request.environ, etag=version, last_modified=modified):
+        response = app.response_class(status=304)
+    else:
+        try:
+            where = {name: kind(request.args[name]) for name, kind in spec['filters'].items()
+                     if request.args.get(name)}
+            between = (spec['dates'],) + api_period(request.args) if spec['dates'] else None
+            after = decode_cursor(request.args['cursore']) if request.args.get('cursore') else None
+            limit = min(max(int(request.args.get('limite') or API_PAGE_SIZE), 1), API_MAX_PAGE_SIZE)
+            elementi, after = dataset.query(filename, where=where, between=between, order=spec['order'],
+                                            descending=spec['descending'], after=after, limit=limit,
+                                            data_dir=DATA_DIR)
+        except ValueError as e:
+            return jsonify({'success': False, 'message': f"Richiesta non valida: {e}"}), 400
+        response = jsonify({'elementi': elementi, 'cursore': encode_cursor(after)})
+    response.set_etag(version)
+    response.last_modified = modified
+    # Cached by the browser, but checked again every time
+    response.cache_control.no_cache = True
+    return response
+
 @app.route('/ufficializza', methods=['POST'])
 def ufficializza():
-    # Get the schedule from session
-    schedule = session.get('last_schedule')
-    date_str = session.get('last_date')
-
-    if not schedule or not date_str:
-        return jsonify({'success': False, 'message': 'Nessuna sostituzione da ufficializzare'}), 400
-
-    # Load collaboratori data
-    collaboratori_data = load_json('collaboratori.json')
-
-    # Create a map of collaboratore_id to collaboratore for easy lookup
-    collab_map = {c['id']: c for c in collaboratori_data}
-
-    # Track all collaborators who did substitutions
-    substitute_ids = set()
-
-    # Process location-based substitutes
-    for luogo_id, collaboratori in schedule.items():
-        if luogo_id in ['afternoon_subs', 'cleaning_overtime']:
-            continue
-
-        for collaboratore in collaboratori:
-            if collaboratore.get('is_substitute', False):
-                substitute_ids.add(collaboratore['collaboratore_id'])
-
-    # Process afternoon substitutes
-    if 'afternoon_subs' in schedule:
-        for collaboratore in schedule['afternoon_subs']:
-            substitute_ids.add(collaboratore['collaboratore_id'])
+    # Take the schedule whose id is in the session, at most once
+    schedule_id = session.get('last_schedule_id')
+    stored = schedule_store.take(schedule_id)
+
+    if stored is None:
+        message = 'Nessuna sostituzione da ufficializzare'
+        if schedule_id:
+            message = 'Le sostituzioni generate sono scadute: generale di nuovo'
+        return jsonify({'success': False, 'message': message}), 400
+    schedule, date_str = stored['schedule'], stored['date']
+
+    # Other workers must not change collaboratori between reading and writing them back
+    with dataset.locked(DATA_DIR):
+        # Load collaboratori data
+        collaboratori_data = load_json('collaboratori.json')
 
-    # Update ultima_sostituzione for all substitutes
-    for collab_id in substitute_ids:
-        if collab_id in collab_map:
-            collab_map[collab_id]['ultima_sostituzione'] = date_str
+        # Copies of the records, the loaded ones are shared through the dataset cache
+        collab_map = {c['id']: dict(c) for c in collaboratori_data}
+        official = Schedule.from_dict(schedule)
 
-    # Process cleaning overtime assignments
-    if 'cleaning_overtime' in schedule:
-        for cleaning in schedule['cleaning_overtime']:
-            collab_id = cleaning['collaboratore_id']
-            overtime_minutes = cleaning['overtime_minutes']
+        # Append the day to the ledger, with the values it replaces, so it can be undone
+        commit_id = new_commit_id()
+        dataset.insert_many(LEDGER_FILENAME, entries_for(official, date_str, collab_map, commit_id), DATA_DIR)
 
-            if collab_id in collab_map:
-                current_overtime = collab_map[collab_id].get('straordinari_svolti', 0)
-                collab_map[collab_id]['straordinari_svolti'] = current_overtime + overtime_minutes
+        # The store holds the JSON form of the schedule; update ultima_sostituzione
+        # of the substitutes and straordinari_svolti of whoever does cleaning overtime
+        apply_official_schedule(collab_map, official, date_str)
 
-    # Save the updated collaboratori data
-    save_json('collaboratori.json', collaboratori_data)
+        # Write back only the records that changed
+        for collaboratore in collaboratori_data:
+            updated = collab_map[collaboratore['id']]
+            changes = {key: value for key, value in updated.items() if collaboratore.get(key) != value}
+            if changes:
+                update_json('collaboratori.json', collaboratore['id'], changes)
 
     # Clear the session data
-    session.pop('last_schedule', None)
-    session.pop('last_date', None)
+    session.pop('last_schedule_id', None)
 
-    return jsonify({'success': True, 'message': 'Sostituzioni ufficializzate con successo!'})
+    return jsonify({'success': True, 'message': 'Sostituzioni ufficializzate con successo!',
+                    'ufficializzazione': commit_id})
+
+@app.route('/storico')
+def storico():
+    storico_data = load_json(LEDGER_FILENAME)
+    collaboratori_data = load_json('collaboratori.json')
+    luoghi_data = load_json('luoghi.json')
 
+    # One row per official schedule, the latest first
+    ufficializzazioni = {}
+    for entry in storico_data:
+        row = ufficializzazioni.setdefault(entry['ufficializzazione'], {
+            'id': entry['ufficializzazione'], 'data': entry['data'], 'sostituzioni': [], 'straordinari': []
+        })
+        row['sostituzioni' if entry['tipo'] == 'sostituzione' else 'straordinari'].append(entry)
+
+    # Load of everybody in the fairness windows ending today
+    ledger = shared_ledger(storico_data, DATA_DIR)
+    today = datetime.now().date()
+    carichi = {name: ledger.loads(*window(name, today)) for name in WINDOWS}
+
+    return render_template('storico.html', ufficializzazioni=sorted(ufficializzazioni.values(), key=lambda row: row['data'], reverse=True),
+                           carichi=carichi, collaboratori=collaboratori_data, luoghi=luoghi_data)
+
+@app.route('/storico/annulla/<commit_id>', methods=['POST'])
+def annulla_ufficializzazione(commit_id):
+    with dataset.locked(DATA_DIR):
+        storico_data = load_json(LEDGER_FILENAME)
+        undone = [entry for entry in storico_data if entry['ufficializzazione'] == commit_id]
+        remaining = [entry for entry in storico_data if entry['ufficializzazione'] != commit_id]
+        collab_map = {c['id']: c for c in load_json('collaboratori.json')}
+
+        # Put back ultima_sostituzione and straordinari_svolti, then drop the entries
+        for collab_id, changes in undo_changes(undone, remaining, collab_map).items():
+            update_json('collaboratori.json', collab_id, changes)
+        for entry in undone:
+            delete_json(LEDGER_FILENAME, entry['id'])
+
+    return redirect(url_for('storico'))
+
+@app.route('/importa', methods=['GET', 'POST'])
+def importa():
+    if request.method == 'GET':
+        return render_template('importa.html', anno=default_school_year())
+
+    # A form upload, or the CSV itself as the body for scripts, whatever its
+    # content type. Only touch request.files and request.values for a form:
+    # parsing them consumes the body
+    if request.mimetype == 'multipart/form-data':
+        upload = request.files.get('file')
+        params = request.values
+        if upload is None:
+            return render_template('importa.html', anno=default_school_year(),
+                                   errore="Importazione non riuscita: nessun file caricato"), 400
+        raw = upload.stream
+    else:
+        upload = None
+        params = request.args
+        raw = request.stream
+
+    prova = 'prova' in params
+    try:
+        anno = int(params.get('anno') or default_school_year())
+        # Read a line at a time as it arrives
+        report = import_roster(raw, anno=anno, data_dir=DATA_DIR, dry_run=prova)
+    except ValueError as e:
+        if upload is None:
+            return jsonify({'success': False, 'message': f"Importazione non riuscita: {e}"}), 400
+        return render_template('importa.html', anno=default_school_year(),
+                               errore=f"Importazione non riuscita: {e}"), 400
+    if upload is None:
+        return jsonify(dict(report, success=True))
+    return render_template('importa.html', anno=anno, report=report, prova=prova)
 
 if __name__ == '__main__':
+    job_queue.start()
     app.run(debug=True)
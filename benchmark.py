@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+"""
+Scaling benchmark of the Generator on synthetic data.
+
+Builds a seeded synthetic dataset for every size (collaboratori:luoghi),
+with years of assenze history and turnazioni for the whole year, writes it
+to a temporary data directory and times each phase of a generation
+separately:
+
+- init_cold: Generator() with the dataset cache empty (parsing + indexes)
+- init_warm: Generator() with the files already cached
+- populate_absences
+- generate_schedule (populate_absences included)
+- assign_cleaning_overtime
+- render: parse_substitutions_only
+
+The best of --repeat runs is kept. The results go to a JSON report; given a
+previous report with --compare, the phases that got slower are flagged, and
+the growth exponent of every phase against the number of collaboratori
+between the two largest sizes (about 1 for linear, 2 for quadratic) shows
+where the scaling curve bends.
+
+Usage:
+    python benchmark.py
+    python benchmark.py --sizes 10:5,1000:100,10000:500 --years 3 --output bench.json
+    python benchmark.py --output new.json --compare old.json
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time as timer
+from datetime import date, datetime, timedelta
+
+import dataset as dataset_cache
+from generator import SOLVERS, Generator
+
+GIORNI = ['lunedi', 'martedi', 'mercoledi', 'giovedi', 'venerdi', 'sabato', 'domenica']
+MESI = ['gennaio', 'febbraio', 'marzo', 'aprile', 'maggio', 'giugno',
+        'luglio', 'agosto', 'settembre', 'ottobre', 'novembre', 'dicembre']
+
+BENCHMARK_DATE = date(2026, 1, 13)
+
+# collaboratori:luoghi pairs of the default run
+DEFAULT_SIZES = "10:5,100:20,1000:100,5000:300,10000:500"
+
+PHASES = ('init_cold', 'init_warm', 'populate_absences', 'generate_schedule', 'assign_cleaning_overtime', 'render')
+
+# Bumped when the report layout changes
+REPORT_VERSION = 1
+
+
+def build_dataset(num_collaboratori, num_luoghi, target_date=BENCHMARK_DATE, absence_rate=0.03, seed=0,
+                  history_years=1, full_year_turnazioni=False):
+    """
+    Build a synthetic dataset with the same shape as the files in data/.
+
+    Assenze fall one day a week over history_years years up to target_date.
+    Turnazioni cover the month of target_date, or every month of its year
+    with full_year_turnazioni.
+    """
+    rng = random.Random(seed)
+
+    luoghi = []
+    for luogo_id in range(1, num_luoghi + 1):
+        luoghi.append({
+            'id': luogo_id,
+            'nome': f"Luogo {luogo_id}",
+            'descrizione': "",
+            'min_collaboratori': rng.randint(1, 2),
+            'no_cleaning_needed': rng.random() < 0.1
+        })
+
+    collaboratori = []
+    for collab_id in range(1, num_collaboratori + 1):
+        if rng.random() < 0.15:
+            inizio, fine = "10:48", "18:00"
+        else:
+            inizio, fine = "07:54", "14:57"
+        orari = {giorno: {'inizio': inizio, 'fine': fine} for giorno in GIORNI[:5]}
+        ultima = None
+        if rng.random() < 0.7:
+            ultima = (target_date - timedelta(days=rng.randint(1, 365))).isoformat()
+        collaboratori.append({
+            'id': collab_id,
+            'nome': f"Nome{collab_id}",
+            'cognome': f"Cognome{collab_id}",
+            'fisso_nel_luogo': False,
+            'orari_settimanali': orari,
+            'luogo_id': (collab_id - 1) % num_luoghi + 1,
+            'luogo_secondario_id': rng.randint(1, num_luoghi) if rng.random() < 0.2 else None,
+            'ultima_sostituzione': ultima,
+            'straordinari_svolti': rng.randint(0, 10) * 20,
+            'no_overtime_allowed': rng.random() < 0.1
+        })
+
+    # Years of absence history plus the absences on the benchmark date
+    assenze = []
+    for offset in range(0, 365 * history_years, 7):
+        giorno = target_date - timedelta(days=offset)
+        for collab_id in rng.sample(range(1, num_collaboratori + 1), int(num_collaboratori * absence_rate)):
+            assenze.append({
+                'id': len(assenze) + 1,
+                'collaboratore_id': collab_id,
+                'data': giorno.isoformat(),
+                'tutto_giorno': True,
+                'ora_inizio': None,
+                'ora_fine': None
+            })
+
+    # Turnazioni only fall on the days with an afternoon shift
+    turnazioni = []
+    mesi = MESI if full_year_turnazioni else [MESI[target_date.month - 1]]
+    for collab_id in rng.sample(range(1, num_collaboratori + 1), max(1, num_collaboratori // 50)):
+        giorno = rng.choice(['martedi', 'venerdi'])
+        for mese in mesi:
+            turnazioni.append({
+                'id': len(turnazioni) + 1,
+                'collaboratore_id': collab_id,
+                'giorno_settimana': giorno,
+                'mese': mese,
+                'anno': target_date.year,
+                'fa_pomeriggio': True,
+                'ora_ingresso_alternativa': "10:48"
+            })
+
+    coperture_fisse = []
+    for collab_id in rng.sample(range(1, num_collaboratori + 1), max(1, num_collaboratori // 100)):
+        coperture_fisse.append({
+            'id': len(coperture_fisse) + 1,
+            'collaboratore_id': collab_id,
+            'giorno_settimana': rng.choice(GIORNI[:5]),
+            'luogo_coperto_id': rng.randint(1, num_luoghi)
+        })
+
+    orari_pomeriggio = {
+        'martedi': {'attivo': True, 'ora_fine': "18:00", 'num_collaboratori': max(2, num_collaboratori // 20)},
+        'venerdi': {'attivo': True, 'ora_fine': "18:00", 'num_collaboratori': max(4, num_collaboratori // 10)}
+    }
+
+    return {
+        'assenze': assenze,
+        'turnazioni': turnazioni,
+        'coperture_fisse': coperture_fisse,
+        'collaboratori': collaboratori,
+        'luoghi': luoghi,
+        'orari_pomeriggio': orari_pomeriggio,
+        'sub_order': [luogo['id'] for luogo in luoghi],
+    }
+
+
+def write_dataset(dataset, directory):
+    """Write a dataset built by build_dataset() as the JSON files Generator expects."""
+    for name, data in dataset.items():
+        with open(os.path.join(directory, f"{name}.json"), 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+
+
+def time_generate(num_collaboratori, num_luoghi, target_date=BENCHMARK_DATE, repeat=3, solver='greedy'):
+    """Return the best wall time in seconds of Generator() + generate() over `repeat` runs."""
+    with tempfile.TemporaryDirectory() as directory:
+        write_dataset(build_dataset(num_collaboratori, num_luoghi, target_date), directory)
+        best = None
+        for _ in range(repeat):
+            start = timer.perf_counter()
+            generator = Generator(data_dir=directory, solver=solver)
+            generator.generate(target_date.day, target_date.month, target_date.year,
+                               GIORNI[target_date.weekday()])
+            elapsed = timer.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best
+
+
+def time_phases(directory, target_date=BENCHMARK_DATE, repeat=3, solver='greedy'):
+    """Return {phase: best wall time in seconds} for the dataset in `directory`, see PHASES."""
+    day, month, year = target_date.day, target_date.month, target_date.year
+    weekday = GIORNI[target_date.weekday()]
+    best = {}
+
+    def keep(phase, started):
+        elapsed = timer.perf_counter() - started
+        best[phase] = min(best.get(phase, elapsed), elapsed)
+
+    for _ in range(repeat):
+        dataset_cache.clear()
+        started = timer.perf_counter()
+        Generator(data_dir=directory, solver=solver, seed=0)
+        keep('init_cold', started)
+
+        started = timer.perf_counter()
+        generator = Generator(data_dir=directory, solver=solver, seed=0)
+        keep('init_warm', started)
+
+        started = timer.perf_counter()
+        generator.populate_absences(day, month, year, weekday)
+        keep('populate_absences', started)
+
+        started = timer.perf_counter()
+        schedule = generator.generate_schedule(day, month, year, weekday)
+        keep('generate_schedule', started)
+
+        started = timer.perf_counter()
+        schedule = generator.assign_cleaning_overtime(schedule, weekday)
+        keep('assign_cleaning_overtime', started)
+
+        started = timer.perf_counter()
+        generator.parse_substitutions_only(schedule)
+        keep('render', started)
+    return best
+
+
+def run_suite(sizes, target_date=BENCHMARK_DATE, history_years=1, repeat=3, solver='greedy', seed=0):
+    """Time every phase at every (collaboratori, luoghi) size and return the report as a dict."""
+    results = []
+    for num_collaboratori, num_luoghi in sizes:
+        data = build_dataset(num_collaboratori, num_luoghi, target_date, seed=seed,
+                             history_years=history_years, full_year_turnazioni=True)
+        with tempfile.TemporaryDirectory() as directory:
+            write_dataset(data, directory)
+            phases = time_phases(directory, target_date, repeat=repeat, solver=solver)
+        # Do not keep the big datasets alive in the cache between sizes
+        dataset_cache.clear()
+        results.append({
+            'collaboratori': num_collaboratori,
+            'luoghi': num_luoghi,
+            'assenze': len(data['assenze']),
+            'turnazioni': len(data['turnazioni']),
+            'seconds': {phase: round(phases[phase], 6) for phase in PHASES},
+        })
+
+    return {
+        'version': REPORT_VERSION,
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'params': {
+            'date': target_date.isoformat(),
+            'history_years': history_years,
+            'repeat': repeat,
+            'solver': solver,
+            'seed': seed,
+        },
+        'results': results,
+        'scaling': scaling_exponents(results),
+    }
+
+
+def scaling_exponents(results):
+    """
+    {phase: slope of log(time) against log(collaboratori)} between the two
+    largest sizes, where fixed costs no longer hide the growth: about 1 when
+    a phase grows linearly, about 2 when it grows quadratically. None with
+    less than two sizes.
+    """
+    sized = sorted(results, key=lambda result: result['collaboratori'])
+    if len(sized) < 2 or sized[-2]['collaboratori'] == sized[-1]['collaboratori']:
+        return {phase: None for phase in PHASES}
+    first, last = sized[-2], sized[-1]
+    exponents = {}
+    for phase in PHASES:
+        low, high = first['seconds'][phase], last['seconds'][phase]
+        if low <= 0 or high <= 0:
+            exponents[phase] = None
+        else:
+            exponents[phase] = round(math.log(high / low) / math.log(last['collaboratori'] / first['collaboratori']), 2)
+    return exponents
+
+
+def compare_reports(old, new, tolerance=0.25, min_seconds=0.001):
+    """
+    Rows (collaboratori, luoghi, phase, old seconds, new seconds, ratio,
+    regression) for the sizes present in both reports. A phase regressed
+    when it got more than `tolerance` slower and at least min_seconds.
+    """
+    old_by_size = {(r['collaboratori'], r['luoghi']): r for r in old['results']}
+    rows = []
+    for result in new['results']:
+        previous = old_by_size.get((result['collaboratori'], result['luoghi']))
+        if previous is None:
+            continue
+        for phase in PHASES:
+            before = previous['seconds'].get(phase)
+            after = result['seconds'][phase]
+            if before is None:
+                continue
+            ratio = after / before if before > 0 else float('inf')
+            regression = ratio > 1 + tolerance and after - before >= min_seconds
+            rows.append((result['collaboratori'], result['luoghi'], phase, before, after, ratio, regression))
+    return rows
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _parse_sizes(text):
+    sizes = []
+    for item in text.split(','):
+        num_collaboratori, _, num_luoghi = item.partition(':')
+        sizes.append((int(num_collaboratori), int(num_luoghi or max(1, int(num_collaboratori) // 20))))
+    return sizes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time every phase of the Generator on synthetic data of growing size")
+    parser.add_argument('--sizes', default=DEFAULT_SIZES,
+                        help="comma separated collaboratori:luoghi pairs (luoghi defaults to collaboratori/20)")
+    parser.add_argument('--years', type=int, default=2, help="years of assenze history")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per size, the best one is kept")
+    parser.add_argument('--solver', choices=SOLVERS, default='greedy', help="how substitutes are picked")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the synthetic data")
+    parser.add_argument('--output', help="write the JSON report to this file")
+    parser.add_argument('--compare', help="previous JSON report to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="slowdown ratio above which a phase is flagged (0.25 = 25%%)")
+    args = parser.parse_args()
+
+    report = run_suite(_parse_sizes(args.sizes), history_years=args.years, repeat=args.repeat,
+                       solver=args.solver, seed=args.seed)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+    print(f"{'collaboratori':>13} {'luoghi':>6} {'assenze':>8} " + " ".join(f"{phase:>24}" for phase in PHASES))
+    for result in report['results']:
+        print(f"{result['collaboratori']:>13} {result['luoghi']:>6} {result['assenze']:>8} "
+              + " ".join(f"{result['seconds'][phase] * 1000:>21.2f} ms" for phase in PHASES))
+    print()
+    print("Esponente di crescita (1 = lineare, 2 = quadratico):")
+    for phase, exponent in report['scaling'].items():
+        print(f"  {phase:<26} {'-' if exponent is None else exponent}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            old = json.load(f)
+        rows = compare_reports(old, report, tolerance=args.tolerance)
+        print()
+        print(f"Confronto con {args.compare} (commit {old.get('commit') or '?'}):")
+        regressions = 0
+        for num_collaboratori, num_luoghi, phase, before, after, ratio, regression in rows:
+            flag = "  PEGGIORATO" if regression else ""
+            regressions += regression
+            print(f"  {num_collaboratori:>6}:{num_luoghi:<4} {phase:<26} {before * 1000:>10.2f} -> {after * 1000:>10.2f} ms "
+                  f"x{ratio:.2f}{flag}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+'''
+Process-wide access to the dataset, whatever stores it.
+
+The Flask routes and Generator both read the dataset through load(), which
+parses a collection only when it changed since the last read, and write it
+through insert(), update() and delete() (or save() for whole documents).
+The storage of every data directory is picked the first time it is used:
+
+- the SQLite database data/dataset.sqlite3 if it exists (see storage.py
+  and `python storage.py migrate`),
+- otherwise the JSON files data/*.json.
+
+The DATASET_BACKEND environment variable ('json' or 'sqlite') forces one.
+
+The returned objects are shared by every caller: treat them as read-only,
+and write changes back through this module. Every write is atomic and safe
+across the threads and processes (gunicorn workers) of the app; wrap a
+read-modify-write in `with locked():`.
+
+Every cached collection also carries a digest of its content;
+fingerprint() combines them into a version of a set of collections that
+only changes when their content does, usable as a cache key across
+processes and restarts.
+
+The collections that grow every day (storage.PARTITIONED: assenze) can
+also be read one month at a time, load(partition_filename('assenze.json',
+'2026-01')): only that month is read and cached.
+'''
+
+import hashlib
+import os
+import threading
+
+from storage import DATABASE_FILENAME, JsonStorage, SQLiteStorage, month_of, partition_filename
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(BASE_DIR, 'data')
+
+BACKENDS = ('json', 'sqlite')
+
+_lock = threading.Lock()
+# absolute data directory -> storage backend
+_storages = {}
+# Bumped every time the cached content of any collection changes
+_version = 0
+
+
+def _changed():
+    global _version
+    _version += 1
+
+
+def storage(data_dir=None):
+    '''The storage backend of a data directory.'''
+    data_dir = os.path.abspath(data_dir or DATA_DIR)
+    with _lock:
+        backend = _storages.get(data_dir)
+        if backend is None:
+            database = os.path.join(data_dir, DATABASE_FILENAME)
+            kind = os.environ.get('DATASET_BACKEND') or ('sqlite' if os.path.exists(database) else 'json')
+            if kind not in BACKENDS:
+                raise ValueError(f"DATASET_BACKEND sconosciuto: {kind} (disponibili: {', '.join(BACKENDS)})")
+            if kind == 'sqlite':
+                backend = SQLiteStorage(database, on_change=_changed)
+            else:
+                backend = JsonStorage(data_dir, on_change=_changed)
+            _storages[data_dir] = backend
+        return backend
+
+
+def load(filename, data_dir=None):
+    '''
+    Return the content of a collection, reading it only if it changed.
+
+    Raises FileNotFoundError if the collection does not exist and
+    json.JSONDecodeError if its file does not hold valid JSON.
+    '''
+    return storage(data_dir).load(filename)
+
+
+def save(filename, data, data_dir=None):
+    '''Replace a whole collection and make `data` the cached content for it.'''
+    storage(data_dir).save(filename, data)
+
+
+def insert(filename, record, data_dir=None):
+    '''Add a record and return it with its new id, never used before in the collection.'''
+    return storage(data_dir).insert(filename, record)
+
+
+def insert_many(filename, records, data_dir=None):
+    '''Add several records in a single write; returns them with their new ids, in order.'''
+    return storage(data_dir).insert_many(filename, records)
+
+
+def update(filename, record_id, changes, data_dir=None):
+    '''Change some fields of a record; False if there is no record with that id.'''
+    return storage(data_dir).update(filename, record_id, changes)
+
+
+def delete(filename, record_id, data_dir=None):
+    '''Delete a record; False if there is no record with that id.'''
+    return storage(data_dir).delete(filename, record_id)
+
+
+def query(filename, where=None, between=None, order='id', descending=False, after=None, limit=50,
+          data_dir=None):
+    '''
+    One page of a record collection filtered and sorted on its indexed
+    columns: (records, cursor to pass as `after` for the next page, or None).
+    See JsonStorage.query().
+    '''
+    return storage(data_dir).query(filename, where=where, between=between, order=order,
+                                   descending=descending, after=after, limit=limit)
+
+
+def modified(filename, data_dir=None):
+    '''POSIX time of the last write to a collection (or later), 0 if it does not exist.'''
+    return storage(data_dir).modified(filename)
+
+
+def partitions(filename, data_dir=None):
+    '''Months ('YYYY-MM') with records of a partitioned collection, oldest first.'''
+    return storage(data_dir).partitions(filename)
+
+
+def revision(filename, data_dir=None):
+    '''
+    Token that changes whenever a collection is written, computed without
+    reading its records; unlike fingerprint() it may also change when the
+    content does not.
+    '''
+    return storage(data_dir).revision(filename)
+
+
+def locked(data_dir=None):
+    '''
+    Context manager holding the write lock of the dataset across several
+    operations, for a read-modify-write that other workers must not interleave.
+    '''
+    return storage(data_dir).locked()
+
+
+def fingerprint(filenames, data_dir=None):
+    '''
+    Hex digest of the content of the given collections, missing ones
+    included as such: equal for equal data, whatever process computes it.
+    '''
+    backend = storage(data_dir)
+    combined = hashlib.sha256()
+    for filename in filenames:
+        try:
+            digest = backend.digest(filename)
+        except FileNotFoundError:
+            digest = 'missing'
+        combined.update(f"{filename}:{digest}\n".encode('utf-8'))
+    return combined.hexdigest()
+
+
+def version():
+    '''Counter that changes whenever the cached dataset changes.'''
+    return _version
+
+
+def clear():
+    '''Drop every cached collection, and the choice of backend of every directory.'''
+    with _lock:
+        _storages.clear()
+    _changed()
@@ -0,0 +1,58 @@
+'''
+Optional destinations for the engine's intermediate data.
+
+While generating a day, Generator hands a few snapshots (the absences and
+who is present, the schedule before substitutions, the final schedule and
+its text) to its debug sink, if it has one. By default it has none and
+generating does no file I/O at all.
+
+A sink is any object with dump(name, data), where data is a fresh
+JSON-ready object the sink may keep. DirectoryDebugSink writes every dump
+to <directory>/<name>.json from a background thread, so the generation
+never waits for the disk.
+'''
+
+import json
+import os
+import queue
+import threading
+
+
+class DirectoryDebugSink:
+    '''Writes each dump to <directory>/<name>.json, asynchronously.'''
+
+    def __init__(self, directory='.', indent=4):
+        self.directory = directory
+        self.indent = indent
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._write_loop, name='debug-sink', daemon=True)
+        self._thread.start()
+
+    def dump(self, name, data):
+        self._queue.put((name, data))
+
+    def flush(self):
+        '''Wait until every dump so far is on disk.'''
+        self._queue.join()
+
+    def close(self):
+        '''Write what is pending and stop the writer thread.'''
+        self._queue.put(None)
+        self._thread.join()
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                name, data = item
+                path = os.path.join(self.directory, f"{name}.json")
+                try:
+                    with open(path, 'w', encoding='utf-8') as f:
+                        json.dump(data, f, indent=self.indent)
+                except OSError as e:
+                    # Losing a debug dump must never break a generation
+                    print(f"Impossibile scrivere {path}: {e}")
+            finally:
+                self._queue.task_done()
@@ -0,0 +1,74 @@
+'''
+Structured trace of the engine's decisions.
+
+Generator records what it decides while building a day (who is absent, the
+coverage of every luogo, which candidates it skipped and why, who it picked
+and by which rule, cleaning overtime) as events in a DecisionTrace:
+
+    trace.record(INFO, 'substitute_picked', collaboratore_id=12, luogo_id=3,
+                 reason='oldest_ultima_sostituzione')
+
+Events are kept in a ring buffer of fixed size, so a long generation keeps
+the most recent ones and never grows without bound. Events below the
+trace's level are discarded on entry.
+
+Tracing is off unless a DecisionTrace is passed to the Generator: the
+engine checks `trace is not None` before building an event, so a disabled
+trace costs a single comparison.
+'''
+
+import time
+from collections import deque
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+
+LEVEL_NAMES = {DEBUG: 'debug', INFO: 'info', WARNING: 'warning'}
+LEVELS = {name: level for level, name in LEVEL_NAMES.items()}
+
+DEFAULT_CAPACITY = 5000
+
+
+class DecisionTrace:
+    '''Ring buffer of the decision events of one generation.'''
+
+    def __init__(self, level=INFO, capacity=DEFAULT_CAPACITY):
+        if capacity < 1:
+            raise ValueError("La traccia deve contenere almeno un evento")
+        self.level = level
+        self._events = deque(maxlen=capacity)
+        self._started = time.perf_counter()
+        # Events recorded in total, dropped ones included
+        self.recorded = 0
+
+    def __len__(self):
+        return len(self._events)
+
+    @property
+    def dropped(self):
+        '''Events pushed out of the ring buffer by newer ones.'''
+        return self.recorded - len(self._events)
+
+    def record(self, level, event, **fields):
+        if level < self.level:
+            return
+        self.recorded += 1
+        self._events.append((time.perf_counter() - self._started, level, event, fields))
+
+    def events(self):
+        '''The kept events, oldest first, as JSON-ready dicts.'''
+        return [
+            {'ms': round(elapsed * 1000, 3), 'level': LEVEL_NAMES[level], 'event': event, 'fields': fields}
+            for elapsed, level, event, fields in self._events
+        ]
+
+    def lines(self):
+        '''The kept events as text, one per line.'''
+        return [format_event(event) for event in self.events()]
+
+
+def format_event(event):
+    '''One line of text for an event dict as returned by DecisionTrace.events().'''
+    fields = ' '.join(f"{key}={value}" for key, value in event['fields'].items())
+    return f"{event['ms']:9.3f} {event['level'].upper():<7} {event['event']} {fields}".rstrip()
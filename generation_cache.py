@@ -0,0 +1,70 @@
+'''
+Memoized generations, keyed by content.
+
+A generation is fully determined by the date, the seed of the random
+tie-breaks, the solver, the fairness window and the content of the data
+files, so its result can be stored under a hash of those and handed back
+as-is when the same day is asked again before anything changed. Editing any data file changes
+generator.data_version() and with it every key, so stale entries are never
+returned; they just age out of the LRU.
+'''
+
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+DEFAULT_MAX_ENTRIES = 64
+
+
+def cache_key(date_str, seed, data_version, solver='greedy', fairness=None):
+    '''Hex digest identifying one generation.'''
+    material = json.dumps([date_str, seed, solver, fairness, data_version])
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+
+class GenerationCache:
+    '''Bounded, thread-safe LRU of generation results.'''
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        if max_entries < 1:
+            raise ValueError("La cache deve contenere almeno un elemento")
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        '''The stored value, marked as most recently used, or None.'''
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        '''Store a value, evicting the least recently used ones past max_entries.'''
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_or_compute(self, key, compute):
+        '''The stored value, or compute() stored and returned.'''
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
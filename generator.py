@@ -1,42 +1,380 @@
+import argparse
+import heapq
 import json
 import os
-from datetime import datetime, time
 import random
+import sys
+from datetime import date, timedelta
+
+import dataset
+import metrics
+import solver
+from decision_trace import DEBUG, INFO, LEVELS, WARNING, DecisionTrace
+from ledger import LEDGER_FILENAME, WINDOWS, entries_for, shared_ledger, window
+from occupancy import Occupancy
+from schedule import Assignment, CleaningOvertime, Schedule, format_time, parse_time
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
+SOLVERS = ('greedy', 'flow')
+
+WEEKDAYS = ['lunedi', 'martedi', 'mercoledi', 'giovedi', 'venerdi', 'sabato', 'domenica']
+
+
+# Whoever enters by this time counts towards a luogo's morning coverage
+MORNING_COVERAGE_LIMIT = parse_time("08:20")
+# Whoever enters after this time counts towards the afternoon coverage
+AFTERNOON_START_THRESHOLD = parse_time("09:00")
+
+
+class LuogoCoverage:
+    '''
+    Morning coverage of every luogo, kept up to date while the schedule is built.
+
+    Instead of recounting the whole schedule after every substitution, each
+    added assignment only updates the counter of the luogo it lands in.
+    '''
+
+    def __init__(self, luoghi, counts=None):
+        self._min_required = {}
+        for luogo in luoghi:
+            self._min_required.setdefault(luogo['id'], luogo['min_collaboratori'])
+        self._count = dict.fromkeys(self._min_required, 0)
+        # Starting head counts, e.g. read from an Occupancy
+        for luogo_id, count in (counts or {}).items():
+            if luogo_id in self._count:
+                self._count[luogo_id] = count
+        self._surplus = {luogo_id for luogo_id in self._count if self.balance(luogo_id) > 0}
+        self._watchers = []
+
+    def __contains__(self, luogo_id):
+        return luogo_id in self._min_required
+
+    def add(self, luogo_id, start, end):
+        self._update(luogo_id, start, end, 1)
+
+    def remove(self, luogo_id, start, end):
+        self._update(luogo_id, start, end, -1)
+
+    def _update(self, luogo_id, start, end, delta):
+        # Same test as Occupancy.counts_at(): at work from start up to, not including, end
+        if luogo_id not in self._min_required or not start <= MORNING_COVERAGE_LIMIT < end:
+            return
+        self._count[luogo_id] += delta
+        if self.balance(luogo_id) > 0:
+            if luogo_id not in self._surplus:
+                self._surplus.add(luogo_id)
+                for callback in self._watchers:
+                    callback(luogo_id)
+        else:
+            self._surplus.discard(luogo_id)
+
+    def watch(self, callback):
+        '''Call callback(luogo_id) every time a luogo goes into surplus.'''
+        self._watchers.append(callback)
+
+    def balance(self, luogo_id):
+        '''People above (positive) or below (negative) the luogo minimum.'''
+        return self._count[luogo_id] - self._min_required[luogo_id]
+
+    def surplus_luoghi(self):
+        return self._surplus
+
+    def info(self, luogo_id):
+        balance = self.balance(luogo_id)
+        if balance == 0:
+            return "EXACT"
+        elif balance > 0:
+            return f"+{balance}"
+        return f"-{-balance}"
+
+    def as_dict(self):
+        return {luogo_id: self.info(luogo_id) for luogo_id in self._min_required}
+
+
+class CandidatePool:
+    '''
+    Substitute candidates for one day, ranked once and kept in a heap.
+
+    Candidates whose home luogo is not in surplus are parked, per luogo, the
+    first time they reach the top of the heap and pushed back when the luogo
+    goes into surplus again. Assigned candidates are dropped lazily, so
+    picking the best one costs O(log n) instead of a pass over everybody.
+    '''
+
+    def __init__(self, candidates, coverage, key, criteria, trace=None):
+        self.criteria = criteria
+        self._coverage = coverage
+        self._trace = trace
+        # Candidates looked at so far, for metrics.CANDIDATES_EXAMINED
+        self.examined = 0
+        self._assigned = set()
+        self._parked = {}
+        # Entries are (rank, position, collaboratore); positions are unique so
+        # the dicts themselves are never compared
+        self._heap = [(key(c), pos, c) for pos, c in enumerate(candidates)]
+        heapq.heapify(self._heap)
+        coverage.watch(self._restore)
+
+    def mark_assigned(self, collaboratore_id):
+        self._assigned.add(collaboratore_id)
+
+    def is_available(self, collaboratore):
+        self.examined += 1
+        return (collaboratore['id'] not in self._assigned and
+                collaboratore.get('luogo_id') in self._coverage.surplus_luoghi())
+
+    def best(self):
+        '''Return the highest ranked available candidate, or None.'''
+        surplus = self._coverage.surplus_luoghi()
+        while self._heap:
+            self.examined += 1
+            entry = self._heap[0]
+            collaboratore = entry[2]
+            if collaboratore['id'] in self._assigned:
+                heapq.heappop(self._heap)
+                if self._trace is not None:
+                    self._trace.record(DEBUG, 'candidate_rejected', collaboratore_id=collaboratore['id'],
+                                       reason='already_assigned')
+            elif collaboratore['luogo_id'] not in surplus:
+                heapq.heappop(self._heap)
+                self._parked.setdefault(collaboratore['luogo_id'], []).append(entry)
+                if self._trace is not None:
+                    self._trace.record(DEBUG, 'candidate_rejected', collaboratore_id=collaboratore['id'],
+                                       reason='home_not_in_surplus', luogo_id=collaboratore['luogo_id'])
+            else:
+                return collaboratore
+        return None
+
+    def _restore(self, luogo_id):
+        for entry in self._parked.pop(luogo_id, []):
+            if entry[2]['id'] not in self._assigned:
+                heapq.heappush(self._heap, entry)
+
+
+# Read a month at a time, only for the days being generated
+ASSENZE_FILENAME = 'assenze.json'
+
+# Attribute -> data file the Generator reads
+DATA_FILES = {
+    'turnazioni': 'turnazioni.json',
+    'coperture_fisse': 'coperture_fisse.json',
+    'collaboratori': 'collaboratori.json',
+    'luoghi': 'luoghi.json',
+    'orari_pomeriggio': 'orari_pomeriggio.json',
+    'sub_order': 'sub_order.json',
+}
+
+
+# Data files the Generator reads if they exist
+OPTIONAL_DATA_FILES = {
+    'storico': LEDGER_FILENAME,
+}
+
+
+def data_version(data_dir=None, day=None):
+    '''
+    Content fingerprint of the data files, changes only when one of them does.
+    With a day, only the assenze of its month count: generating that day reads no other.
+    '''
+    assenze = dataset.partition_filename(ASSENZE_FILENAME, dataset.month_of(day)) if day else ASSENZE_FILENAME
+    filenames = [assenze] + list(DATA_FILES.values()) + list(OPTIONAL_DATA_FILES.values())
+    return dataset.fingerprint(filenames, data_dir or os.path.join(BASE_DIR, 'data'))
+
+
+class GenerationResult:
+    '''What generate() produces for one day.'''
+
+    __slots__ = ('schedule', 'substitutions_text')
+
+    def __init__(self, schedule, substitutions_text):
+        self.schedule = schedule
+        self.substitutions_text = substitutions_text
+
+    def to_dict(self):
+        return {'schedule': self.schedule.to_dict(), 'substitutions_text': self.substitutions_text}
+
+
 class Generator:
-    def __init__(self):
+    def __init__(self, data_dir=None, debug_sink=None, solver='greedy', seed=None, trace=None, fairness=None):
+        if solver not in SOLVERS:
+            raise ValueError(f"Solver sconosciuto: {solver} (disponibili: {', '.join(SOLVERS)})")
+        if fairness is not None and fairness not in WINDOWS:
+            raise ValueError(f"Finestra sconosciuta: {fairness} (disponibili: {', '.join(WINDOWS)})")
+        # 'greedy' fills deficits one by one, 'flow' solves the whole day at once
+        self.solver = solver
+        # Receives the intermediate data of a generation, see debug_sink.py
+        self.debug_sink = debug_sink
+        # DecisionTrace recording why the engine decided what, see decision_trace.py
+        self.trace = trace
+        # Source of the random tie-breaks: with a seed the same data and date
+        # always give the same schedule. The simulator swaps in its own
+        self.seed = seed
+        self.rng = random if seed is None else random.Random(seed)
+        # With a window of the ledger ('30d', 'term'), candidates are ranked
+        # first by the load they had in it, see ledger.py
+        self.fairness = fairness
+
         # Load JSON to memory
-        data_files = {
-            'assenze': 'data/assenze.json',
-            'turnazioni': 'data/turnazioni.json',
-            'coperture_fisse': 'data/coperture_fisse.json',
-            'collaboratori': 'data/collaboratori.json',
-            'luoghi': 'data/luoghi.json',
-            'orari_pomeriggio': 'data/orari_pomeriggio.json',
-            'sub_order': 'data/sub_order.json',
+        data_dir = data_dir or os.path.join(BASE_DIR, 'data')
+        self.data_dir = data_dir
+        with metrics.PHASE_SECONDS.time(phase='data_load'):
+            for attr, filename in DATA_FILES.items():
+                path = os.path.join(data_dir, filename)
+                try:
+                    # Shared with the Flask routes, reparsed only when the file changes
+                    setattr(self, attr, dataset.load(filename, data_dir))
+                except FileNotFoundError:
+                    raise FileNotFoundError(f"File dati mancante: {path}")
+                except json.JSONDecodeError as e:
+                    raise ValueError(f"JSON non valido in {path}: {e}")
+            for attr, filename in OPTIONAL_DATA_FILES.items():
+                try:
+                    setattr(self, attr, dataset.load(filename, data_dir))
+                except FileNotFoundError:
+                    setattr(self, attr, [])
+
+        # Assenze by date, filled a month at a time as days are generated;
+        # set_assenze() replaces them all
+        self._assenze_by_date = {}
+        self._absent_ids_by_date = {}
+        self._assenze_months = set()
+        self._assenze_override = None
+
+        # Only the fairness ranking needs the ledger, indexed again only when storico.json changes
+        self.ledger = shared_ledger(self.storico, data_dir) if fairness is not None else None
+        # {collaboratore_id: (substitutions, overtime minutes)} in the window of the day being generated
+        self._window_loads = None
+
+        self._build_indexes()
+        self._build_rule_indexes()
+
+    def _build_indexes(self):
+        '''Build the id-keyed lookup tables used by every helper.'''
+        self._collaboratori_by_id = {}
+        self._collaboratore_pos = {}
+        self._orari_by_id = {}
+        self._collaboratori_by_luogo = {}
+        self._collaboratori_by_luogo_secondario = {}
+        for pos, collaboratore in enumerate(self.collaboratori):
+            # Keep the first entry on duplicate ids, like the old linear scan did
+            if collaboratore['id'] not in self._collaboratori_by_id:
+                self._collaboratori_by_id[collaboratore['id']] = collaboratore
+                self._collaboratore_pos[collaboratore['id']] = pos
+                # Working hours as (inizio, fine) minutes, per giorno
+                self._orari_by_id[collaboratore['id']] = {
+                    giorno: (parse_time(orario['inizio']), parse_time(orario['fine']))
+                    for giorno, orario in collaboratore['orari_settimanali'].items()
+                }
+            luogo_id = collaboratore.get('luogo_id')
+            if luogo_id is not None:
+                self._collaboratori_by_luogo.setdefault(luogo_id, []).append(collaboratore)
+            luogo_secondario_id = collaboratore.get('luogo_secondario_id')
+            if luogo_secondario_id is not None:
+                self._collaboratori_by_luogo_secondario.setdefault(luogo_secondario_id, []).append(collaboratore)
+
+        self._luoghi_by_id = {}
+        for luogo in self.luoghi:
+            self._luoghi_by_id.setdefault(luogo['id'], luogo)
+
+        # Where every collaboratore normally works, for the occupancy of the day
+        self._home_luogo_by_id = {
+            collab_id: collaboratore.get('luogo_id')
+            for collab_id, collaboratore in self._collaboratori_by_id.items()
+        }
+
+        self._afternoon_end_by_weekday = {
+            giorno: parse_time(orario['ora_fine'])
+            for giorno, orario in self.orari_pomeriggio.items()
         }
-        for attr, rel_path in data_files.items():
-            path = os.path.join(BASE_DIR, rel_path)
-            try:
-                with open(path, 'r') as f:
-                    setattr(self, attr, json.load(f))
-            except FileNotFoundError:
-                raise FileNotFoundError(f"File dati mancante: {path}")
-            except json.JSONDecodeError as e:
-                raise ValueError(f"JSON non valido in {path}: {e}")
+
+    def _build_rule_indexes(self):
+        '''
+        Index turnazioni by (anno, mese, giorno_settimana) and coperture_fisse
+        by giorno_settimana, parsing every date once at load.
+
+        Turnazioni are stored as (turnazione, ora_ingresso_alternativa in minutes).
+        '''
+        self._turnazioni_by_day = {}
+        self._turnazioni_by_day_collab = {}
+        for turnazione in self.turnazioni:
+            mese = self._convert_month('index_from_name', month_name=turnazione['mese'])
+            key = (turnazione['anno'], mese, turnazione['giorno_settimana'])
+            entry = (turnazione, parse_time(turnazione['ora_ingresso_alternativa']))
+            self._turnazioni_by_day.setdefault(key, []).append(entry)
+            self._turnazioni_by_day_collab.setdefault(key + (turnazione['collaboratore_id'],), []).append(entry)
+
+        self._coperture_by_weekday = {}
+        self._coperture_by_weekday_collab = {}
+        for copertura in self.coperture_fisse:
+            weekday = copertura['giorno_settimana']
+            self._coperture_by_weekday.setdefault(weekday, []).append(copertura)
+            self._coperture_by_weekday_collab.setdefault((weekday, copertura['collaboratore_id']), []).append(copertura)
+
+    def _index_assenze(self, assenze):
+        for assenza in assenze:
+            assenza_year, assenza_month, assenza_day = map(int, assenza['data'].split('-'))
+            key = (assenza_year, assenza_month, assenza_day)
+            self._assenze_by_date.setdefault(key, []).append(assenza)
+            self._absent_ids_by_date.setdefault(key, set()).add(assenza['collaboratore_id'])
+
+    def _load_assenze_month(self, year, month):
+        '''Read and index the assenze of a month, the first time a day of it is needed.'''
+        if self._assenze_override is not None or (year, month) in self._assenze_months:
+            return
+        filename = dataset.partition_filename(ASSENZE_FILENAME, f"{year:04d}-{month:02d}")
+        try:
+            assenze = dataset.load(filename, self.data_dir)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"JSON non valido in {os.path.join(self.data_dir, filename)}: {e}")
+        self._index_assenze(assenze)
+        self._assenze_months.add((year, month))
+
+    def _assenze_on(self, year, month, day):
+        self._load_assenze_month(year, month)
+        return self._assenze_by_date.get((year, month, day), [])
+
+    def _absent_ids_on(self, year, month, day):
+        self._load_assenze_month(year, month)
+        return self._absent_ids_by_date.get((year, month, day), set())
+
+    @property
+    def assenze(self):
+        '''Every assenza: the whole history, read only when asked for.'''
+        if self._assenze_override is not None:
+            return self._assenze_override
+        try:
+            return dataset.load(ASSENZE_FILENAME, self.data_dir)
+        except FileNotFoundError:
+            return []
+
+    def assenze_between(self, start, end):
+        '''The assenze from date start to date end, both included, reading only their months.'''
+        first, last = start.isoformat(), end.isoformat()
+        if self._assenze_override is not None:
+            return [assenza for assenza in self._assenze_override if first <= assenza['data'] <= last]
+        assenze = []
+        year, month = start.year, start.month
+        while (year, month) <= (end.year, end.month):
+            self._load_assenze_month(year, month)
+            month_days = sorted(key for key in self._assenze_by_date if key[:2] == (year, month))
+            assenze += [assenza for key in month_days for assenza in self._assenze_by_date[key]
+                        if first <= assenza['data'] <= last]
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+        return assenze
+
+    def set_assenze(self, assenze):
+        '''Replace the assenze the schedules are built from (e.g. a sampled scenario).'''
+        self._assenze_override = assenze
+        self._assenze_by_date = {}
+        self._absent_ids_by_date = {}
+        self._index_assenze(assenze)
 
     def _get_collaboratore_by_id(self, id):
-        for collaboratore in self.collaboratori:
-            if collaboratore['id'] == id:
-                return collaboratore
-        return None
+        return self._collaboratori_by_id.get(id)
+
     def _get_luogo_by_id(self, id):
-        for luogo in self.luoghi:
-            if luogo['id'] == id:
-                return luogo
-        return None
+        return self._luoghi_by_id.get(id)
 
     def _convert_month(self, criteria, month_name=None, month_index=None):
         months = {
@@ -61,134 +399,121 @@ class Generator:
                     return name
         return None
 
-    def _calculate_luogo_info(self, schedule):
-        luogo_info = {}
-        for luogo in self.luoghi:
-            luogo_id = luogo['id']
-            collaboratori = schedule.get(luogo_id, [])
-            amount = 0
-            # Count all collaboratori which enter earlier than "8:20"
-            for collaboratore in collaboratori:
-                start_time = collaboratore['start']
-                print(collaboratore)
-                start_hour, start_minute = map(int, start_time.split(':'))
-                start_time_obj = time(start_hour, start_minute)
-                target_time = time(8, 20)
-                if start_time_obj <= target_time:
-                    amount += 1
-            
-            min_required = luogo['min_collaboratori']
-
-            if amount == min_required:
-                luogo_info[luogo_id] = "EXACT"
-            elif amount > min_required:
-                luogo_info[luogo_id] = f"+{amount - min_required}"
-            else:
-                luogo_info[luogo_id] = f"-{min_required - amount}"
-        
-        return luogo_info
+    def _occupancy(self, schedule):
+        return Occupancy(schedule, self._luoghi_by_id, self._home_luogo_by_id)
 
-    def _is_collaborator_already_assigned(self, schedule, collaboratore_id):
-        '''Check if a collaborator is already assigned as a substitute.'''
-        # Check if already assigned as a substitute at any location
-        for luogo_id, collaboratori in schedule.items():
-            if luogo_id == 'afternoon_subs':
-                continue
-            for collab in collaboratori:
-                if collab['collaboratore_id'] == collaboratore_id and collab.get('is_substitute', False):
-                    return True
+    def _calculate_coverage(self, schedule):
+        '''Count, for every luogo, the collaboratori at work there at 8:20.'''
+        counts = self._occupancy(schedule).counts_at(MORNING_COVERAGE_LIMIT)
+        return LuogoCoverage(self.luoghi, counts)
 
-        # Check afternoon substitutes
-        if 'afternoon_subs' in schedule:
-            for collab in schedule['afternoon_subs']:
-                if collab['collaboratore_id'] == collaboratore_id:
-                    return True
+    def _leave_home(self, schedule, coverage, collaboratore_id):
+        '''
+        Take a collaboratore who starts substituting out of the coverage of
+        the luoghi they were at, as Occupancy does, so the counters of the
+        greedy loop see the luogo they leave.
+        '''
+        if coverage is None or schedule.is_substitute(collaboratore_id):
+            return
+        for luogo_id, assignment in schedule.regular_assignments(collaboratore_id):
+            coverage.remove(luogo_id, assignment.start, assignment.end)
+
+    def _add_to_schedule(self, schedule, coverage, pool, luogo_id, assignment):
+        '''
+        Append an assignment to a luogo, updating only the coverage of that
+        luogo and of the one a substitute leaves, and taking the substitute
+        out of the candidate pool.
+        '''
+        if assignment.is_substitute:
+            self._leave_home(schedule, coverage, assignment.collaboratore_id)
+        schedule.add(luogo_id, assignment)
+        if assignment.partial_end is not None:
+            # Back at their own luogo from partial_end, as in Occupancy
+            coverage.add(luogo_id, assignment.start, assignment.partial_end)
+            coverage.add(assignment.original_luogo_id, assignment.partial_end, assignment.end)
+        else:
+            coverage.add(luogo_id, assignment.start, assignment.end)
+        if pool is not None:
+            pool.mark_assigned(assignment.collaboratore_id)
 
-        return False
+    def _build_candidate_pool(self, schedule, coverage, criteria):
+        '''
+        Rank every collaboratore with a home luogo for the given criteria.
 
-    def find_substitute(self, schedule, criteria, needed_luogo_id=None):
+        "substitute" prefers who never substituted (in random order), then the
+        oldest ultima_sostituzione; "overtime" prefers the least straordinari_svolti.
+        With a fairness window, who substituted (or did overtime) less in it
+        comes first. Ties keep self.collaboratori order.
+        '''
+        if criteria == "overtime":
+            key = lambda c: (c["straordinari_svolti"],)
+        elif criteria == "substitute":
+            key = lambda c: ((0, self.rng.random()) if c["ultima_sostituzione"] is None
+                             else (1, c["ultima_sostituzione"]))
+        else:
+            return None
+        if self._window_loads is not None:
+            loads, load_index = self._window_loads, 1 if criteria == "overtime" else 0
+            rank = key
+            key = lambda c: (loads.get(c['id'], (0, 0))[load_index],) + rank(c)
+        candidates = [c for c in self.collaboratori if c.get('luogo_id') is not None]
+        pool = CandidatePool(candidates, coverage, key, criteria, self.trace)
+        for collab_id in schedule.substitute_ids():
+            pool.mark_assigned(collab_id)
+        return pool
+
+    def find_substitute(self, schedule, criteria, needed_luogo_id=None, coverage=None, pool=None):
         '''
         Find a substitute available to cover a missing shift.
 
+        Only people whose home luogo is in surplus and who are not already
+        substituting somewhere are available.
+
         Args:
             schedule: Current schedule state
             criteria: Selection criteria ("overtime" or "substitute")
             needed_luogo_id: The location ID that needs coverage
+            coverage: LuogoCoverage of the schedule, recomputed if not given
+            pool: CandidatePool for the same criteria, rebuilt if not given
         '''
-        luogo_info = self._calculate_luogo_info(schedule)
-        available_collaboratori = {}
-        for luogo_id, info in luogo_info.items():
-            if info.startswith("+"):
-                # Find all collaboratori
-                possible_subs = [c for c in self.collaboratori if c["luogo_id"] == luogo_id]
-                for sub in possible_subs:
-                    # Skip if already assigned
-                    if self._is_collaborator_already_assigned(schedule, sub["id"]):
-                        continue
-                    available_collaboratori[sub["id"]] = {
-                        "last_sub": sub["ultima_sostituzione"],
-                        "overtime": sub["straordinari_svolti"],
-                    }
-
-        # If no available collaborators, return None
-        if not available_collaboratori:
-            return None
-
-        # Choose based on selected criteria
-        if criteria == "overtime":
-            min_overtime = min(available_collaboratori[col_id]["overtime"] for col_id in available_collaboratori)
-            for collaboratore in self.collaboratori:
-                if collaboratore["id"] in available_collaboratori and collaboratore["straordinari_svolti"] == min_overtime:
-                    return collaboratore
-            return None
-
-        elif criteria == "substitute":
-            # PRIORITY 1: Check for luogo_secondario
-            # If a collaborator has the needed location as their luogo_secondario, they are the first choice
-            if needed_luogo_id is not None:
-                luogo_secondario_candidates = []
-                for collaboratore in self.collaboratori:
-                    # Check if this collaborator has the needed location as luogo_secondario
-                    if collaboratore.get("luogo_secondario_id") == needed_luogo_id:
-                        # Check if they are available (not already assigned and in surplus location)
-                        if collaboratore["id"] in available_collaboratori:
-                            luogo_secondario_candidates.append(collaboratore)
-
-                if luogo_secondario_candidates:
-                    # Pick the first one (could add more logic here if needed)
-                    chosen = luogo_secondario_candidates[0]
-                    print(f"Found luogo_secondario match: {chosen['cognome']} {chosen['nome']} for luogo {needed_luogo_id}")
-                    return chosen
-
-            # PRIORITY 2: Then, look for collaboratori with "none" as last substitute date
-            none_collaboratori = []
-            for collaboratore in self.collaboratori:
-                if collaboratore["id"] in available_collaboratori:
-                    if collaboratore["ultima_sostituzione"] == None:
-                        none_collaboratori.append(collaboratore)
-            if none_collaboratori:
-                return random.choice(none_collaboratori)
-
-            # PRIORITY 3: If none found, pick the one with the oldest last substitute date
-            available_dates = [self.collaboratori[i]["ultima_sostituzione"]
-                             for i, col in enumerate(self.collaboratori)
-                             if col["id"] in available_collaboratori and col["ultima_sostituzione"] is not None]
-
-            if not available_dates:
+        if coverage is None:
+            coverage = self._calculate_coverage(schedule)
+        if pool is None or pool.criteria != criteria:
+            pool = self._build_candidate_pool(schedule, coverage, criteria)
+            if pool is None:
                 return None
 
-            last_substitute = min(available_dates)
-            print("Last substitute date to beat:", last_substitute)
-            for collaboratore in self.collaboratori:
-                if (collaboratore["id"] in available_collaboratori and
-                    collaboratore["ultima_sostituzione"] == last_substitute):
+        # PRIORITY 1: Check for luogo_secondario
+        # If a collaborator has the needed location as their luogo_secondario, they are the first choice
+        if criteria == "substitute" and needed_luogo_id is not None:
+            for collaboratore in self._collaboratori_by_luogo_secondario.get(needed_luogo_id, []):
+                # Check if they are available (not already assigned and in surplus location)
+                if pool.is_available(collaboratore):
+                    if self.trace is not None:
+                        self.trace.record(INFO, 'substitute_picked', collaboratore_id=collaboratore['id'],
+                                          luogo_id=needed_luogo_id, reason='luogo_secondario')
                     return collaboratore
-            return None
-
-        else:
-            return None
-
+                if self.trace is not None:
+                    self.trace.record(DEBUG, 'secondary_rejected', collaboratore_id=collaboratore['id'],
+                                      luogo_id=needed_luogo_id, reason='not_available')
+
+        # PRIORITY 2 and 3 come straight from the ranking of the pool
+        substitute = pool.best()
+        if self.trace is not None and substitute is not None:
+            if self._window_loads is not None:
+                reason = 'least_window_load'
+            elif criteria == "overtime":
+                reason = 'least_straordinari'
+            elif substitute['ultima_sostituzione'] is None:
+                reason = 'never_substituted'
+            else:
+                reason = 'oldest_ultima_sostituzione'
+            self.trace.record(INFO, 'substitute_picked', collaboratore_id=substitute['id'],
+                              luogo_id=needed_luogo_id, reason=reason,
+                              ultima_sostituzione=substitute['ultima_sostituzione'])
+        return substitute
 
+    @metrics.timed(metrics.PHASE_SECONDS, phase='populate_absences')
     def populate_absences(self, day, month, year, weekday):
         '''
         Populate a list containing all the shifts covered by the present collaborators.
@@ -202,163 +527,118 @@ class Generator:
 
 
         absences = []
-        for assenza in self.assenze:
-            # Convert date to YYYY-MM-DD for comparison
-            assenza_date = assenza['data']
-            assenza_day = int(assenza_date.split('-')[2])
-            assenza_month = int(assenza_date.split('-')[1])
-            assenza_year = int(assenza_date.split('-')[0])
-
-            if (assenza_day == day and
-                assenza_month == month and
-                assenza_year == year):
-
-                absences.append({
-                    'collaboratore_id': assenza['collaboratore_id'],
-                    'inizio': assenza['ora_inizio'] or 'day_start',
-                    'fine': assenza['ora_fine'] or 'day_end',
-                    'tipo': 'assenza'
-                })
+        for assenza in self._assenze_on(year, month, day):
+            absences.append({
+                'collaboratore_id': assenza['collaboratore_id'],
+                'inizio': assenza['ora_inizio'] or 'day_start',
+                'fine': assenza['ora_fine'] or 'day_end',
+                'tipo': 'assenza'
+            })
 
-        str_month = self._convert_month('name_from_index', month_index=month)
-        for turnazione in self.turnazioni:
-            if (turnazione['mese'] == str_month and
-                turnazione['anno'] == year and
-                turnazione['giorno_settimana'] == weekday):
+        for turnazione, _ in self._turnazioni_by_day.get((year, month, weekday), []):
+            absences.append({
+                'collaboratore_id': turnazione['collaboratore_id'],
+                'inizio': 'day_start',
+                'fine': turnazione['ora_ingresso_alternativa'],
+                'tipo': 'turnazione'
+            })
+        
+        covered_locations = []
+        for copertura in self._coperture_by_weekday.get(weekday, []):
+            collaboratore = self._get_collaboratore_by_id(copertura['collaboratore_id'])
+            if collaboratore:
                 absences.append({
-                    'collaboratore_id': turnazione['collaboratore_id'],
+                    'collaboratore_id': copertura['collaboratore_id'],
                     'inizio': 'day_start',
-                    'fine': turnazione['ora_ingresso_alternativa'],
-                    'tipo': 'turnazione'
+                    'fine': 'day_end',
+                    'tipo': 'copertura_fissa'
+                })
+                covered_locations.append({
+                    'collaboratore_id': copertura['collaboratore_id'],
+                    'luogo_id': collaboratore['luogo_id']
                 })
         
-        covered_locations = []
-        for copertura in self.coperture_fisse:
-            if copertura['giorno_settimana'] == weekday:
-                collaboratore = self._get_collaboratore_by_id(copertura['collaboratore_id'])
-                if collaboratore:
-                    absences.append({
-                        'collaboratore_id': copertura['collaboratore_id'],
-                        'inizio': 'day_start',
-                        'fine': 'day_end',
-                        'tipo': 'copertura_fissa'
-                    })
-                    covered_locations.append({
-                        'collaboratore_id': copertura['collaboratore_id'],
-                        'luogo_id': collaboratore['luogo_id']
-                    })
-        
-        # Create list of all currently covered locations by present collaborators
+        # Create list of all currently covered locations by present collaborators.
+        # Start and end times are minutes since midnight.
         present_locations = []
+        absent_ids = self._absent_ids_on(year, month, day)
         for collaboratore in self.collaboratori:
-            # If collaboratore is absent (i.e. in absences), skip
-            if any(a['collaboratore_id'] == collaboratore['id'] for a in self.assenze):
-                # Make sure assenza is for the current day
-                is_absent_today = False
-                for a in self.assenze:
-                    assenza_date = a['data']
-                    assenza_day = int(assenza_date.split('-')[2])
-                    assenza_month = int(assenza_date.split('-')[1])
-                    assenza_year = int(assenza_date.split('-')[0])
-                    if (a['collaboratore_id'] == collaboratore['id'] and
-                        assenza_day == day and
-                        assenza_month == month and
-                        assenza_year == year):
-                        is_absent_today = True
-                        break
-                if is_absent_today:
-                    continue
+            # If collaboratore is absent today, skip
+            if collaboratore['id'] in absent_ids:
+                continue
+            giorno_orario = self._orari_by_id[collaboratore['id']].get(weekday)
+            coperture = self._coperture_by_weekday_collab.get((weekday, collaboratore['id']))
+            turnazioni = self._turnazioni_by_day_collab.get((year, month, weekday, collaboratore['id']))
             # If collaboratore has a fixed location coverage today, add only the covered location
-            if any(c['collaboratore_id'] == collaboratore['id'] and
-                   c['giorno_settimana'] == weekday for c in self.coperture_fisse):
-                print("Fixed coverage for", collaboratore['nome'])
-                for c in self.coperture_fisse:
-                    if (c['collaboratore_id'] == collaboratore['id'] and
-                        c['giorno_settimana'] == weekday):
-                        present_locations.append({
-                            'collaboratore_id': collaboratore['id'],
-                            'luogo_id': c['luogo_coperto_id'],
-                            'start': 'day_start',
-                            'end': 'day_end'
-                        })
-                        print("From location", collaboratore['luogo_id'], "to location", c['luogo_coperto_id'])
-            
+            if coperture:
+                if not giorno_orario:
+                    continue
+                for c in coperture:
+                    present_locations.append({
+                        'collaboratore_id': collaboratore['id'],
+                        'luogo_id': c['luogo_coperto_id'],
+                        'start': giorno_orario[0],
+                        'end': giorno_orario[1]
+                    })
+                    if self.trace is not None:
+                        self.trace.record(DEBUG, 'fixed_coverage', collaboratore_id=collaboratore['id'],
+                                          from_luogo_id=collaboratore['luogo_id'], to_luogo_id=c['luogo_coperto_id'])
+
             # If collaboratore has a turnazione, add only the time for that turnazione
-            elif any(t['collaboratore_id'] == collaboratore['id'] and
-                     t['mese'] == str_month and
-                     t['anno'] == year and
-                     t['giorno_settimana'] == weekday for t in self.turnazioni):
-                for t in self.turnazioni:
-                    if (t['collaboratore_id'] == collaboratore['id'] and
-                        t['mese'] == str_month and
-                        t['anno'] == year and
-                        t['giorno_settimana'] == weekday):
-                        present_locations.append({
-                            'collaboratore_id': collaboratore['id'],
-                            'luogo_id': collaboratore['luogo_id'],
-                            'start': t['ora_ingresso_alternativa'],
-                            'end': self.orari_pomeriggio[weekday]['ora_fine']
-                        })
-            # Look for collaboratore schedule and check that they are present that day
-            else:
-                giorno_orario = collaboratore['orari_settimanali'].get(weekday)
-                if giorno_orario:
+            elif turnazioni:
+                for _, ora_ingresso_alternativa in turnazioni:
+                    if ora_ingresso_alternativa is None and giorno_orario:
+                        ora_ingresso_alternativa = giorno_orario[0]
                     present_locations.append({
                         'collaboratore_id': collaboratore['id'],
                         'luogo_id': collaboratore['luogo_id'],
-                        'start': 'day_start',
-                        'end': 'day_end'
+                        'start': ora_ingresso_alternativa,
+                        'end': self._afternoon_end_by_weekday[weekday]
                     })
+            # Look for collaboratore schedule and check that they are present that day
+            elif giorno_orario:
+                present_locations.append({
+                    'collaboratore_id': collaboratore['id'],
+                    'luogo_id': collaboratore['luogo_id'],
+                    'start': giorno_orario[0],
+                    'end': giorno_orario[1]
+                })
 
-        # Populate day_start and day_end based on collaboratore schedule
-        for location in present_locations:
-            collaboratore = self._get_collaboratore_by_id(location['collaboratore_id'])
-            if not collaboratore:
-                continue
-            giorno_orario = collaboratore['orari_settimanali'].get(weekday)
-            if giorno_orario:
-                if location['start'] == 'day_start':
-                    location['start'] = giorno_orario['inizio']
-                if location['end'] == 'day_end':
-                    location['end'] = giorno_orario['fine']
-                
-
-        with open("debug_output.json", "w") as debug_file:
-            json.dump({
+        if self.trace is not None:
+            for absence in absences:
+                self.trace.record(DEBUG, 'absent', collaboratore_id=absence['collaboratore_id'],
+                                  tipo=absence['tipo'], inizio=absence['inizio'], fine=absence['fine'])
+
+        if self.debug_sink is not None:
+            self.debug_sink.dump("debug_output", {
                 "absences": absences,
-                "present_locations": present_locations
-            }, debug_file, indent=4)
+                "present_locations": [
+                    dict(location, start=format_time(location['start']), end=format_time(location['end']))
+                    for location in present_locations
+                ]
+            })
 
         return absences, present_locations
     
     def _find_absent_collaborator(self, luogo_id, day, month, year):
         '''Find which collaborator from a location is absent on a given day.'''
-        for collaboratore in self.collaboratori:
-            if collaboratore['luogo_id'] == luogo_id:
-                # Check if this collaboratore is absent today
-                for assenza in self.assenze:
-                    assenza_date = assenza['data']
-                    assenza_day = int(assenza_date.split('-')[2])
-                    assenza_month = int(assenza_date.split('-')[1])
-                    assenza_year = int(assenza_date.split('-')[0])
-                    if (assenza['collaboratore_id'] == collaboratore['id'] and
-                        assenza_day == day and
-                        assenza_month == month and
-                        assenza_year == year):
-                        return collaboratore
+        absent_ids = self._absent_ids_on(year, month, day)
+        if not absent_ids:
+            return None
+        for collaboratore in self._collaboratori_by_luogo.get(luogo_id, []):
+            # Check if this collaboratore is absent today
+            if collaboratore['id'] in absent_ids:
+                return collaboratore
         return None
 
     def _find_turnazione_at_location(self, luogo_id, weekday, month, year):
         '''Find if someone at this location has a turnazione (shifted hours) today.'''
-        str_month = self._convert_month('name_from_index', month_index=month)
-        for collaboratore in self.collaboratori:
-            if collaboratore['luogo_id'] == luogo_id:
-                for turnazione in self.turnazioni:
-                    if (turnazione['collaboratore_id'] == collaboratore['id'] and
-                        turnazione['giorno_settimana'] == weekday and
-                        turnazione['mese'] == str_month and
-                        turnazione['anno'] == year):
-                        return collaboratore, turnazione['ora_ingresso_alternativa']
+        if (year, month, weekday) not in self._turnazioni_by_day:
+            return None, None
+        for collaboratore in self._collaboratori_by_luogo.get(luogo_id, []):
+            turnazioni = self._turnazioni_by_day_collab.get((year, month, weekday, collaboratore['id']))
+            if turnazioni:
+                return collaboratore, turnazioni[0][1]
         return None, None
 
     def _find_absent_afternoon_collaborator(self, day, month, year, weekday):
@@ -367,274 +647,311 @@ class Generator:
         if weekday not in self.orari_pomeriggio or not self.orari_pomeriggio[weekday].get('attivo'):
             return None
 
-        afternoon_start_threshold = time(9, 0)
-
         # Find collaborators who are absent today and normally start after 9:00
-        for assenza in self.assenze:
-            assenza_date = assenza['data']
-            assenza_day = int(assenza_date.split('-')[2])
-            assenza_month = int(assenza_date.split('-')[1])
-            assenza_year = int(assenza_date.split('-')[0])
-
-            if (assenza_day == day and assenza_month == month and assenza_year == year):
-                collaboratore = self._get_collaboratore_by_id(assenza['collaboratore_id'])
-                if collaboratore and weekday in collaboratore['orari_settimanali']:
-                    # Check if they normally start after 9:00
-                    start_str = collaboratore['orari_settimanali'][weekday]['inizio']
-                    start_hour, start_minute = map(int, start_str.split(':'))
-                    start_time = time(start_hour, start_minute)
-
-                    if start_time > afternoon_start_threshold:
-                        return collaboratore
+        for assenza in self._assenze_on(year, month, day):
+            collaboratore = self._get_collaboratore_by_id(assenza['collaboratore_id'])
+            if collaboratore and weekday in self._orari_by_id[collaboratore['id']]:
+                # Check if they normally start after 9:00
+                start = self._orari_by_id[collaboratore['id']][weekday][0]
+                if start > AFTERNOON_START_THRESHOLD:
+                    return collaboratore
 
         # Also check if someone with a turnazione (shifted hours) covering afternoon is absent
-        str_month = self._convert_month('name_from_index', month_index=month)
-        for turnazione in self.turnazioni:
-            if (turnazione['giorno_settimana'] == weekday and
-                turnazione['mese'] == str_month and
-                turnazione['anno'] == year):
-                # Check if their alternative start time is after 9:00
-                alt_start_str = turnazione['ora_ingresso_alternativa']
-                alt_start_hour, alt_start_minute = map(int, alt_start_str.split(':'))
-                alt_start_time = time(alt_start_hour, alt_start_minute)
-
-                if alt_start_time > afternoon_start_threshold:
-                    # Check if this person is absent
-                    for assenza in self.assenze:
-                        if assenza['collaboratore_id'] == turnazione['collaboratore_id']:
-                            assenza_date = assenza['data']
-                            assenza_day = int(assenza_date.split('-')[2])
-                            assenza_month = int(assenza_date.split('-')[1])
-                            assenza_year = int(assenza_date.split('-')[0])
-                            if (assenza_day == day and assenza_month == month and assenza_year == year):
-                                return self._get_collaboratore_by_id(turnazione['collaboratore_id'])
+        absent_ids = self._absent_ids_on(year, month, day)
+        for turnazione, alt_start in self._turnazioni_by_day.get((year, month, weekday), []):
+            # Check if their alternative start time is after 9:00
+            if alt_start is not None and alt_start > AFTERNOON_START_THRESHOLD:
+                # Check if this person is absent
+                if turnazione['collaboratore_id'] in absent_ids:
+                    return self._get_collaboratore_by_id(turnazione['collaboratore_id'])
 
         return None
 
     def _count_afternoon_coverage(self, schedule):
         '''Count how many collaborators start work after 9:00 AM across all locations.'''
-        afternoon_start_threshold = time(9, 0)
-
-        count = 0
-        for luogo_id, collaboratori in schedule.items():
-            # Skip special schedule keys that aren't actual locations
-            if luogo_id in ['afternoon_subs', 'cleaning_overtime']:
-                continue
-
-            for collaboratore in collaboratori:
-                start_time_str = collaboratore['start']
-                start_hour, start_minute = map(int, start_time_str.split(':'))
-                start_time = time(start_hour, start_minute)
-
-                if start_time > afternoon_start_threshold:
-                    count += 1
-
-        return count
+        return self._occupancy(schedule).starts_after(AFTERNOON_START_THRESHOLD)
 
-    def _shift_hours_for_afternoon(self, start_str, end_str, afternoon_end_str):
+    def _shift_hours_for_afternoon(self, start, end, afternoon_end):
         '''Shift working hours so they end at afternoon end time while maintaining duration.'''
-        # Parse times
-        start_hour, start_minute = map(int, start_str.split(':'))
-        end_hour, end_minute = map(int, end_str.split(':'))
-        afternoon_end_hour, afternoon_end_minute = map(int, afternoon_end_str.split(':'))
-
-        # Calculate work duration in minutes
-        start_minutes = start_hour * 60 + start_minute
-        end_minutes = end_hour * 60 + end_minute
-        duration_minutes = end_minutes - start_minutes
-
-        # Calculate new start time
-        afternoon_end_minutes = afternoon_end_hour * 60 + afternoon_end_minute
-        new_start_minutes = afternoon_end_minutes - duration_minutes
-
-        new_start_hour = new_start_minutes // 60
-        new_start_minute = new_start_minutes % 60
-
-        return f"{new_start_hour:02d}:{new_start_minute:02d}", afternoon_end_str
+        return afternoon_end - (end - start), afternoon_end
 
     def generate_schedule(self, day, month, year, weekday):
+        metrics.GENERATIONS.inc(solver=self.solver)
+        if self.ledger is not None:
+            # One pass over the ledger index per day: then O(1) per candidate
+            self._window_loads = self.ledger.loads(*window(self.fairness, date(year, month, day)))
         absences, present_locations = self.populate_absences(day, month, year, weekday)
 
         # Group present locations by luogo_id
-        schedule = {}
+        schedule = Schedule()
         for location in present_locations:
-            luogo_id = location['luogo_id']
-            if luogo_id not in schedule:
-                schedule[luogo_id] = []
-            schedule[luogo_id].append({
-                'collaboratore_id': location['collaboratore_id'],
-                'start': location['start'],
-                'end': location['end']
-            })
+            schedule.add(location['luogo_id'], Assignment(
+                location['collaboratore_id'], location['start'], location['end']
+            ))
 
-        with open("final_schedule.json", "w") as schedule_file:
-            json.dump(schedule, schedule_file, indent=4)
+        if self.debug_sink is not None:
+            self.debug_sink.dump("final_schedule", schedule.to_dict())
 
-        luogo_info = self._calculate_luogo_info(schedule)
+        coverage = self._calculate_coverage(schedule)
+        if self.solver == 'flow':
+            self._solve_with_flow(schedule, coverage, day, month, year, weekday)
+            return schedule
 
-        for luogo_id, info in luogo_info.items():
-            print(f"Luogo ID {luogo_id}: {info}")
+        pool = self._build_candidate_pool(schedule, coverage, "substitute")
+
+        self._fill_morning_deficits(schedule, coverage, pool, day, month, year, weekday)
+        self._fill_afternoon_shift(schedule, coverage, pool, day, month, year, weekday)
+        metrics.CANDIDATES_EXAMINED.inc(pool.examined)
+        return schedule
+    
+    @metrics.timed(metrics.PHASE_SECONDS, phase='substitution')
+    def _fill_morning_deficits(self, schedule, coverage, pool, day, month, year, weekday):
+        '''Greedy solver: fill every luogo below its minimum, in coverage order, cascading once.'''
+        for luogo_id, info in coverage.as_dict().items():
+            if self.trace is not None:
+                self.trace.record(DEBUG, 'coverage', luogo_id=luogo_id, balance=info)
 
             if info.startswith("-"):
                 amount_needed = int(info[1:])
                 while amount_needed > 0:
 
-                    substitute = self.find_substitute(schedule, "substitute", needed_luogo_id=luogo_id)
+                    substitute = self.find_substitute(schedule, "substitute", needed_luogo_id=luogo_id, coverage=coverage, pool=pool)
                     if substitute:
-                        # Check if shortage is due to turnazione
-                        turnazione_person, turnazione_start = self._find_turnazione_at_location(luogo_id, weekday, month, year)
-
-                        if turnazione_person:
-                            # Someone at this location has shifted hours for afternoon
-                            # Substitute only needs to cover the morning gap
-                            print(f"Found substitute Collaboratore ID {substitute['id']} for morning gap at Luogo ID {luogo_id}")
-                            normal_end = substitute['orari_settimanali'][weekday]['fine']
-
-                            if luogo_id not in schedule:
-                                schedule[luogo_id] = []
-                            schedule[luogo_id].append({
-                                'collaboratore_id': substitute['id'],
-                                'start': substitute['orari_settimanali'][weekday]['inizio'],
-                                'end': normal_end,
-                                'partial_end': turnazione_start,
-                                'original_luogo_id': substitute['luogo_id'],
-                                'is_substitute': True,
-                                'replaces_id': turnazione_person['id']
-                            })
-                        else:
-                            # Regular absence, full day substitution
-                            absent_collaboratore = self._find_absent_collaborator(luogo_id, day, month, year)
-
-                            print(f"Found substitute Collaboratore ID {substitute['id']} for Luogo ID {luogo_id}")
-                            if luogo_id not in schedule:
-                                schedule[luogo_id] = []
-                            schedule[luogo_id].append({
-                                'collaboratore_id': substitute['id'],
-                                'start': substitute['orari_settimanali'][weekday]['inizio'],
-                                'end': substitute['orari_settimanali'][weekday]['fine'],
-                                'is_substitute': True,
-                                'replaces_id': absent_collaboratore['id'] if absent_collaboratore else None,
-                                'original_luogo_id': substitute['luogo_id']
-                            })
-
-                        # Update luogo_info to check if substitute's original location now needs coverage
-                        luogo_info = self._calculate_luogo_info(schedule)
+                        self._place_substitute(schedule, coverage, pool, luogo_id, substitute, day, month, year, weekday)
+                        metrics.SUBSTITUTES.inc(kind='morning')
+                        depth = 1
 
                         # Check if the substitute's original location now needs a substitute
                         substitute_original_luogo = substitute['luogo_id']
-                        if substitute_original_luogo in luogo_info and luogo_info[substitute_original_luogo].startswith("-"):
-                            print(f"Substitute's original location (Luogo ID {substitute_original_luogo}) now needs coverage")
+                        if substitute_original_luogo in coverage and coverage.balance(substitute_original_luogo) < 0:
+                            if self.trace is not None:
+                                self.trace.record(INFO, 'cascade_needed', luogo_id=substitute_original_luogo,
+                                                  left_by=substitute['id'])
                             # Find a substitute for the substitute's original location
-                            cascading_substitute = self.find_substitute(schedule, "substitute", needed_luogo_id=substitute_original_luogo)
+                            cascading_substitute = self.find_substitute(schedule, "substitute", needed_luogo_id=substitute_original_luogo, coverage=coverage, pool=pool)
                             if cascading_substitute:
-                                print(f"Found cascading substitute Collaboratore ID {cascading_substitute['id']} for Luogo ID {substitute_original_luogo}")
-                                if substitute_original_luogo not in schedule:
-                                    schedule[substitute_original_luogo] = []
-                                schedule[substitute_original_luogo].append({
-                                    'collaboratore_id': cascading_substitute['id'],
-                                    'start': cascading_substitute['orari_settimanali'][weekday]['inizio'],
-                                    'end': cascading_substitute['orari_settimanali'][weekday]['fine'],
-                                    'is_substitute': True,
-                                    'replaces_id': substitute['id'],
-                                    'original_luogo_id': cascading_substitute['luogo_id']
-                                })
-                                # Update luogo_info again after cascading substitution
-                                luogo_info = self._calculate_luogo_info(schedule)
+                                cascading_start, cascading_end = self._orari_by_id[cascading_substitute['id']][weekday]
+                                self._add_to_schedule(schedule, coverage, pool, substitute_original_luogo, Assignment(
+                                    cascading_substitute['id'], cascading_start, cascading_end,
+                                    is_substitute=True,
+                                    replaces_id=substitute['id'],
+                                    original_luogo_id=cascading_substitute['luogo_id']
+                                ))
+                                metrics.SUBSTITUTES.inc(kind='cascade')
+                                depth += 1
                             else:
-                                print(f"No cascading substitute found for Luogo ID {substitute_original_luogo}")
+                                if self.trace is not None:
+                                    self.trace.record(WARNING, 'no_substitute', luogo_id=substitute_original_luogo)
+                                metrics.UNFILLED.inc(kind='morning')
 
+                        metrics.CASCADE_DEPTH.observe(depth)
                         amount_needed -= 1
                     else:
-                        print("No available substitute found.")
+                        if self.trace is not None:
+                            self.trace.record(WARNING, 'no_substitute', luogo_id=luogo_id, missing=amount_needed)
+                        metrics.UNFILLED.inc(amount_needed, kind='morning')
                         break
 
+    @metrics.timed(metrics.PHASE_SECONDS, phase='afternoon')
+    def _fill_afternoon_shift(self, schedule, coverage, pool, day, month, year, weekday):
+        '''Greedy solver: move people to the afternoon shift until it has enough of them.'''
         # Handle afternoon shift coverage (school-wide, not location-specific)
         if weekday in self.orari_pomeriggio and self.orari_pomeriggio[weekday].get('attivo'):
-            afternoon_end = self.orari_pomeriggio[weekday]['ora_fine']
             required_afternoon = self.orari_pomeriggio[weekday]['num_collaboratori']
 
             # Count how many collaborators start work after 9:00 AM across all locations
             afternoon_count = self._count_afternoon_coverage(schedule)
-            print(f"Afternoon coverage: {afternoon_count}/{required_afternoon} (start after 9:00)")
+            if self.trace is not None:
+                self.trace.record(INFO, 'afternoon_coverage', present=afternoon_count, required=required_afternoon)
 
             while afternoon_count < required_afternoon:
-                substitute = self.find_substitute(schedule, "substitute", needed_luogo_id=None)
+                substitute = self.find_substitute(schedule, "substitute", needed_luogo_id=None, coverage=coverage, pool=pool)
                 if substitute:
-                    # Calculate shifted hours
-                    original_start = substitute['orari_settimanali'][weekday]['inizio']
-                    original_end = substitute['orari_settimanali'][weekday]['fine']
-                    new_start, new_end = self._shift_hours_for_afternoon(original_start, original_end, afternoon_end)
-
-                    # Find who they're replacing for afternoon
-                    absent_afternoon = self._find_absent_afternoon_collaborator(day, month, year, weekday)
-
-                    print(f"Found afternoon substitute Collaboratore ID {substitute['id']}: {new_start}-{new_end}")
-
-                    # Store afternoon substitutes separately (not tied to a specific location)
-                    if 'afternoon_subs' not in schedule:
-                        schedule['afternoon_subs'] = []
-                    schedule['afternoon_subs'].append({
-                        'collaboratore_id': substitute['id'],
-                        'start': new_start,
-                        'end': new_end,
-                        'is_substitute': True,
-                        'is_afternoon_sub': True,
-                        'replaces_id': absent_afternoon['id'] if absent_afternoon else None,
-                        'original_luogo_id': substitute['luogo_id']
-                    })
+                    self._place_afternoon_substitute(schedule, coverage, pool, substitute, day, month, year, weekday)
                     afternoon_count += 1
+                    metrics.SUBSTITUTES.inc(kind='afternoon')
+                    depth = 1
 
-                    # Update luogo_info and check if substitute's original location now needs coverage
-                    luogo_info = self._calculate_luogo_info(schedule)
+                    # Check if substitute's original location now needs coverage
                     substitute_original_luogo = substitute['luogo_id']
-                    if substitute_original_luogo in luogo_info and luogo_info[substitute_original_luogo].startswith("-"):
-                        print(f"Afternoon substitute's original location (Luogo ID {substitute_original_luogo}) now needs coverage")
+                    if substitute_original_luogo in coverage and coverage.balance(substitute_original_luogo) < 0:
+                        if self.trace is not None:
+                            self.trace.record(INFO, 'cascade_needed', luogo_id=substitute_original_luogo,
+                                              left_by=substitute['id'])
                         # Find a substitute for the substitute's original location
-                        cascading_substitute = self.find_substitute(schedule, "substitute", needed_luogo_id=substitute_original_luogo)
+                        cascading_substitute = self.find_substitute(schedule, "substitute", needed_luogo_id=substitute_original_luogo, coverage=coverage, pool=pool)
                         if cascading_substitute:
-                            print(f"Found cascading substitute Collaboratore ID {cascading_substitute['id']} for Luogo ID {substitute_original_luogo}")
-                            if substitute_original_luogo not in schedule:
-                                schedule[substitute_original_luogo] = []
-                            schedule[substitute_original_luogo].append({
-                                'collaboratore_id': cascading_substitute['id'],
-                                'start': cascading_substitute['orari_settimanali'][weekday]['inizio'],
-                                'end': cascading_substitute['orari_settimanali'][weekday]['fine'],
-                                'is_substitute': True,
-                                'replaces_id': substitute['id'],
-                                'original_luogo_id': cascading_substitute['luogo_id']
-                            })
-                            # Update luogo_info again after cascading substitution
-                            luogo_info = self._calculate_luogo_info(schedule)
+                            cascading_start, cascading_end = self._orari_by_id[cascading_substitute['id']][weekday]
+                            self._add_to_schedule(schedule, coverage, pool, substitute_original_luogo, Assignment(
+                                cascading_substitute['id'], cascading_start, cascading_end,
+                                is_substitute=True,
+                                replaces_id=substitute['id'],
+                                original_luogo_id=cascading_substitute['luogo_id']
+                            ))
+                            metrics.SUBSTITUTES.inc(kind='cascade')
+                            depth += 1
                         else:
-                            print(f"No cascading substitute found for Luogo ID {substitute_original_luogo}")
+                            if self.trace is not None:
+                                self.trace.record(WARNING, 'no_substitute', luogo_id=substitute_original_luogo)
+                            metrics.UNFILLED.inc(kind='afternoon')
+                    metrics.CASCADE_DEPTH.observe(depth)
                 else:
-                    print("No available substitute found for afternoon coverage.")
+                    if self.trace is not None:
+                        self.trace.record(WARNING, 'no_substitute', luogo_id=None,
+                                          missing=required_afternoon - afternoon_count)
+                    metrics.UNFILLED.inc(required_afternoon - afternoon_count, kind='afternoon')
                     break
-        return schedule
-    
+
+    def _place_substitute(self, schedule, coverage, pool, luogo_id, substitute, day, month, year, weekday):
+        '''Put a substitute in a luogo short of people, for the morning gap of a turnazione or the whole day.'''
+        normal_start, normal_end = self._orari_by_id[substitute['id']][weekday]
+
+        # Check if shortage is due to turnazione
+        turnazione_person, turnazione_start = self._find_turnazione_at_location(luogo_id, weekday, month, year)
+
+        if turnazione_person:
+            # Someone at this location has shifted hours for afternoon
+            # Substitute only needs to cover the morning gap
+            if self.trace is not None:
+                self.trace.record(INFO, 'substitute_placed', collaboratore_id=substitute['id'], luogo_id=luogo_id,
+                                  replaces_id=turnazione_person['id'], until=format_time(turnazione_start))
+            self._add_to_schedule(schedule, coverage, pool, luogo_id, Assignment(
+                substitute['id'], normal_start, normal_end,
+                partial_end=turnazione_start,
+                is_substitute=True,
+                replaces_id=turnazione_person['id'],
+                original_luogo_id=substitute['luogo_id']
+            ))
+        else:
+            # Regular absence, full day substitution
+            absent_collaboratore = self._find_absent_collaborator(luogo_id, day, month, year)
+
+            if self.trace is not None:
+                self.trace.record(INFO, 'substitute_placed', collaboratore_id=substitute['id'], luogo_id=luogo_id,
+                                  replaces_id=absent_collaboratore['id'] if absent_collaboratore else None)
+            self._add_to_schedule(schedule, coverage, pool, luogo_id, Assignment(
+                substitute['id'], normal_start, normal_end,
+                is_substitute=True,
+                replaces_id=absent_collaboratore['id'] if absent_collaboratore else None,
+                original_luogo_id=substitute['luogo_id']
+            ))
+
+    def _place_afternoon_substitute(self, schedule, coverage, pool, substitute, day, month, year, weekday):
+        '''Move a substitute to the afternoon shift, keeping the length of their working day.'''
+        # Calculate shifted hours
+        original_start, original_end = self._orari_by_id[substitute['id']][weekday]
+        new_start, new_end = self._shift_hours_for_afternoon(
+            original_start, original_end, self._afternoon_end_by_weekday[weekday]
+        )
+
+        # Find who they're replacing for afternoon
+        absent_afternoon = self._find_absent_afternoon_collaborator(day, month, year, weekday)
+
+        if self.trace is not None:
+            self.trace.record(INFO, 'afternoon_substitute_placed', collaboratore_id=substitute['id'],
+                              start=format_time(new_start), end=format_time(new_end),
+                              replaces_id=absent_afternoon['id'] if absent_afternoon else None)
+
+        # Store afternoon substitutes separately (not tied to a specific location)
+        self._leave_home(schedule, coverage, substitute['id'])
+        schedule.add_afternoon_sub(Assignment(
+            substitute['id'], new_start, new_end,
+            is_substitute=True,
+            is_afternoon_sub=True,
+            replaces_id=absent_afternoon['id'] if absent_afternoon else None,
+            original_luogo_id=substitute['luogo_id']
+        ))
+        if pool is not None:
+            pool.mark_assigned(substitute['id'])
+
+    @metrics.timed(metrics.PHASE_SECONDS, phase='substitution')
+    def _solve_with_flow(self, schedule, coverage, day, month, year, weekday):
+        '''
+        Fill the morning deficits and the afternoon shift in one pass with the
+        min-cost-flow solver (see solver.py) instead of the greedy loop.
+        '''
+        target_date = date(year, month, day)
+        ranks = solver.sub_order_ranks(self.sub_order, self._luoghi_by_id)
+        last_rank = max(ranks.values(), default=0)
+
+        demands = {}
+        for luogo_id in self._luoghi_by_id:
+            balance = coverage.balance(luogo_id)
+            if balance < 0:
+                # The later in sub_order, the more essential the luogo
+                demands[luogo_id] = (-balance, (last_rank + 1 - ranks[luogo_id]) * solver.PRIORITY_STEP)
+        if weekday in self.orari_pomeriggio and self.orari_pomeriggio[weekday].get('attivo'):
+            missing = self.orari_pomeriggio[weekday]['num_collaboratori'] - self._count_afternoon_coverage(schedule)
+            if missing > 0:
+                demands[solver.AFTERNOON] = (missing, (last_rank + 2) * solver.PRIORITY_STEP)
+        if not demands:
+            return
+
+        donors = {
+            luogo_id: (coverage.balance(luogo_id), ranks[luogo_id] * solver.DONOR_STEP)
+            for luogo_id in coverage.surplus_luoghi()
+        }
+
+        # Whoever counts for the morning coverage of their own luogo can move,
+        # unless they are fixed there
+        candidates = []
+        for luogo_id in donors:
+            for assignment in schedule.assignments(luogo_id):
+                collaboratore = self._get_collaboratore_by_id(assignment.collaboratore_id)
+                if (collaboratore is None or collaboratore.get('luogo_id') != luogo_id
+                        or collaboratore.get('fisso_nel_luogo') or assignment.start > MORNING_COVERAGE_LIMIT):
+                    continue
+                window_load = self._window_loads.get(collaboratore['id'], (0, 0))[0] if self._window_loads else 0
+                candidates.append((
+                    collaboratore['id'], luogo_id, solver.fairness_cost(collaboratore, target_date, window_load),
+                    collaboratore.get('luogo_secondario_id')
+                ))
+        # Equal costs keep self.collaboratori order
+        candidates.sort(key=lambda candidate: self._collaboratore_pos[candidate[0]])
+
+        metrics.CANDIDATES_EXAMINED.inc(len(candidates))
+
+        placed = {}
+        for collab_id, target in solver.solve(donors, candidates, demands):
+            substitute = self._get_collaboratore_by_id(collab_id)
+            if target == solver.AFTERNOON:
+                self._place_afternoon_substitute(schedule, coverage, None, substitute, day, month, year, weekday)
+                metrics.SUBSTITUTES.inc(kind='afternoon')
+            else:
+                self._place_substitute(schedule, coverage, None, target, substitute, day, month, year, weekday)
+                metrics.SUBSTITUTES.inc(kind='morning')
+            # Donors only give their surplus: a deficit never needs a cascade
+            metrics.CASCADE_DEPTH.observe(1)
+            placed[target] = placed.get(target, 0) + 1
+
+        for luogo_id, (amount, _) in demands.items():
+            if luogo_id == solver.AFTERNOON:
+                if placed.get(luogo_id, 0) < amount:
+                    metrics.UNFILLED.inc(amount - placed.get(luogo_id, 0), kind='afternoon')
+            elif coverage.balance(luogo_id) < 0:
+                metrics.UNFILLED.inc(-coverage.balance(luogo_id), kind='morning')
+                if self.trace is not None:
+                    self.trace.record(WARNING, 'no_substitute', luogo_id=luogo_id, missing=-coverage.balance(luogo_id))
+
     def parse_result(self, schedule, weekday):
         result = {}
         for luogo_id, collaboratori in schedule.items():
-            # Skip special keys that are not location IDs
-            if luogo_id in ['afternoon_subs', 'cleaning_overtime']:
-                continue
             # Get string of luogo
-            luogo = self._get_luogo_by_id(int(luogo_id))
+            luogo = self._get_luogo_by_id(luogo_id)
             if not luogo:
                 continue
             luogo_str = luogo['nome']
             if luogo_str not in result:
                 result[luogo_str] = {}
             for collaboratore in collaboratori:
-                collab_id = collaboratore['collaboratore_id']
-                collab = self._get_collaboratore_by_id(collab_id)
+                collab = self._get_collaboratore_by_id(collaboratore.collaboratore_id)
                 if not collab:
                     continue
                 collab_str = f"{collab['cognome']} {collab['nome']}"
-                if not "original_luogo_id" in collaboratore or len(collaboratori) == 1:
+                if not collaboratore.is_substitute or len(collaboratori) == 1:
                     result[luogo_str][collab_str] = {
-                        'start': collaboratore['start'],
-                        'end': collaboratore['end']
+                        'start': format_time(collaboratore.start),
+                        'end': format_time(collaboratore.end)
                     }
                 else:
                     # This was a substitution. If it substituted someone who
@@ -642,42 +959,34 @@ class Generator:
                     # they need to go back to their original location.
                     # So first we check if the other person was doing
                     # the afternoon shift.
-                    print("Substitution detected for", collab_str)
-                    for other_collaboratore in [c for c in collaboratori if c != collaboratore]:
-                        other_start = other_collaboratore['start']
+                    for other_collaboratore in [c for c in collaboratori if c is not collaboratore]:
+                        other_start = other_collaboratore.start
                         # Check if it is greater than their usual start time
-                        other_collab = self._get_collaboratore_by_id(other_collaboratore['collaboratore_id'])
+                        other_collab = self._get_collaboratore_by_id(other_collaboratore.collaboratore_id)
                         if not other_collab:
                             continue
-                        other_weekday_schedule = other_collab['orari_settimanali'].get(weekday)
+                        other_weekday_schedule = self._orari_by_id[other_collab['id']].get(weekday)
                         if not other_weekday_schedule:
                             continue
-                        other_usual_start = other_weekday_schedule.get('inizio')
-                        if not other_usual_start:
-                            continue
-                        # Convert time strings to datetime objects for comparison
-                        other_start_hour, other_start_minute = map(int, other_start.split(':'))
-                        other_start_time = time(other_start_hour, other_start_minute)
+                        other_usual_start = other_weekday_schedule[0]
 
-                        other_usual_start_hour, other_usual_start_minute = map(int, other_usual_start.split(':'))
-                        other_usual_start_time = time(other_usual_start_hour, other_usual_start_minute)
-
-                        if other_start_time > other_usual_start_time:
-                            original_luogo = self._get_luogo_by_id(collaboratore['original_luogo_id'])
+                        if other_start > other_usual_start:
+                            original_luogo = self._get_luogo_by_id(collaboratore.original_luogo_id)
                             move_back_name = original_luogo['nome'] if original_luogo else 'Sconosciuto'
                             result[luogo_str][collab_str] = {
-                                'start': collaboratore['start'],
-                                'partial_end': other_start,
+                                'start': format_time(collaboratore.start),
+                                'partial_end': format_time(other_start),
                                 'move_back_to': move_back_name,
-                                'end': collaboratore['end']
+                                'end': format_time(collaboratore.end)
                             }
                         else:
                             result[luogo_str][collab_str] = {
-                                'start': collaboratore['start'],
-                                'end': collaboratore['end']
+                                'start': format_time(collaboratore.start),
+                                'end': format_time(collaboratore.end)
                             }
         return dict(sorted(result.items()))
 
+    @metrics.timed(metrics.PHASE_SECONDS, phase='parse_substitutions')
     def parse_substitutions_only(self, schedule):
         '''
         Parse only substitutions and return as a formatted string.
@@ -686,11 +995,7 @@ class Generator:
 
         # Process location-based substitutes
         for luogo_id, collaboratori in schedule.items():
-            # Skip special keys
-            if luogo_id in ['afternoon_subs', 'cleaning_overtime']:
-                continue
-
-            luogo = self._get_luogo_by_id(int(luogo_id))
+            luogo = self._get_luogo_by_id(luogo_id)
             if not luogo:
                 continue
             luogo_str = luogo['nome']
@@ -698,21 +1003,20 @@ class Generator:
 
             for collaboratore in collaboratori:
                 # Only include substitutes
-                if collaboratore.get('is_substitute', False):
-                    collab_id = collaboratore['collaboratore_id']
-                    collab = self._get_collaboratore_by_id(collab_id)
+                if collaboratore.is_substitute:
+                    collab = self._get_collaboratore_by_id(collaboratore.collaboratore_id)
                     if not collab:
                         continue
                     collab_str = f"{collab['cognome']} {collab['nome']}"
-                    start = collaboratore['start']
-                    end = collaboratore['end']
+                    start = format_time(collaboratore.start)
+                    end = format_time(collaboratore.end)
 
                     # Check if it's a partial substitution (covering morning gap for turnazione)
-                    if 'partial_end' in collaboratore and 'original_luogo_id' in collaboratore:
-                        partial_end = collaboratore['partial_end']
-                        original_luogo = self._get_luogo_by_id(collaboratore['original_luogo_id'])
+                    if collaboratore.partial_end is not None:
+                        partial_end = format_time(collaboratore.partial_end)
+                        original_luogo = self._get_luogo_by_id(collaboratore.original_luogo_id)
                         original_luogo_str = original_luogo['nome'] if original_luogo else 'Sconosciuto'
-                        replaces_id = collaboratore.get('replaces_id')
+                        replaces_id = collaboratore.replaces_id
                         if replaces_id:
                             absent_collab = self._get_collaboratore_by_id(replaces_id)
                             absent_str = f"{absent_collab['cognome']} {absent_collab['nome']}" if absent_collab else 'Sconosciuto'
@@ -721,7 +1025,7 @@ class Generator:
                             subs_for_location.append(f"- {collab_str} entra alle {start}, alle {partial_end} torna a {original_luogo_str}, esce alle {end}")
                     else:
                         # Regular full-day substitution
-                        replaces_id = collaboratore.get('replaces_id')
+                        replaces_id = collaboratore.replaces_id
                         if replaces_id:
                             absent_collab = self._get_collaboratore_by_id(replaces_id)
                             absent_str = f"{absent_collab['cognome']} {absent_collab['nome']}" if absent_collab else 'Sconosciuto'
@@ -736,18 +1040,17 @@ class Generator:
                 result.append("")  # Empty line between locations
 
         # Process afternoon substitutes separately
-        if 'afternoon_subs' in schedule:
+        if schedule.afternoon_subs:
             result.append("POMERIGGIO:")
-            for collaboratore in schedule['afternoon_subs']:
-                collab_id = collaboratore['collaboratore_id']
-                collab = self._get_collaboratore_by_id(collab_id)
+            for collaboratore in schedule.afternoon_subs:
+                collab = self._get_collaboratore_by_id(collaboratore.collaboratore_id)
                 if not collab:
                     continue
                 collab_str = f"{collab['cognome']} {collab['nome']}"
-                start = collaboratore['start']
-                end = collaboratore['end']
+                start = format_time(collaboratore.start)
+                end = format_time(collaboratore.end)
 
-                replaces_id = collaboratore.get('replaces_id')
+                replaces_id = collaboratore.replaces_id
                 if replaces_id:
                     absent_collab = self._get_collaboratore_by_id(replaces_id)
                     absent_str = f"{absent_collab['cognome']} {absent_collab['nome']}" if absent_collab else 'Sconosciuto'
@@ -757,21 +1060,21 @@ class Generator:
             result.append("")
 
         # Process cleaning overtime assignments
-        if 'cleaning_overtime' in schedule and schedule['cleaning_overtime']:
+        if schedule.cleaning_overtime:
             result.append("STRAORDINARI PER PULIZIA:")
-            for cleaning in schedule['cleaning_overtime']:
-                collab_id = cleaning['collaboratore_id']
-                collab = self._get_collaboratore_by_id(collab_id)
+            for cleaning in schedule.cleaning_overtime:
+                collab = self._get_collaboratore_by_id(cleaning.collaboratore_id)
                 if not collab:
                     continue
                 collab_str = f"{collab['cognome']} {collab['nome']}"
-                location_name = cleaning['location_name']
-                overtime_minutes = cleaning['overtime_minutes']
+                location_name = cleaning.location_name
+                overtime_minutes = cleaning.overtime_minutes
                 result.append(f"- {collab_str}: {overtime_minutes} minuti per pulizia di {location_name}")
             result.append("")
 
         return "\n".join(result).strip()
 
+    @metrics.timed(metrics.PHASE_SECONDS, phase='cleaning_overtime')
     def assign_cleaning_overtime(self, schedule, weekday):
         """
         Assigns cleaning overtime to collaborators when someone is missing from a location.
@@ -780,20 +1083,20 @@ class Generator:
         of cleaning overtime.
         """
         # Initialize cleaning_overtime list if not exists
-        if 'cleaning_overtime' not in schedule:
-            schedule['cleaning_overtime'] = []
+        if schedule.cleaning_overtime is None:
+            schedule.cleaning_overtime = []
 
         # Track who has already been assigned cleaning overtime today (max 20 minutes per day)
         assigned_today = set()
 
         # For each location, count how many people normally work there
-        locations_normal_count = {}
-        for collaboratore in self.collaboratori:
-            luogo_id = collaboratore.get('luogo_id')
-            if luogo_id is not None:
-                if luogo_id not in locations_normal_count:
-                    locations_normal_count[luogo_id] = 0
-                locations_normal_count[luogo_id] += 1
+        locations_normal_count = {
+            luogo_id: len(collaboratori)
+            for luogo_id, collaboratori in self._collaboratori_by_luogo.items()
+        }
+
+        # Whoever is physically at a location at the end of their day can clean it
+        present_at_end = self._occupancy(schedule).present_at_end()
 
         # For each location, count how many people are present at the end of the day
         for luogo_id, normal_count in locations_normal_count.items():
@@ -803,94 +1106,42 @@ class Generator:
                 continue
 
             if luogo.get('no_cleaning_needed', False):
-                print(f"Location {luogo['nome']} doesn't need cleaning, skipping")
+                if self.trace is not None:
+                    self.trace.record(DEBUG, 'cleaning_skipped', luogo_id=luogo_id, reason='no_cleaning_needed')
                 continue
 
             # Count people present at the end of day at this location
-            present_count = self._count_present_at_end_of_day(schedule, luogo_id)
+            present_count = present_at_end.get(luogo_id, 0)
 
             missing_count = normal_count - present_count
 
             if missing_count > 0:
-                print(f"Location {luogo['nome']} is missing {missing_count} people for cleaning")
+                if self.trace is not None:
+                    self.trace.record(INFO, 'cleaning_needed', luogo_id=luogo_id, missing=missing_count)
 
                 # For each missing person, assign cleaning overtime
                 for _ in range(missing_count):
                     overtime_person = self._find_cleaning_overtime_candidate(schedule, weekday, assigned_today)
 
                     if overtime_person:
-                        print(f"Assigning cleaning overtime to {overtime_person['nome']} {overtime_person['cognome']} for location {luogo['nome']}")
+                        if self.trace is not None:
+                            self.trace.record(INFO, 'cleaning_assigned', collaboratore_id=overtime_person['id'],
+                                              luogo_id=luogo_id, reason='least_straordinari')
 
                         # Mark this person as assigned today (they can't be assigned again)
                         assigned_today.add(overtime_person['id'])
 
+                        metrics.CLEANING_ASSIGNED.inc()
                         # Record the cleaning overtime assignment
-                        schedule['cleaning_overtime'].append({
-                            'collaboratore_id': overtime_person['id'],
-                            'location_id': luogo_id,
-                            'location_name': luogo['nome'],
-                            'overtime_minutes': 20
-                        })
+                        schedule.add_cleaning_overtime(CleaningOvertime(
+                            overtime_person['id'], luogo_id, luogo['nome'], 20
+                        ))
                     else:
-                        print(f"WARNING: No one available for cleaning overtime at location {luogo['nome']}")
+                        if self.trace is not None:
+                            self.trace.record(WARNING, 'cleaning_unassigned', luogo_id=luogo_id)
 
         return schedule
 
-    def _count_present_at_end_of_day(self, schedule, luogo_id):
-        """
-        Count how many people are ACTUALLY present at this location at the end of the day.
-
-        This includes:
-        - People normally assigned there who are present
-        - Regular substitutes working at this location
-        - Afternoon substitutes working at this location
-        - People with turnazione (they come late but leave at normal time, so they can clean)
-
-        The key principle: whoever is physically at a location at end of day can clean that location.
-        """
-        count = 0
-        present_ids = set()
-
-        # First, identify who is doing afternoon shifts elsewhere
-        afternoon_sub_ids = set()
-        if 'afternoon_subs' in schedule:
-            for assignment in schedule['afternoon_subs']:
-                afternoon_sub_ids.add(assignment['collaboratore_id'])
-
-        # Count people in the regular schedule at this location
-        if luogo_id in schedule:
-            for assignment in schedule[luogo_id]:
-                collab_id = assignment['collaboratore_id']
-
-                # Skip if this person is doing afternoon shift elsewhere
-                # (they won't be here at end of day)
-                if collab_id in afternoon_sub_ids:
-                    collab = self._get_collaboratore_by_id(collab_id)
-                    if collab and collab.get('luogo_id') == luogo_id:
-                        # This person normally works here but is doing afternoon elsewhere
-                        continue
-
-                # Anyone assigned to this location at end of day can clean
-                if 'end' in assignment:
-                    present_ids.add(collab_id)
-                    count += 1
-
-        # Count afternoon substitutes at this location
-        if 'afternoon_subs' in schedule:
-            for assignment in schedule['afternoon_subs']:
-                # Check if this afternoon sub is assigned to this location
-                # Afternoon subs replace someone, so we need to find which location
-                replaces_id = assignment.get('replaces_id')
-                if replaces_id:
-                    replaced_collab = self._get_collaboratore_by_id(replaces_id)
-                    if replaced_collab and replaced_collab.get('luogo_id') == luogo_id:
-                        # This afternoon sub is covering this location
-                        collab_id = assignment['collaboratore_id']
-                        if collab_id not in present_ids:
-                            count += 1
-
-        return count
-
     def _find_cleaning_overtime_candidate(self, schedule, weekday, assigned_today):
         """
         Find the best candidate for cleaning overtime.
@@ -898,22 +1149,15 @@ class Generator:
         - Must be present that day
         - Must not have no_overtime_allowed flag set
         - Must not have already been assigned cleaning overtime today (max 20 min/day)
-        - Select the one with least straordinari_svolti
+        - Select the one with least straordinari_svolti (with a fairness
+          window, the least overtime minutes in it first)
         """
         candidates = []
 
-        # Get all collaborators who are present that day
-        present_ids = set()
-        for luogo_id, assignments in schedule.items():
-            if luogo_id == 'afternoon_subs' or luogo_id == 'cleaning_overtime':
-                continue
-            for assignment in assignments:
-                present_ids.add(assignment['collaboratore_id'])
-
         # Filter candidates
         for collaboratore in self.collaboratori:
             # Must be present that day
-            if collaboratore['id'] not in present_ids:
+            if not schedule.is_present(collaboratore['id']):
                 continue
 
             # Must be able to do overtime
@@ -934,25 +1178,139 @@ class Generator:
             return None
 
         # Select the one with least overtime
-        min_overtime = min(c.get('straordinari_svolti', 0) for c in candidates)
+        overtime = lambda c: c.get('straordinari_svolti', 0)
+        if self._window_loads is not None:
+            loads = self._window_loads
+            overtime = lambda c: (loads.get(c['id'], (0, 0))[1], c.get('straordinari_svolti', 0))
+        min_overtime = min(overtime(c) for c in candidates)
         for candidate in candidates:
-            if candidate.get('straordinari_svolti', 0) == min_overtime:
+            if overtime(candidate) == min_overtime:
                 return candidate
 
         return None
 
     def generate(self, day, month, year, weekday):
+        '''Generate one day: substitutions, cleaning overtime and their text, as a GenerationResult.'''
         schedule = self.generate_schedule(day, month, year, weekday)
 
         # Assign cleaning overtime if needed
         schedule = self.assign_cleaning_overtime(schedule, weekday)
 
-        with open("final_schedule_after_substitutions.json", "w") as final_file:
-            json.dump(schedule, final_file, indent=4)
+        if self.debug_sink is not None:
+            self.debug_sink.dump("final_schedule_after_substitutions", schedule.to_dict())
 
         substitutions_text = self.parse_substitutions_only(schedule)
 
-        with open("parsed_schedule.json", "w") as parsed_file:
-            json.dump({"substitutions_text": substitutions_text}, parsed_file, indent=4)
+        if self.debug_sink is not None:
+            self.debug_sink.dump("parsed_schedule", {"substitutions_text": substitutions_text})
+
+        return GenerationResult(schedule, substitutions_text)
+
+    def school_days(self):
+        '''Weekdays on which somebody has working hours.'''
+        return {giorno for orari in self._orari_by_id.values() for giorno in orari}
 
-        return substitutions_text
\ No newline at end of file
+    def plan_range(self, start, end):
+        '''
+        Build the schedule of every school day from start to end (dates, both
+        included), yielding (date, weekday, schedule).
+
+        After each day ultima_sostituzione and straordinari_svolti (and the
+        ledger, with a fairness window) are updated in memory like
+        /ufficializza does, so the following days see the substitutions
+        already planned. Nothing is written to disk and the
+        loaded data is left as it was.
+        '''
+        school_days = self.school_days()
+
+        original_collaboratori = self.collaboratori
+        original_ledger = self.ledger
+        debug_sink = self.debug_sink
+        # Work on copies, the loaded records are shared through the dataset cache
+        self.collaboratori = [dict(collaboratore) for collaboratore in original_collaboratori]
+        if original_ledger is not None:
+            self.ledger = original_ledger.copy()
+        self.debug_sink = None
+        self._build_indexes()
+        try:
+            current = start
+            while current <= end:
+                weekday = WEEKDAYS[current.weekday()]
+                if weekday in school_days:
+                    schedule = self.generate_schedule(current.day, current.month, current.year, weekday)
+                    schedule = self.assign_cleaning_overtime(schedule, weekday)
+                    if self.ledger is not None:
+                        self.ledger.add_entries(entries_for(schedule, current.isoformat(),
+                                                            self._collaboratori_by_id, None))
+                    apply_official_schedule(self._collaboratori_by_id, schedule, current.isoformat())
+                    yield current, weekday, schedule
+                current += timedelta(days=1)
+        finally:
+            self.collaboratori = original_collaboratori
+            self.ledger = original_ledger
+            self.debug_sink = debug_sink
+            self._build_indexes()
+
+    def generate_range(self, start, end):
+        '''Like plan_range(), but yields one JSON-ready record per day.'''
+        for current, weekday, schedule in self.plan_range(start, end):
+            yield {
+                'data': current.isoformat(),
+                'giorno': weekday,
+                'sostituzioni': self.parse_substitutions_only(schedule),
+                'schedule': schedule.to_dict()
+            }
+
+    def missing_by_luogo(self, schedule):
+        '''{luogo_id: people missing} for the luoghi left below their minimum in the morning.'''
+        coverage = self._calculate_coverage(schedule)
+        missing = {}
+        for luogo_id in self._luoghi_by_id:
+            if coverage.balance(luogo_id) < 0:
+                missing[luogo_id] = -coverage.balance(luogo_id)
+        return missing
+
+def apply_official_schedule(collaboratori_by_id, schedule, date_str):
+    '''
+    Record a confirmed day on the collaboratori records: the date of the last
+    substitution for every substitute and the cleaning minutes as overtime.
+    '''
+    for collab_id in schedule.substitute_ids():
+        if collab_id in collaboratori_by_id:
+            collaboratori_by_id[collab_id]['ultima_sostituzione'] = date_str
+
+    for cleaning in schedule.cleaning_overtime or []:
+        if cleaning.collaboratore_id in collaboratori_by_id:
+            collaboratore = collaboratori_by_id[cleaning.collaboratore_id]
+            current_overtime = collaboratore.get('straordinari_svolti', 0)
+            collaboratore['straordinari_svolti'] = current_overtime + cleaning.overtime_minutes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate the substitutions of a date range, one NDJSON record per school day")
+    parser.add_argument('--from', dest='start', required=True, type=date.fromisoformat, help="first day, YYYY-MM-DD")
+    parser.add_argument('--to', dest='end', required=True, type=date.fromisoformat, help="last day (included), YYYY-MM-DD")
+    parser.add_argument('--data-dir', default=None, help="directory with the JSON data files (default: data/)")
+    parser.add_argument('--solver', choices=SOLVERS, default='greedy', help="how substitutes are picked")
+    parser.add_argument('--seed', type=int, default=None, help="seed of the random tie-breaks, for repeatable output")
+    parser.add_argument('--fairness', choices=WINDOWS, default=None,
+                        help="rank candidates by their load in this window of the ledger first")
+    parser.add_argument('--trace', choices=LEVELS, default=None, help="write the decision trace of every day to stderr")
+    args = parser.parse_args(argv)
+    if args.end < args.start:
+        parser.error("--to precede --from")
+
+    generator = Generator(data_dir=args.data_dir, solver=args.solver, seed=args.seed, fairness=args.fairness)
+    if args.trace:
+        generator.trace = DecisionTrace(LEVELS[args.trace])
+    for record in generator.generate_range(args.start, args.end):
+        if generator.trace is not None:
+            # One trace per day, kept off the NDJSON stream
+            sys.stderr.write(f"# {record['data']}\n" + "".join(line + "\n" for line in generator.trace.lines()))
+            generator.trace = DecisionTrace(LEVELS[args.trace])
+        sys.stdout.write(json.dumps(record, ensure_ascii=False) + "\n")
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file
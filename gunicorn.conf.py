@@ -0,0 +1,8 @@
+# Read by gunicorn from the working directory, see the Dockerfile
+
+
+def post_worker_init(worker):
+    # The job dispatcher runs in every worker, never in the master before the
+    # fork: this also picks up the jobs queued or orphaned before a restart
+    from app import job_queue
+    job_queue.start()
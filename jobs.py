@@ -0,0 +1,241 @@
+'''
+Background jobs for the generations too long for a request.
+
+A job is a kind (a key of the handlers given to the JobQueue) and JSON
+parameters. submit() stores it in a SQLite file and returns its id; a
+dispatcher thread in every process claims queued jobs and runs them on a
+thread pool, never more than max_running at once across all the processes
+sharing the file. A handler is called as handler(params, report) and
+returns a JSON-ready result; it calls report(done, total) as it goes, which
+records the progress and raises JobCancelled once cancel() was asked.
+
+Jobs are in the file, so they survive a restart. A running job is leased
+to the process instance that claimed it, under a token unique to it (not
+its pid or host name, which a restarted or recreated container hands out
+again): the dispatcher of that process renews the lease every few
+seconds, and a job whose lease is older than lease_seconds, because its
+process is gone, goes back to the queue and starts over.
+
+    queue = JobQueue('data/jobs.sqlite3', {'intervallo': plan_range_job})
+    queue.start()
+    job_id = queue.submit('intervallo', {'dal': '2026-02-02', 'al': '2026-02-27'})
+    queue.get(job_id)['status']     # queued, running, done, failed, cancelled
+'''
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED = (DONE, FAILED, CANCELLED)
+
+DEFAULT_MAX_RUNNING = 2
+POLL_SECONDS = 0.5
+# A running job whose owner did not renew it for this long is orphaned
+LEASE_SECONDS = 30
+
+logger = logging.getLogger(__name__)
+
+
+class JobCancelled(Exception):
+    '''Raised by report() inside a job whose cancellation was asked.'''
+
+
+class JobQueue:
+    '''Jobs persisted in a SQLite file, run by a thread pool in every process.'''
+
+    def __init__(self, path, handlers, max_running=DEFAULT_MAX_RUNNING, poll_seconds=POLL_SECONDS,
+                 lease_seconds=LEASE_SECONDS):
+        if max_running < 1:
+            raise ValueError("Deve poter girare almeno un lavoro")
+        self.path = path
+        self.handlers = handlers
+        self.max_running = max_running
+        self.poll_seconds = poll_seconds
+        self.lease_seconds = lease_seconds
+        self._local = threading.local()
+        self._executor = None
+        self._dispatcher = None
+        self._starting = threading.Lock()
+        self._stopping = threading.Event()
+        self._owner_token = None
+        self._owner_pid = None
+        self._renewed = 0
+        # Jobs of this process on the pool
+        self._active = set()
+        self._active_lock = threading.Lock()
+
+    def _owner(self):
+        '''Token of this queue in this process, a fork gets its own.'''
+        if self._owner_pid != os.getpid():
+            self._owner_token = uuid.uuid4().hex
+            self._owner_pid = os.getpid()
+        return self._owner_token
+
+    def _connection(self):
+        # sqlite3 connections belong to one thread, and must not survive a fork
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("CREATE TABLE IF NOT EXISTS jobs ("
+                               "id TEXT PRIMARY KEY, kind TEXT NOT NULL, params TEXT NOT NULL, "
+                               "status TEXT NOT NULL, done INTEGER NOT NULL DEFAULT 0, total INTEGER, "
+                               "result TEXT, error TEXT, owner TEXT, cancel INTEGER NOT NULL DEFAULT 0, "
+                               "created REAL NOT NULL, updated REAL NOT NULL)")
+            connection.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created)")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def submit(self, kind, params):
+        '''Queue a job; returns its id.'''
+        if kind not in self.handlers:
+            raise ValueError(f"Tipo di lavoro sconosciuto: {kind} (disponibili: {', '.join(self.handlers)})")
+        job_id = uuid.uuid4().hex[:12]
+        now = time.time()
+        self._connection().execute(
+            "INSERT INTO jobs (id, kind, params, status, created, updated) VALUES (?, ?, ?, ?, ?, ?)",
+            (job_id, kind, json.dumps(params, ensure_ascii=False), QUEUED, now, now))
+        return job_id
+
+    def get(self, job_id, with_result=True):
+        '''The job as a dict, or None if there is no such job.'''
+        row = self._connection().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = {
+            'id': row['id'], 'tipo': row['kind'], 'parametri': json.loads(row['params']),
+            'status': row['status'], 'fatti': row['done'], 'totale': row['total'],
+            'errore': row['error'], 'annullamento': bool(row['cancel']),
+            'creato': row['created'], 'aggiornato': row['updated'],
+        }
+        if with_result:
+            job['risultato'] = json.loads(row['result']) if row['result'] is not None else None
+        return job
+
+    def cancel(self, job_id):
+        '''
+        Cancel a job: a queued one at once, a running one at its next
+        report(). False if it had already finished or does not exist.
+        '''
+        connection = self._connection()
+        now = time.time()
+        if connection.execute("UPDATE jobs SET status = ?, cancel = 1, updated = ? WHERE id = ? AND status = ?",
+                              (CANCELLED, now, job_id, QUEUED)).rowcount:
+            return True
+        return bool(connection.execute("UPDATE jobs SET cancel = 1, updated = ? WHERE id = ? AND status = ?",
+                                       (now, job_id, RUNNING)).rowcount)
+
+    def start(self):
+        '''Start the dispatcher of this process, if not already running.'''
+        with self._starting:
+            if self._dispatcher is not None and self._dispatcher.is_alive():
+                return
+            self._stopping.clear()
+            self._executor = ThreadPoolExecutor(self.max_running, thread_name_prefix='job')
+            self._dispatcher = threading.Thread(target=self._dispatch_loop, name='job-dispatcher', daemon=True)
+            self._dispatcher.start()
+
+    def stop(self, wait=True):
+        '''Stop claiming jobs; with wait, also let the running ones finish.'''
+        self._stopping.set()
+        if self._dispatcher is not None:
+            self._dispatcher.join()
+            self._dispatcher = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
+
+    def _dispatch_loop(self):
+        while not self._stopping.is_set():
+            try:
+                self._renew()
+                while len(self._active) < self.max_running:
+                    job_id = self._claim()
+                    if job_id is None:
+                        break
+                    with self._active_lock:
+                        self._active.add(job_id)
+                    self._executor.submit(self._run, job_id)
+            except sqlite3.Error:
+                logger.exception("Coda dei lavori non disponibile")
+            self._stopping.wait(self.poll_seconds)
+
+    def _renew(self):
+        '''Renew the lease of the jobs this process runs, a few times per lease.'''
+        now = time.time()
+        if not self._active or now - self._renewed < self.lease_seconds / 3:
+            return
+        self._connection().execute("UPDATE jobs SET updated = ? WHERE owner = ? AND status = ?",
+                                   (now, self._owner(), RUNNING))
+        self._renewed = now
+
+    def _claim(self):
+        '''Mark the oldest queued job as ours, if the cap allows; returns its id or None.'''
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            running = connection.execute("SELECT id, updated FROM jobs WHERE status = ?", (RUNNING,)).fetchall()
+            # Jobs whose lease ran out, their process is gone: they start over
+            orphans = [row['id'] for row in running if row['updated'] < now - self.lease_seconds]
+            for orphan in orphans:
+                connection.execute("UPDATE jobs SET status = CASE WHEN cancel THEN ? ELSE ? END, "
+                                   "owner = NULL, done = 0, updated = ? WHERE id = ?",
+                                   (CANCELLED, QUEUED, now, orphan))
+            job_id = None
+            if len(running) - len(orphans) < self.max_running:
+                row = connection.execute("SELECT id FROM jobs WHERE status = ? ORDER BY created LIMIT 1",
+                                         (QUEUED,)).fetchone()
+                if row is not None:
+                    job_id = row['id']
+                    connection.execute("UPDATE jobs SET status = ?, owner = ?, updated = ? WHERE id = ?",
+                                       (RUNNING, self._owner(), now, job_id))
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return job_id
+
+    def _run(self, job_id):
+        connection = self._connection()
+        try:
+            row = connection.execute("SELECT kind, params FROM jobs WHERE id = ?", (job_id,)).fetchone()
+
+            def report(done, total=None):
+                connection.execute("UPDATE jobs SET done = ?, total = COALESCE(?, total), updated = ? "
+                                   "WHERE id = ? AND owner = ?", (done, total, time.time(), job_id, self._owner()))
+                row = connection.execute("SELECT cancel, owner FROM jobs WHERE id = ?", (job_id,)).fetchone()
+                # Cancelled, or the lease ran out and the job went to someone else
+                if row is None or row['cancel'] or row['owner'] != self._owner():
+                    raise JobCancelled(job_id)
+
+            try:
+                result = self.handlers[row['kind']](json.loads(row['params']), report)
+            except JobCancelled:
+                self._finish(job_id, CANCELLED)
+            except Exception as e:
+                self._finish(job_id, FAILED, error=f"{type(e).__name__}: {e}")
+            else:
+                self._finish(job_id, DONE, result=result)
+        finally:
+            with self._active_lock:
+                self._active.discard(job_id)
+
+    def _finish(self, job_id, status, result=None, error=None):
+        # Only while the job is still ours
+        self._connection().execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, updated = ? WHERE id = ? AND owner = ?",
+            (status, json.dumps(result, ensure_ascii=False) if result is not None else None, error,
+             time.time(), job_id, self._owner()))
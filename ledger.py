@@ -0,0 +1,229 @@
+'''
+History of the official schedules, and the load of every collaboratore in
+a window of days.
+
+The collaboratori records only keep the date of the last substitution and
+a running total of overtime. /ufficializza also appends to the ledger,
+storico.json, one entry per substitution and per cleaning overtime of the
+day:
+
+    {'id': 41, 'ufficializzazione': '3f9c0a1e2b7d', 'data': '2026-01-13',
+     'collaboratore_id': 12, 'tipo': 'sostituzione', 'luogo_id': 3,
+     'minuti': 0, 'precedente': '2025-12-02'}
+
+'precedente' is the value the day replaced on the record (ultima_sostituzione
+or straordinari_svolti), so an official schedule can be undone.
+
+Ledger indexes the entries by collaboratore, with prefix sums of the
+substitutions and of the overtime minutes over the days, so the load of a
+collaboratore in any window of days takes two binary searches however long
+the history is:
+
+    ledger = Ledger.from_entries(dataset.load(LEDGER_FILENAME))
+    substitutions, minutes = ledger.load(12, *window('30d', date(2026, 1, 13)))
+
+shared_ledger() keeps the Ledger built from the entries last loaded, so
+that every generation with a fairness window does not index the whole
+history again.
+'''
+
+import bisect
+import secrets
+import threading
+from datetime import date, timedelta
+
+LEDGER_FILENAME = 'storico.json'
+
+SUBSTITUTION = 'sostituzione'
+OVERTIME = 'straordinario'
+
+ROLLING_DAYS = 30
+# First day (month, day) of each school term: quadrimestri
+TERM_STARTS = ((9, 1), (2, 1))
+
+
+def rolling_window(day, days=ROLLING_DAYS):
+    '''(first, last) day of the `days` days ending with `day`.'''
+    return day - timedelta(days=days - 1), day
+
+
+def term_window(day):
+    '''(first, last) day of the school term `day` is in, up to `day`.'''
+    starts = sorted(date(year, month, start_day)
+                    for year in (day.year - 1, day.year) for month, start_day in TERM_STARTS)
+    return max(start for start in starts if start <= day), day
+
+
+# Windows the engine can rank candidates by
+WINDOWS = {
+    '30d': rolling_window,
+    'term': term_window,
+}
+
+
+def window(name, day):
+    '''(first, last) day of the named window ending with `day`.'''
+    if name not in WINDOWS:
+        raise ValueError(f"Finestra sconosciuta: {name} (disponibili: {', '.join(WINDOWS)})")
+    return WINDOWS[name](day)
+
+
+# key -> (entries, the Ledger built from them), see shared_ledger()
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def shared_ledger(entries, key=None):
+    '''
+    The Ledger of `entries` as returned by dataset.load(), which hands back
+    the same list until the file changes: built once per content, extended
+    with the new entries when the list only grew at the end, rebuilt
+    otherwise (an official schedule undone). One per key, e.g. the data
+    directory. The Ledger is shared: copy() it before adding entries.
+    '''
+    with _shared_lock:
+        previous, ledger = _shared.get(key, (None, None))
+    if previous is entries:
+        return ledger
+    if previous is not None and len(previous) <= len(entries) and entries[:len(previous)] == previous:
+        # Whoever holds the old one keeps it unchanged
+        ledger = ledger.copy()
+        ledger.add_entries(entries[len(previous):])
+    else:
+        ledger = Ledger.from_entries(entries)
+    with _shared_lock:
+        _shared[key] = (entries, ledger)
+    return ledger
+
+
+def new_commit_id():
+    '''Id of one /ufficializza, shared by the entries it adds.'''
+    return secrets.token_hex(6)
+
+
+def entries_for(schedule, date_str, collaboratori_by_id, commit_id):
+    '''
+    Ledger entries (without id) of an official schedule. Call before
+    apply_official_schedule, which overwrites the values kept as 'precedente'.
+    '''
+    entries = []
+    substitutions = [
+        (luogo_id, assignment)
+        for luogo_id, assignments in schedule.items()
+        for assignment in assignments if assignment.is_substitute
+    ] + [(None, assignment) for assignment in schedule.afternoon_subs]
+    for luogo_id, assignment in substitutions:
+        collaboratore = collaboratori_by_id.get(assignment.collaboratore_id)
+        if collaboratore is None:
+            continue
+        entries.append({
+            'ufficializzazione': commit_id, 'data': date_str, 'collaboratore_id': collaboratore['id'],
+            'tipo': SUBSTITUTION, 'luogo_id': luogo_id, 'minuti': 0,
+            'precedente': collaboratore.get('ultima_sostituzione'),
+        })
+
+    # Cleaning overtime adds up on the record: keep the running total before each entry
+    overtime = {}
+    for cleaning in schedule.cleaning_overtime or []:
+        collaboratore = collaboratori_by_id.get(cleaning.collaboratore_id)
+        if collaboratore is None:
+            continue
+        previous = overtime.get(collaboratore['id'], collaboratore.get('straordinari_svolti', 0))
+        overtime[collaboratore['id']] = previous + cleaning.overtime_minutes
+        entries.append({
+            'ufficializzazione': commit_id, 'data': date_str, 'collaboratore_id': collaboratore['id'],
+            'tipo': OVERTIME, 'luogo_id': cleaning.location_id, 'minuti': cleaning.overtime_minutes,
+            'precedente': previous,
+        })
+    return entries
+
+
+def undo_changes(undone, remaining, collaboratori_by_id):
+    '''
+    {collaboratore_id: changes} that take back the entries of `undone` (one
+    official schedule) from the collaboratori records, given the `remaining`
+    entries of the ledger.
+
+    Overtime minutes are subtracted, whatever came after. ultima_sostituzione
+    goes back to the latest substitution left, or to the value the undone
+    day replaced, but only if no later day set it.
+    '''
+    changes = {}
+    for entry in undone:
+        collaboratore = collaboratori_by_id.get(entry['collaboratore_id'])
+        if collaboratore is None:
+            continue
+        record_changes = changes.setdefault(collaboratore['id'], {})
+        if entry['tipo'] == OVERTIME:
+            current = record_changes.get('straordinari_svolti', collaboratore.get('straordinari_svolti', 0))
+            record_changes['straordinari_svolti'] = max(0, current - entry['minuti'])
+        elif collaboratore.get('ultima_sostituzione') == entry['data']:
+            left = [other['data'] for other in remaining
+                    if other['collaboratore_id'] == collaboratore['id'] and other['tipo'] == SUBSTITUTION]
+            if entry['precedente'] is not None:
+                left.append(entry['precedente'])
+            record_changes['ultima_sostituzione'] = max(left) if left else None
+    return {collab_id: record_changes for collab_id, record_changes in changes.items() if record_changes}
+
+
+class Ledger:
+    '''Per collaboratore, the days with entries and the prefix sums of their load.'''
+
+    def __init__(self):
+        # collaboratore_id -> sorted day ordinals, and the prefix sums of the
+        # substitutions and overtime minutes up to each (with a leading 0)
+        self._days = {}
+        self._substitutions = {}
+        self._minutes = {}
+
+    @classmethod
+    def from_entries(cls, entries):
+        ledger = cls()
+        ledger.add_entries(entries)
+        return ledger
+
+    def copy(self):
+        ledger = Ledger()
+        ledger._days = {collab_id: list(days) for collab_id, days in self._days.items()}
+        ledger._substitutions = {collab_id: list(sums) for collab_id, sums in self._substitutions.items()}
+        ledger._minutes = {collab_id: list(sums) for collab_id, sums in self._minutes.items()}
+        return ledger
+
+    def add_entries(self, entries):
+        for entry in sorted(entries, key=lambda entry: entry['data']):
+            self.add(date.fromisoformat(entry['data']), entry['collaboratore_id'],
+                     substitutions=1 if entry['tipo'] == SUBSTITUTION else 0,
+                     minutes=entry['minuti'] if entry['tipo'] == OVERTIME else 0)
+
+    def add(self, day, collab_id, substitutions=0, minutes=0):
+        '''Count some load on a day; adding in date order costs O(1).'''
+        days = self._days.setdefault(collab_id, [])
+        subs_sums = self._substitutions.setdefault(collab_id, [0])
+        minutes_sums = self._minutes.setdefault(collab_id, [0])
+        ordinal = day.toordinal()
+        position = bisect.bisect_right(days, ordinal)
+        if position and days[position - 1] == ordinal:
+            start = position
+        else:
+            days.insert(position, ordinal)
+            subs_sums.insert(position + 1, subs_sums[position])
+            minutes_sums.insert(position + 1, minutes_sums[position])
+            start = position + 1
+        # Only the sums from that day on change
+        for i in range(start, len(subs_sums)):
+            subs_sums[i] += substitutions
+            minutes_sums[i] += minutes
+
+    def load(self, collab_id, first, last):
+        '''(substitutions, overtime minutes) of a collaboratore from first to last, both included.'''
+        days = self._days.get(collab_id)
+        if not days:
+            return 0, 0
+        low = bisect.bisect_left(days, first.toordinal())
+        high = bisect.bisect_right(days, last.toordinal())
+        subs_sums, minutes_sums = self._substitutions[collab_id], self._minutes[collab_id]
+        return subs_sums[high] - subs_sums[low], minutes_sums[high] - minutes_sums[low]
+
+    def loads(self, first, last):
+        '''{collaboratore_id: (substitutions, overtime minutes)} from first to last, for everybody with entries.'''
+        return {collab_id: self.load(collab_id, first, last) for collab_id in self._days}
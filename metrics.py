@@ -0,0 +1,187 @@
+'''
+In-process counters and histograms, exposed in the Prometheus text format.
+
+The engine times its phases and counts its decisions here, and app.py
+times every request; GET /metrics returns render(). Metrics live in the
+memory of the process: under gunicorn every worker reports its own, and a
+Prometheus scrape sees the worker that answered (label the targets per
+worker, or run a single worker, to see them all).
+
+    SUBSTITUTES.inc(kind='morning')
+    PHASE_SECONDS.observe(0.004, phase='populate_absences')
+    with PHASE_SECONDS.time(phase='data_load'):
+        ...
+'''
+
+import bisect
+import contextlib
+import functools
+import threading
+import time
+
+# Seconds; from a cached page to a very large generation
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry = []
+_registry_lock = threading.Lock()
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        with _registry_lock:
+            _registry.append(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name}: etichette attese {self.labelnames}, ricevute {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+            lines.extend(self._render_samples(items))
+        return lines
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Counter(_Metric):
+    '''A value that only goes up.'''
+
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def _render_samples(self, items):
+        for key, value in items:
+            yield f"{self.name}_total{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Histogram(_Metric):
+    '''Observations counted in cumulative buckets, with their sum.'''
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per bucket counts (the last one is +Inf), sum, count
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        '''Observe the seconds spent in the with block.'''
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels):
+        state = self._values.get(self._key(labels))
+        return state[2] if state else 0
+
+    def _render_samples(self, items):
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, [('le', _format_value(float(bound)))])
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {_format_value(total)}"
+            yield f"{self.name}_count{labels} {count}"
+
+
+def timed(histogram, **labels):
+    '''Decorator observing the seconds of every call of the function.'''
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started, **labels)
+        return wrapper
+    return decorator
+
+
+def render():
+    '''Every registered metric in the Prometheus text exposition format.'''
+    with _registry_lock:
+        metrics = list(_registry)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def clear():
+    '''Reset every metric to no samples.'''
+    with _registry_lock:
+        metrics = list(_registry)
+    for metric in metrics:
+        metric.clear()
+
+
+# Engine
+PHASE_SECONDS = Histogram('generator_phase_seconds', "Time spent in each phase of a generation", ('phase',))
+GENERATIONS = Counter('generator_generations', "Days generated", ('solver',))
+SUBSTITUTES = Counter('generator_substitutes_chosen', "Substitutes placed, by kind", ('kind',))
+UNFILLED = Counter('generator_unfilled_deficits', "People still missing after the substitutions, by kind", ('kind',))
+CANDIDATES_EXAMINED = Counter('generator_candidates_examined', "Candidates looked at while picking substitutes")
+CASCADE_DEPTH = Histogram('generator_cascade_depth',
+                          "Substitutions needed to fill one deficit, cascades included",
+                          buckets=(1, 2, 3, 4, 5, 8))
+CLEANING_ASSIGNED = Counter('generator_cleaning_overtime_assigned', "Cleaning overtime assignments")
+
+# HTTP
+REQUEST_SECONDS = Histogram('http_request_duration_seconds', "Latency of the Flask routes",
+                            ('route', 'method', 'status'))
+
+# Storage
+COMPACTION_FAILURES = Counter('storage_compaction_failures', "Background journal compactions that failed, by collection",
+                              ('collection',))
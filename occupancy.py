@@ -0,0 +1,138 @@
+'''
+Minute-level occupancy of the luoghi for one day's schedule.
+
+Occupancy turns a Schedule into the places every collaboratore physically
+is during the day, as segments (collaboratore, luogo, start, end):
+
+- a regular assignment keeps its collaboratore at the luogo all day;
+- a substitute leaves their own luogo for the one they cover, and with a
+  partial_end goes back to original_luogo_id at that time;
+- an afternoon substitute works the shifted hours at the luogo of the person
+  they replace; one who replaces nobody works for the school as a whole
+  and is at no luogo, so they clean none at the end of the day.
+
+The segments are summed in one vectorized pass into a luoghi x minutes
+matrix of head counts, and the coverage questions of the engine (morning
+coverage, afternoon starters, who cleans at the end of the day, coverage
+gaps) are queries against it.
+'''
+
+import numpy as np
+
+DAY_MINUTES = 24 * 60
+
+
+class Occupancy:
+    '''Who is where, minute by minute, for one day's schedule.'''
+
+    def __init__(self, schedule, luogo_ids, home_luogo_by_id):
+        '''
+        luogo_ids: every luogo that gets a row in the matrix.
+        home_luogo_by_id: collaboratore id -> luogo_id they normally work at.
+        '''
+        self.luogo_ids = list(luogo_ids)
+        self._row = {luogo_id: row for row, luogo_id in enumerate(self.luogo_ids)}
+
+        collab_ids, rows, starts, ends = [], [], [], []
+
+        def add_segment(collab_id, luogo_id, start, end):
+            row = self._row.get(luogo_id)
+            if row is None or start is None or end is None or end <= start:
+                return
+            collab_ids.append(collab_id)
+            rows.append(row)
+            starts.append(max(0, start))
+            ends.append(min(DAY_MINUTES, end))
+
+        # People working as substitutes somewhere are no longer at their own luogo
+        substitute_ids = schedule.substitute_ids()
+        for luogo_id, assignments in schedule.items():
+            for assignment in assignments:
+                collab_id = assignment.collaboratore_id
+                if not assignment.is_substitute:
+                    if collab_id not in substitute_ids:
+                        add_segment(collab_id, luogo_id, assignment.start, assignment.end)
+                elif assignment.partial_end is not None:
+                    add_segment(collab_id, luogo_id, assignment.start, assignment.partial_end)
+                    add_segment(collab_id, assignment.original_luogo_id, assignment.partial_end, assignment.end)
+                else:
+                    add_segment(collab_id, luogo_id, assignment.start, assignment.end)
+
+        for assignment in schedule.afternoon_subs:
+            # None when they replace nobody: add_segment skips it
+            luogo_id = home_luogo_by_id.get(assignment.replaces_id)
+            add_segment(assignment.collaboratore_id, luogo_id, assignment.start, assignment.end)
+
+        self.segment_collab = np.array(collab_ids, dtype=np.int64)
+        self.segment_row = np.array(rows, dtype=np.int64)
+        self.segment_start = np.array(starts, dtype=np.int64)
+        self.segment_end = np.array(ends, dtype=np.int64)
+
+        # +1 where a segment starts, -1 where it ends, then a running sum per luogo
+        delta = np.zeros((len(self.luogo_ids), DAY_MINUTES + 1), dtype=np.int32)
+        np.add.at(delta, (self.segment_row, self.segment_start), 1)
+        np.add.at(delta, (self.segment_row, self.segment_end), -1)
+        self.counts = np.cumsum(delta[:, :DAY_MINUTES], axis=1)
+
+    def count(self, luogo_id, minute):
+        '''People at the luogo at the given minute.'''
+        return int(self.counts[self._row[luogo_id], minute])
+
+    def counts_at(self, minute):
+        '''{luogo_id: people at the luogo} at the given minute.'''
+        return dict(zip(self.luogo_ids, self.counts[:, minute].tolist()))
+
+    def who_is_at(self, luogo_id, minute):
+        '''Ids of the collaboratori at the luogo at the given minute.'''
+        mask = ((self.segment_row == self._row[luogo_id])
+                & (self.segment_start <= minute) & (minute < self.segment_end))
+        return self.segment_collab[mask].tolist()
+
+    def where_is(self, collaboratore_id, minute):
+        '''luogo_id where the collaboratore is at the given minute, None if not at work.'''
+        mask = ((self.segment_collab == collaboratore_id)
+                & (self.segment_start <= minute) & (minute < self.segment_end))
+        rows = self.segment_row[mask]
+        return self.luogo_ids[rows[0]] if len(rows) else None
+
+    def starts_after(self, minute):
+        '''How many collaboratori begin their day after the given minute.'''
+        if not len(self.segment_collab):
+            return 0
+        order = np.lexsort((self.segment_start, self.segment_collab))
+        collab = self.segment_collab[order]
+        first = np.ones(len(collab), dtype=bool)
+        first[1:] = collab[1:] != collab[:-1]
+        return int(np.count_nonzero(self.segment_start[order][first] > minute))
+
+    def present_at_end(self):
+        '''{luogo_id: collaboratori whose working day ends there}.'''
+        present = dict.fromkeys(self.luogo_ids, 0)
+        if not len(self.segment_collab):
+            return present
+        # The last segment of every collaboratore is where they finish the day
+        order = np.lexsort((self.segment_end, self.segment_collab))
+        collab = self.segment_collab[order]
+        last = np.ones(len(collab), dtype=bool)
+        last[:-1] = collab[:-1] != collab[1:]
+        per_row = np.bincount(self.segment_row[order][last], minlength=len(self.luogo_ids))
+        return dict(zip(self.luogo_ids, per_row.tolist()))
+
+    def gaps(self, min_required, start=0, end=DAY_MINUTES):
+        '''
+        {luogo_id: [(from, to), ...]} minute ranges within [start, end) where
+        the luogo has fewer people than min_required[luogo_id].
+        '''
+        minimum = np.array([min_required.get(luogo_id, 0) for luogo_id in self.luogo_ids], dtype=np.int32)
+        below = self.counts[:, start:end] < minimum[:, None]
+        # Edges of the runs of short minutes, per luogo
+        padded = np.zeros((len(self.luogo_ids), end - start + 2), dtype=np.int8)
+        padded[:, 1:-1] = below
+        edges = np.diff(padded, axis=1)
+        # Both come out row by row in minute order, so the n-th opening pairs with the n-th closing
+        open_rows, open_columns = np.nonzero(edges == 1)
+        _, close_columns = np.nonzero(edges == -1)
+        result = {}
+        for row, opened, closed in zip(open_rows.tolist(), open_columns.tolist(), close_columns.tolist()):
+            result.setdefault(self.luogo_ids[row], []).append((start + opened, start + closed))
+        return result
@@ -0,0 +1,327 @@
+'''
+Import of the staff roster from a CSV file, in the layout of the sheet the
+school keeps:
+
+    Nome (P = Part Time),Assegnazione,Lunedi,Martedi,Mercoledi,Giovedi,Venerdi
+    Rossi Maria (P),Palestra,7:54 - 14:57,7:54 - 14:57 (novembre 10:48 - 18:00),assente,...
+
+One row per collaboratore. Nome is "Cognome Nome", a trailing "(P)"
+dropped; Assegnazione is the name of the luogo. A day cell holds the hours
+of the day or "assente", and may add "(<mese> HH:MM - HH:MM)" for a month
+the collaboratore starts later to work the afternoon (a turnazione) and
+"in <luogo>" / "al <luogo>" for a luogo covered that day (a copertura
+fissa). Optional columns: Sabato, and Fisso (sì/no) for fisso_nel_luogo.
+
+The file is read once, row by row, and never held in memory. Every row is
+checked on its own: a bad one is reported with its line and skipped. The
+good ones are written BATCH_SIZE at a time, every batch with one write per
+collection (one transaction with SQLite). Luoghi are matched by name and
+created when missing; a collaboratore already there, same cognome and
+nome, is reported and left alone, so importing the same file again adds
+nothing.
+
+    python roster_import.py orari.csv --anno 2025
+'''
+
+import argparse
+import csv
+import itertools
+import re
+import sys
+import unicodedata
+from datetime import date
+
+import dataset
+
+BATCH_SIZE = 500
+
+GIORNI = ('lunedi', 'martedi', 'mercoledi', 'giovedi', 'venerdi', 'sabato')
+MESI = ('gennaio', 'febbraio', 'marzo', 'aprile', 'maggio', 'giugno',
+        'luglio', 'agosto', 'settembre', 'ottobre', 'novembre', 'dicembre')
+# First month of the school year: the months from here on are in the year
+# it starts, the ones before in the next
+FIRST_MONTH = 9
+
+_TIME = r'\d{1,2}:\d{2}'
+_PART_TIME = re.compile(r'\s*\(\s*P\s*\)\s*$', re.IGNORECASE)
+_HOURS = re.compile(rf'^({_TIME})\s*-\s*({_TIME})')
+_TURNAZIONE = re.compile(rf'\(\s*([^\W\d_]+)\s+({_TIME})\s*-\s*({_TIME})\s*\)')
+_COPERTURA = re.compile(r'^(?:in|al)\s+(\S.*?)$', re.IGNORECASE)
+_ASSENTE = re.compile(r'^assente\b', re.IGNORECASE)
+_YES = re.compile(r'^(?:s[iì]|x|1|true)$', re.IGNORECASE)
+_NO = re.compile(r'^(?:no|0|false)?$', re.IGNORECASE)
+
+
+def default_school_year(today=None):
+    '''Year the current school year started in.'''
+    today = today or date.today()
+    return today.year if today.month >= FIRST_MONTH else today.year - 1
+
+
+def _key(text):
+    '''Case and accent insensitive form of a name, for matching.'''
+    text = unicodedata.normalize('NFKD', text)
+    return ' '.join(''.join(char for char in text if not unicodedata.combining(char)).lower().split())
+
+
+def _time(text):
+    hours, minutes = (int(part) for part in text.split(':'))
+    if hours > 23 or minutes > 59:
+        raise ValueError(f"orario non valido '{text}'")
+    return f"{hours:02d}:{minutes:02d}"
+
+
+def _columns(header):
+    '''{field: position} of the header row; ValueError if the needed columns are missing.'''
+    columns = {}
+    for position, title in enumerate(header):
+        # A byte order mark left by a reader that did not expect one
+        title = _key(title.lstrip('\ufeff'))
+        if title.startswith('nome'):
+            columns.setdefault('nome', position)
+        elif title.startswith('assegnazione'):
+            columns.setdefault('luogo', position)
+        elif title.startswith('fisso'):
+            columns.setdefault('fisso', position)
+        elif title in GIORNI:
+            columns.setdefault(title, position)
+    missing = [name for name in ('nome', 'luogo') if name not in columns]
+    if not any(giorno in columns for giorno in GIORNI):
+        missing.append('giorni della settimana')
+    if missing:
+        raise ValueError(f"Colonne mancanti nell'intestazione: {', '.join(missing)}")
+    return columns
+
+
+def parse_cell(text):
+    '''
+    (orario, turnazione, copertura) of a day cell: {'inizio', 'fine'} or
+    None, (mese, ora di ingresso) or None, name of the covered luogo or None.
+    '''
+    text = ' '.join(text.split())
+    if not text or _ASSENTE.match(text):
+        return None, None, None
+    turnazione = None
+    match = _TURNAZIONE.search(text)
+    if match:
+        mese = _key(match.group(1))
+        if mese not in MESI:
+            raise ValueError(f"mese sconosciuto '{match.group(1)}'")
+        turnazione = (mese, _time(match.group(2)))
+        text = (text[:match.start()] + text[match.end():]).strip()
+    match = _HOURS.match(text)
+    if not match:
+        raise ValueError(f"orario non riconosciuto '{text}'")
+    orario = {'inizio': _time(match.group(1)), 'fine': _time(match.group(2))}
+    if orario['inizio'] >= orario['fine']:
+        raise ValueError(f"l'orario {orario['inizio']} - {orario['fine']} finisce prima di iniziare")
+    rest = text[match.end():].strip()
+    copertura = None
+    if rest:
+        match = _COPERTURA.match(rest)
+        if not match:
+            raise ValueError(f"testo non riconosciuto '{rest}'")
+        copertura = match.group(1)
+    return orario, turnazione, copertura
+
+
+def parse_row(row, columns, anno):
+    '''
+    The collaboratore of a row, with the names of its luoghi and its
+    turnazioni and coperture; ValueError with every problem of the row.
+    '''
+    def cell(name):
+        position = columns.get(name)
+        return row[position].strip() if position is not None and position < len(row) else ''
+
+    errors = []
+    nome = _PART_TIME.sub('', cell('nome'))
+    cognome, _, nome = nome.partition(' ')
+    if not cognome or not nome.strip():
+        errors.append("nome mancante o senza cognome")
+    luogo = cell('luogo')
+    if not luogo:
+        errors.append("assegnazione mancante")
+    fisso = cell('fisso')
+    if not (_YES.match(fisso) or _NO.match(fisso)):
+        errors.append(f"valore di Fisso non riconosciuto '{fisso}'")
+
+    entry = {
+        'cognome': cognome, 'nome': nome.strip(), 'luogo': luogo, 'fisso': bool(_YES.match(fisso)),
+        'orari': {}, 'turnazioni': [], 'coperture': [],
+    }
+    for giorno in GIORNI:
+        try:
+            orario, turnazione, copertura = parse_cell(cell(giorno))
+        except ValueError as e:
+            errors.append(f"{giorno.capitalize()}: {e}")
+            continue
+        if orario:
+            entry['orari'][giorno] = orario
+        if turnazione:
+            mese, ora = turnazione
+            month = MESI.index(mese) + 1
+            entry['turnazioni'].append({
+                'giorno_settimana': giorno, 'mese': mese, 'anno': anno if month >= FIRST_MONTH else anno + 1,
+                'fa_pomeriggio': True, 'ora_ingresso_alternativa': ora,
+            })
+        if copertura:
+            entry['coperture'].append((giorno, copertura))
+    if errors:
+        raise ValueError('; '.join(errors))
+    return entry
+
+
+def _load(filename, data_dir):
+    try:
+        return dataset.load(filename, data_dir)
+    except FileNotFoundError:
+        return []
+
+
+def _write(batch, luoghi, report, data_dir, dry_run):
+    '''Add the luoghi, collaboratori, turnazioni and coperture of a batch, one write per collection.'''
+    new_luoghi = {}
+    for entry in batch:
+        for name in [entry['luogo']] + [luogo for _, luogo in entry['coperture']]:
+            if _key(name) not in luoghi:
+                new_luoghi.setdefault(_key(name), name)
+    luogo_records = [{'nome': name, 'descrizione': '', 'min_collaboratori': 1, 'no_cleaning_needed': False}
+                     for name in new_luoghi.values()]
+    collaboratore_records = [{
+        'nome': entry['nome'], 'cognome': entry['cognome'], 'luogo_id': None, 'luogo_secondario_id': None,
+        'fisso_nel_luogo': entry['fisso'], 'orari_settimanali': entry['orari'],
+        'ultima_sostituzione': None, 'straordinari_svolti': 0, 'no_overtime_allowed': False,
+    } for entry in batch]
+    report['luoghi'] += len(luogo_records)
+    report['collaboratori'] += len(batch)
+    report['turnazioni'] += sum(len(entry['turnazioni']) for entry in batch)
+    report['coperture_fisse'] += sum(len(entry['coperture']) for entry in batch)
+    if dry_run:
+        # Only so that the next batches do not count them again
+        luoghi.update((key, None) for key in new_luoghi)
+        return
+
+    with dataset.locked(data_dir):
+        for luogo in dataset.insert_many('luoghi.json', luogo_records, data_dir):
+            luoghi[_key(luogo['nome'])] = luogo['id']
+        for record, entry in zip(collaboratore_records, batch):
+            record['luogo_id'] = luoghi[_key(entry['luogo'])]
+        collaboratori = dataset.insert_many('collaboratori.json', collaboratore_records, data_dir)
+        dataset.insert_many('turnazioni.json', [
+            dict(turnazione, collaboratore_id=collaboratore['id'])
+            for collaboratore, entry in zip(collaboratori, batch) for turnazione in entry['turnazioni']
+        ], data_dir)
+        dataset.insert_many('coperture_fisse.json', [
+            {'collaboratore_id': collaboratore['id'], 'giorno_settimana': giorno,
+             'luogo_coperto_id': luoghi[_key(luogo)]}
+            for collaboratore, entry in zip(collaboratori, batch) for giorno, luogo in entry['coperture']
+        ], data_dir)
+
+
+def _decoded(lines, report):
+    '''Lines of a binary stream as UTF-8 text, one at a time; a line that is not UTF-8 is reported and left empty.'''
+    for number, line in enumerate(lines, 1):
+        try:
+            yield line.decode('utf-8-sig' if number == 1 else 'utf-8')
+        except UnicodeDecodeError:
+            if number == 1:
+                raise ValueError("Riga 1: l'intestazione non è in UTF-8")
+            report['errori'].append([number, "riga non in UTF-8"])
+            # Keeps the line numbers of the csv reader
+            yield '\n'
+
+
+def import_roster(stream, anno=None, data_dir=None, dry_run=False, batch_size=BATCH_SIZE):
+    '''
+    Import the rows of a CSV stream, binary (UTF-8) or text; with dry_run
+    only check them.
+
+    Returns {'collaboratori', 'luoghi', 'turnazioni', 'coperture_fisse'}
+    with the number of records added (that would be, with dry_run) and
+    'errori', the [line, message] of every row skipped. A file that stops
+    being CSV halfway ends there, with the rows before it imported and an
+    error for the line. Raises ValueError for a file that cannot be read
+    at all: empty, without the needed columns, or not CSV from the header.
+    '''
+    anno = default_school_year() if anno is None else anno
+    report = {'collaboratori': 0, 'luoghi': 0, 'turnazioni': 0, 'coperture_fisse': 0, 'errori': []}
+    lines = iter(stream)
+    first = next(lines, None)
+    lines = itertools.chain([first] if first is not None else [], lines)
+    if isinstance(first, bytes):
+        lines = _decoded(lines, report)
+    reader = csv.reader(lines)
+    try:
+        header = next(reader, None)
+    except csv.Error as e:
+        raise ValueError(f"Riga 1: CSV non valido: {e}")
+    if header is None:
+        raise ValueError("Il file è vuoto")
+    columns = _columns(header)
+
+    luoghi = {_key(luogo['nome']): luogo['id'] for luogo in _load('luoghi.json', data_dir)}
+    known = {(_key(collaboratore['cognome']), _key(collaboratore['nome']))
+             for collaboratore in _load('collaboratori.json', data_dir)}
+    batch = []
+    while True:
+        try:
+            row = next(reader, None)
+        except csv.Error as e:
+            # The rows before are imported all the same, the rest cannot be read
+            report['errori'].append([reader.line_num, f"CSV non valido da qui in poi: {e}"])
+            break
+        if row is None:
+            break
+        if not any(cell.strip() for cell in row):
+            continue
+        try:
+            entry = parse_row(row, columns, anno)
+            key = (_key(entry['cognome']), _key(entry['nome']))
+            if key in known:
+                raise ValueError(f"{entry['cognome']} {entry['nome']} è già presente")
+        except ValueError as e:
+            report['errori'].append([reader.line_num, str(e)])
+            continue
+        known.add(key)
+        batch.append(entry)
+        if len(batch) >= batch_size:
+            _write(batch, luoghi, report, data_dir, dry_run)
+            batch = []
+    if batch:
+        _write(batch, luoghi, report, data_dir, dry_run)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import collaboratori, orari, turnazioni and coperture from a CSV roster")
+    parser.add_argument('file', help="CSV file, - for the standard input")
+    parser.add_argument('--anno', type=int, default=None,
+                        help="year the school year starts in, for the months of the turnazioni (default: the current one)")
+    parser.add_argument('--data-dir', default=None, help="directory with the data files (default: data/)")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help="rows written at a time")
+    parser.add_argument('--dry-run', action='store_true', help="only check the file, write nothing")
+    args = parser.parse_args()
+    if args.batch_size < 1:
+        parser.error("--batch-size deve essere almeno 1")
+
+    stream = sys.stdin.buffer if args.file == '-' else open(args.file, 'rb')
+    with stream:
+        try:
+            report = import_roster(stream, anno=args.anno, data_dir=args.data_dir,
+                                   dry_run=args.dry_run, batch_size=args.batch_size)
+        except ValueError as e:
+            sys.exit(str(e))
+
+    for line, message in sorted(report['errori']):
+        print(f"Riga {line}: {message}", file=sys.stderr)
+    verb = "Da importare" if args.dry_run else "Importati"
+    print(f"{verb}: {report['collaboratori']} collaboratori, {report['luoghi']} luoghi nuovi, "
+          f"{report['turnazioni']} turnazioni, {report['coperture_fisse']} coperture fisse; "
+          f"{len(report['errori'])} righe scartate")
+    if report['errori']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+'''
+Typed model of a generated schedule.
+
+A Schedule holds the assignments of one day per luogo, plus the afternoon
+substitutes and the cleaning overtime that are not tied to a luogo. Times are
+kept in minutes since midnight; to_dict() and from_dict() convert to and from
+the JSON shape used by the output files and the session.
+'''
+
+
+def parse_time(value):
+    '''Convert an "HH:MM" string to minutes since midnight (None stays None).'''
+    if value is None:
+        return None
+    hour, minute = value.split(':')
+    return int(hour) * 60 + int(minute)
+
+
+def format_time(minutes):
+    '''Convert minutes since midnight back to an "HH:MM" string.'''
+    if minutes is None:
+        return None
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+class Assignment:
+    '''One collaboratore working at a luogo (or in the afternoon) for the day.'''
+
+    __slots__ = ('collaboratore_id', 'start', 'end', 'partial_end', 'is_substitute',
+                 'is_afternoon_sub', 'replaces_id', 'original_luogo_id')
+
+    def __init__(self, collaboratore_id, start, end, partial_end=None, is_substitute=False,
+                 is_afternoon_sub=False, replaces_id=None, original_luogo_id=None):
+        self.collaboratore_id = collaboratore_id
+        self.start = start
+        self.end = end
+        self.partial_end = partial_end
+        self.is_substitute = is_substitute
+        self.is_afternoon_sub = is_afternoon_sub
+        self.replaces_id = replaces_id
+        self.original_luogo_id = original_luogo_id
+
+    def to_dict(self):
+        data = {
+            'collaboratore_id': self.collaboratore_id,
+            'start': format_time(self.start),
+            'end': format_time(self.end),
+        }
+        if self.partial_end is not None:
+            data['partial_end'] = format_time(self.partial_end)
+        if self.is_substitute:
+            data['is_substitute'] = True
+            if self.is_afternoon_sub:
+                data['is_afternoon_sub'] = True
+            data['replaces_id'] = self.replaces_id
+            data['original_luogo_id'] = self.original_luogo_id
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            data['collaboratore_id'],
+            parse_time(data['start']),
+            parse_time(data['end']),
+            partial_end=parse_time(data.get('partial_end')),
+            is_substitute=data.get('is_substitute', False),
+            is_afternoon_sub=data.get('is_afternoon_sub', False),
+            replaces_id=data.get('replaces_id'),
+            original_luogo_id=data.get('original_luogo_id'),
+        )
+
+
+class CleaningOvertime:
+    '''Extra minutes a collaboratore spends cleaning a luogo left short of staff.'''
+
+    __slots__ = ('collaboratore_id', 'location_id', 'location_name', 'overtime_minutes')
+
+    def __init__(self, collaboratore_id, location_id, location_name, overtime_minutes):
+        self.collaboratore_id = collaboratore_id
+        self.location_id = location_id
+        self.location_name = location_name
+        self.overtime_minutes = overtime_minutes
+
+    def to_dict(self):
+        return {
+            'collaboratore_id': self.collaboratore_id,
+            'location_id': self.location_id,
+            'location_name': self.location_name,
+            'overtime_minutes': self.overtime_minutes
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['collaboratore_id'], data['location_id'],
+                   data['location_name'], data['overtime_minutes'])
+
+
+class Schedule:
+    '''
+    Assignments of one day.
+
+    Keeps the sets of present and substitute collaboratore ids, and the
+    regular assignments of every collaboratore, next to the assignments, so
+    membership checks and lookups don't walk the schedule.
+    '''
+
+    __slots__ = ('luoghi', 'afternoon_subs', 'cleaning_overtime', '_present_ids', '_substitute_ids',
+                 '_regular_by_id')
+
+    def __init__(self):
+        self.luoghi = {}
+        self.afternoon_subs = []
+        # None until assign_cleaning_overtime has run
+        self.cleaning_overtime = None
+        self._present_ids = set()
+        self._substitute_ids = set()
+        # collaboratore_id -> [(luogo_id, assignment)] of their non-substitute assignments
+        self._regular_by_id = {}
+
+    def add(self, luogo_id, assignment):
+        if luogo_id not in self.luoghi:
+            self.luoghi[luogo_id] = []
+        self.luoghi[luogo_id].append(assignment)
+        self._present_ids.add(assignment.collaboratore_id)
+        if assignment.is_substitute:
+            self._substitute_ids.add(assignment.collaboratore_id)
+        else:
+            self._regular_by_id.setdefault(assignment.collaboratore_id, []).append((luogo_id, assignment))
+
+    def add_afternoon_sub(self, assignment):
+        self.afternoon_subs.append(assignment)
+        self._substitute_ids.add(assignment.collaboratore_id)
+
+    def add_cleaning_overtime(self, cleaning):
+        if self.cleaning_overtime is None:
+            self.cleaning_overtime = []
+        self.cleaning_overtime.append(cleaning)
+
+    def assignments(self, luogo_id):
+        return self.luoghi.get(luogo_id, [])
+
+    def items(self):
+        '''(luogo_id, assignments) pairs, in the order the luoghi were first filled.'''
+        return self.luoghi.items()
+
+    def is_present(self, collaboratore_id):
+        '''True if the collaboratore works at some luogo today.'''
+        return collaboratore_id in self._present_ids
+
+    def is_substitute(self, collaboratore_id):
+        '''True if the collaboratore already substitutes somewhere, afternoon included.'''
+        return collaboratore_id in self._substitute_ids
+
+    def regular_assignments(self, collaboratore_id):
+        '''(luogo_id, assignment) of the non-substitute assignments of a collaboratore.'''
+        return self._regular_by_id.get(collaboratore_id, ())
+
+    def present_ids(self):
+        return self._present_ids
+
+    def substitute_ids(self):
+        return self._substitute_ids
+
+    def to_dict(self):
+        data = {
+            luogo_id: [assignment.to_dict() for assignment in assignments]
+            for luogo_id, assignments in self.luoghi.items()
+        }
+        if self.afternoon_subs:
+            data['afternoon_subs'] = [assignment.to_dict() for assignment in self.afternoon_subs]
+        if self.cleaning_overtime is not None:
+            data['cleaning_overtime'] = [cleaning.to_dict() for cleaning in self.cleaning_overtime]
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        '''Rebuild a Schedule from to_dict() output, also after a JSON round trip.'''
+        schedule = cls()
+        for key, entries in data.items():
+            if key == 'afternoon_subs':
+                for entry in entries:
+                    schedule.add_afternoon_sub(Assignment.from_dict(entry))
+            elif key == 'cleaning_overtime':
+                schedule.cleaning_overtime = [CleaningOvertime.from_dict(entry) for entry in entries]
+            else:
+                # JSON turns the integer luogo ids into strings
+                luogo_id = int(key)
+                for entry in entries:
+                    schedule.add(luogo_id, Assignment.from_dict(entry))
+        return schedule
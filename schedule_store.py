@@ -0,0 +1,115 @@
+'''
+Generated schedules waiting to be made official, kept on the server.
+
+/genera stores the schedule it shows here and puts only the returned short
+id in the session; /ufficializza takes it back with that id. The session
+cookie stays the same size however big the school is.
+
+Entries live in a SQLite file, so that every gunicorn worker sees the
+schedules generated by the others, with an in-process TTL cache in front
+of it for the worker that generated them. They expire after `ttl` seconds:
+a schedule generated long ago was computed from data that may have changed
+since, and is better generated again.
+'''
+
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_TTL = 3600
+DEFAULT_MAX_ENTRIES = 256
+
+
+class ScheduleStore:
+    '''Schedules by short id: a bounded in-process TTL cache over a SQLite table.'''
+
+    def __init__(self, path, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES):
+        if max_entries < 1:
+            raise ValueError("La cache deve contenere almeno un elemento")
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # id -> (expires, value), oldest first
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _connection(self):
+        # sqlite3 connections belong to one thread, and must not survive a fork
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("CREATE TABLE IF NOT EXISTS schedules "
+                               "(id TEXT PRIMARY KEY, expires REAL NOT NULL, body TEXT NOT NULL)")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def put(self, value):
+        '''Store a JSON-ready value; returns its new id.'''
+        entry_id = secrets.token_urlsafe(8)
+        now = time.time()
+        expires = now + self.ttl
+        connection = self._connection()
+        # Expired entries are dropped on the way, nobody else cleans the table
+        connection.execute("DELETE FROM schedules WHERE expires <= ?", (now,))
+        connection.execute("INSERT INTO schedules (id, expires, body) VALUES (?, ?, ?)",
+                           (entry_id, expires, json.dumps(value, ensure_ascii=False)))
+        with self._lock:
+            self._entries[entry_id] = (expires, value)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry_id
+
+    def get(self, entry_id):
+        '''
+        The value stored under an id, or None if there is none or it expired.
+        A worker may still find in its cache an entry another worker took.
+        '''
+        if not entry_id:
+            return None
+        with self._lock:
+            cached = self._entries.get(entry_id)
+        if cached is not None:
+            expires, value = cached
+        else:
+            row = self._connection().execute("SELECT expires, body FROM schedules WHERE id = ?",
+                                             (entry_id,)).fetchone()
+            if row is None:
+                return None
+            expires, value = row[0], json.loads(row[1])
+        return value if expires > time.time() else None
+
+    def take(self, entry_id):
+        '''
+        Remove an entry and return its value, or None if there is none or it
+        expired. Of concurrent calls with the same id only one gets the value.
+        '''
+        if not entry_id:
+            return None
+        with self._lock:
+            self._entries.pop(entry_id, None)
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute("SELECT expires, body FROM schedules WHERE id = ?",
+                                     (entry_id,)).fetchone()
+            connection.execute("DELETE FROM schedules WHERE id = ?", (entry_id,))
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        if row is None or row[0] <= time.time():
+            return None
+        return json.loads(row[1])
+
+    def __len__(self):
+        '''Entries not expired yet, in every worker.'''
+        row = self._connection().execute("SELECT COUNT(*) FROM schedules WHERE expires > ?",
+                                         (time.time(),)).fetchone()
+        return row[0]
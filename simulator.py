@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+Monte Carlo staffing-risk simulator.
+
+Samples random absence scenarios over a date range from per-collaboratore
+absence rates and runs the usual generation on each one (generate_schedule
+and assign_cleaning_overtime day after day, with the substitutions carried
+forward like /ufficializza does), spread over a process pool. Reports, per
+luogo, how likely a school day is to be left short of staff, the expected
+cleaning overtime of the range and the substitutes who get called too often.
+
+Every scenario gets its own random.Random seeded from (seed, scenario
+number), used both for the sampled absences and for the engine's random
+tie-breaks, so the report does not depend on the number of workers.
+
+Usage:
+    python simulator.py --from 2026-02-01 --to 2026-02-28
+    python simulator.py --from 2026-02-01 --to 2026-02-28 --scenarios 20000 --rate 0.04 --rates rates.json
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+
+from generator import WEEKDAYS, Generator
+
+# Scenarios handed to a worker at a time, per worker
+BATCHES_PER_WORKER = 8
+
+# Per-process state, set up once by _init_worker
+_worker = None
+
+
+class _Worker:
+    '''The Generator of one process plus everything that is equal for all scenarios.'''
+
+    def __init__(self, data_dir, start, end, default_rate, rates, overload_threshold):
+        self.generator = Generator(data_dir=data_dir)
+        self.start = start
+        self.end = end
+        self.default_rate = default_rate
+        self.rates = rates
+        self.overload_threshold = overload_threshold
+
+        # Absences already recorded in the range are part of every scenario
+        self.recorded = self.generator.assenze_between(start, end)
+        recorded_ids = {}
+        for assenza in self.recorded:
+            recorded_ids.setdefault(assenza['data'], set()).add(assenza['collaboratore_id'])
+
+        # (date string, ids of the people working that day and not already absent)
+        self.days = []
+        for current in _school_dates(self.generator, start, end):
+            weekday = WEEKDAYS[current.weekday()]
+            absent = recorded_ids.get(current.isoformat(), set())
+            working = sorted({
+                c['id'] for c in self.generator.collaboratori
+                if weekday in c['orari_settimanali'] and c['id'] not in absent
+            })
+            self.days.append((current.isoformat(), working))
+
+    def sample_assenze(self, rng):
+        assenze = []
+        for data, working in self.days:
+            for collab_id in working:
+                if rng.random() < self.rates.get(collab_id, self.default_rate):
+                    assenze.append({
+                        'id': None,
+                        'collaboratore_id': collab_id,
+                        'data': data,
+                        'tutto_giorno': True,
+                        'ora_inizio': None,
+                        'ora_fine': None
+                    })
+        return assenze
+
+    def run(self, first, count, seed):
+        totals = _empty_totals()
+        for index in range(first, first + count):
+            rng = random.Random(f"{seed}:{index}")
+            self.generator.set_assenze(self.recorded + self.sample_assenze(rng))
+            self.generator.rng = rng
+
+            short_luoghi = set()
+            overtime = 0
+            substitutions = Counter()
+            for _, _, schedule in self.generator.plan_range(self.start, self.end):
+                missing = self.generator.missing_by_luogo(schedule)
+                totals['short_days'].update(missing.keys())
+                short_luoghi.update(missing)
+                overtime += sum(cleaning.overtime_minutes for cleaning in schedule.cleaning_overtime or [])
+                substitutions.update(schedule.substitute_ids())
+
+            totals['scenarios'] += 1
+            totals['short_scenarios'].update(short_luoghi)
+            totals['overtime'].append(overtime)
+            totals['substitutions'].update(substitutions)
+            totals['overloaded'].update(
+                collab_id for collab_id, times in substitutions.items() if times > self.overload_threshold
+            )
+        return totals
+
+
+def _empty_totals():
+    return {
+        'scenarios': 0,
+        # luogo_id -> school days short / scenarios with at least one short day
+        'short_days': Counter(),
+        'short_scenarios': Counter(),
+        # cleaning overtime minutes of every scenario
+        'overtime': [],
+        # collaboratore_id -> substitutions over all scenarios / scenarios above the threshold
+        'substitutions': Counter(),
+        'overloaded': Counter(),
+    }
+
+
+def _merge(totals, partial):
+    totals['scenarios'] += partial['scenarios']
+    totals['overtime'].extend(partial['overtime'])
+    for key in ('short_days', 'short_scenarios', 'substitutions', 'overloaded'):
+        totals[key].update(partial[key])
+
+
+def _init_worker(*args):
+    global _worker
+    _worker = _Worker(*args)
+
+
+def _run_batch(first, count, seed):
+    return _worker.run(first, count, seed)
+
+
+def simulate(start, end, scenarios=1000, seed=0, default_rate=0.05, rates=None,
+             overload_threshold=3, workers=None, data_dir=None):
+    '''
+    Run `scenarios` sampled absence scenarios from start to end (dates, both
+    included) and return the report as a dict.
+
+    rates maps collaboratore id to the probability of being absent on a
+    school day; everyone else gets default_rate. A substitute is overloaded
+    in a scenario when called more than overload_threshold times.
+    '''
+    rates = rates or {}
+    generator = Generator(data_dir=data_dir)
+    workers = workers or os.cpu_count() or 1
+    batch_size = max(1, math.ceil(scenarios / (workers * BATCHES_PER_WORKER)))
+    batches = [(first, min(batch_size, scenarios - first)) for first in range(0, scenarios, batch_size)]
+
+    totals = _empty_totals()
+    init_args = (data_dir, start, end, default_rate, rates, overload_threshold)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=init_args) as executor:
+        futures = [executor.submit(_run_batch, first, count, seed) for first, count in batches]
+        # Merge in submission order, the result does not depend on who finished first
+        for future in futures:
+            _merge(totals, future.result())
+
+    school_days = sum(1 for _ in _school_dates(generator, start, end))
+    overtime = sorted(totals['overtime'])
+    luoghi = {luogo['id']: luogo['nome'] for luogo in generator.luoghi}
+    collaboratori = {c['id']: f"{c['cognome']} {c['nome']}" for c in generator.collaboratori}
+    day_scenarios = max(1, scenarios * school_days)
+
+    return {
+        'from': start.isoformat(),
+        'to': end.isoformat(),
+        'scenarios': scenarios,
+        'school_days': school_days,
+        'seed': seed,
+        'shortage': [
+            {
+                'luogo_id': luogo_id,
+                'nome': luoghi.get(luogo_id),
+                'per_day': totals['short_days'][luogo_id] / day_scenarios,
+                'in_range': totals['short_scenarios'][luogo_id] / max(1, scenarios),
+            }
+            for luogo_id in sorted(totals['short_days'], key=lambda l: (-totals['short_days'][l], l))
+        ],
+        'overtime_minutes': {
+            'mean': sum(overtime) / len(overtime) if overtime else 0,
+            'p90': overtime[int(0.9 * (len(overtime) - 1))] if overtime else 0,
+            'max': overtime[-1] if overtime else 0,
+        },
+        'overloaded': [
+            {
+                'collaboratore_id': collab_id,
+                'nome': collaboratori.get(collab_id),
+                'mean_substitutions': totals['substitutions'][collab_id] / max(1, scenarios),
+                'probability': totals['overloaded'][collab_id] / max(1, scenarios),
+            }
+            for collab_id in sorted(totals['overloaded'], key=lambda c: (-totals['overloaded'][c], c))
+        ],
+    }
+
+
+def _school_dates(generator, start, end):
+    school_days = generator.school_days()
+    current = start
+    while current <= end:
+        if WEEKDAYS[current.weekday()] in school_days:
+            yield current
+        current += timedelta(days=1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate random absences and estimate the staffing risk of a date range")
+    parser.add_argument('--from', dest='start', required=True, type=date.fromisoformat, help="first day, YYYY-MM-DD")
+    parser.add_argument('--to', dest='end', required=True, type=date.fromisoformat, help="last day (included), YYYY-MM-DD")
+    parser.add_argument('--scenarios', type=int, default=1000, help="number of sampled scenarios")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the whole simulation")
+    parser.add_argument('--rate', type=float, default=0.05, help="daily absence probability of every collaboratore")
+    parser.add_argument('--rates', help="JSON file {collaboratore_id: probability} overriding --rate")
+    parser.add_argument('--overload', type=int, default=3,
+                        help="a substitute called more than this many times in the range is overloaded")
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: one per CPU)")
+    parser.add_argument('--data-dir', default=None, help="directory with the JSON data files (default: data/)")
+    parser.add_argument('--json', action='store_true', help="print the report as JSON")
+    args = parser.parse_args()
+    if args.end < args.start:
+        parser.error("--to precede --from")
+
+    rates = {}
+    if args.rates:
+        with open(args.rates, 'r', encoding='utf-8') as f:
+            rates = {int(collab_id): rate for collab_id, rate in json.load(f).items()}
+
+    report = simulate(args.start, args.end, scenarios=args.scenarios, seed=args.seed,
+                      default_rate=args.rate, rates=rates, overload_threshold=args.overload,
+                      workers=args.workers, data_dir=args.data_dir)
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return
+
+    print(f"{report['scenarios']} scenari, {report['school_days']} giorni di scuola dal {report['from']} al {report['to']}")
+    print()
+    print(f"{'luogo':<30} {'prob. giorno':>12} {'prob. periodo':>13}")
+    for row in report['shortage']:
+        print(f"{row['nome'] or row['luogo_id']:<30} {row['per_day']:>12.3f} {row['in_range']:>13.3f}")
+    print()
+    overtime = report['overtime_minutes']
+    print(f"Straordinari pulizia (minuti): media {overtime['mean']:.1f}, p90 {overtime['p90']}, max {overtime['max']}")
+    print()
+    print(f"{'sostituto sovraccarico':<30} {'sost. medie':>11} {'prob.':>7}")
+    for row in report['overloaded']:
+        print(f"{row['nome'] or row['collaboratore_id']:<30} {row['mean_substitutions']:>11.2f} {row['probability']:>7.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,244 @@
+'''
+Min-cost-flow substitution solver.
+
+Instead of filling deficits one at a time, the whole day is modelled as a
+flow network and solved in one pass:
+
+    source -> donor luogo -> candidate -> pool -> deficit -> sink
+                             candidate -> deficit, if it is their luogo_secondario
+
+- a donor luogo is a luogo in surplus and gives at most its surplus, so a
+  move never opens a new deficit and no cascade is needed;
+- a candidate is someone counted in the morning coverage of their own
+  luogo, and can be moved once;
+- a deficit is a luogo below its minimum, or the afternoon shift, and takes
+  as many people as it is missing.
+
+sub_order lists the luoghi from the first one to give up people to the last
+one: donors early in the list are preferred, and when people are short the
+deficits late in the list (and the luoghi not listed) are filled first, the
+afternoon shift last of all. Costs are integers built so that, in order of
+importance, the solver:
+
+1. covers as many missing people as possible (it is a min-cost max flow);
+2. fills the most essential deficits first when people are short;
+3. sends people to their luogo_secondario;
+4. balances sub_order donor preference against fairness: who never
+   substituted or substituted longest ago, then who has less overtime.
+
+Successive shortest paths with Dijkstra and node potentials; one search per
+covered person, on a graph linear in the number of candidates.
+'''
+
+import heapq
+from datetime import date
+
+AFTERNOON = 'afternoon'
+
+# Cost weights, from the strongest to the weakest
+PRIORITY_STEP = 10 ** 9
+SECONDARY_BONUS = 10 ** 6
+# One position in sub_order weighs like a month of ultima_sostituzione
+DONOR_STEP = 30
+# Older substitutions than this all count the same
+MAX_AGE_DAYS = 365
+# straordinari_svolti weigh one per block of this many minutes
+OVERTIME_BLOCK = 20
+MAX_OVERTIME_BLOCKS = 10 ** 4
+# One substitution in the fairness window outweighs any age and overtime;
+# counts past the cap weigh the same, so they stay below SECONDARY_BONUS
+WINDOW_LOAD_STEP = MAX_AGE_DAYS + MAX_OVERTIME_BLOCKS + 1
+MAX_WINDOW_LOAD = 90
+
+INFINITY = float('inf')
+
+
+class FlowNetwork:
+    '''Directed graph with integer capacities and non-negative costs.'''
+
+    def __init__(self, num_nodes=0):
+        # Edge e and its reverse e ^ 1 are stored side by side in flat lists
+        self.edges_from = [[] for _ in range(num_nodes)]
+        self.target = []
+        self.capacity = []
+        self.cost = []
+
+    def add_node(self):
+        self.edges_from.append([])
+        return len(self.edges_from) - 1
+
+    def add_edge(self, source, target, capacity, cost):
+        '''Add an edge and return its id, for flow_on().'''
+        edge = len(self.target)
+        self.edges_from[source].append(edge)
+        self.target.append(target)
+        self.capacity.append(capacity)
+        self.cost.append(cost)
+        self.edges_from[target].append(edge + 1)
+        self.target.append(source)
+        self.capacity.append(0)
+        self.cost.append(-cost)
+        return edge
+
+    def flow_on(self, edge):
+        return self.capacity[edge ^ 1]
+
+    def min_cost_flow(self, source, sink):
+        '''Push the maximum flow from source to sink at minimum cost; return (flow, cost).'''
+        edges_from, target, capacity, cost = self.edges_from, self.target, self.capacity, self.cost
+        num_nodes = len(edges_from)
+        potential = [0] * num_nodes
+        total_flow = total_cost = 0
+        while True:
+            distance = [INFINITY] * num_nodes
+            previous = [-1] * num_nodes
+            distance[source] = 0
+            heap = [(0, source)]
+            while heap:
+                dist, node = heapq.heappop(heap)
+                if dist > distance[node]:
+                    continue
+                if node == sink:
+                    break
+                base = dist + potential[node]
+                for edge in edges_from[node]:
+                    if capacity[edge] > 0:
+                        next_node = target[edge]
+                        candidate = base + cost[edge] - potential[next_node]
+                        if candidate < distance[next_node]:
+                            distance[next_node] = candidate
+                            previous[next_node] = edge
+                            heapq.heappush(heap, (candidate, next_node))
+            if distance[sink] == INFINITY:
+                return total_flow, total_cost
+
+            # The search stops at the sink: nodes not settled by then move by the
+            # sink distance, which keeps every reduced cost non-negative
+            sink_distance = distance[sink]
+            for node in range(num_nodes):
+                potential[node] += min(distance[node], sink_distance)
+
+            amount = INFINITY
+            node = sink
+            while node != source:
+                edge = previous[node]
+                amount = min(amount, capacity[edge])
+                node = target[edge ^ 1]
+            node = sink
+            while node != source:
+                edge = previous[node]
+                capacity[edge] -= amount
+                capacity[edge ^ 1] += amount
+                node = target[edge ^ 1]
+            total_flow += amount
+            total_cost += amount * (potential[sink] - potential[source])
+
+
+def fairness_cost(collaboratore, target_date, window_load=0):
+    '''
+    Lower for who substituted less in the fairness window (window_load),
+    then for who never substituted or did it longest ago, then for less overtime.
+    '''
+    if collaboratore.get('ultima_sostituzione') is None:
+        age = MAX_AGE_DAYS
+    else:
+        age = min(MAX_AGE_DAYS, (target_date - date.fromisoformat(collaboratore['ultima_sostituzione'])).days)
+    overtime = min(MAX_OVERTIME_BLOCKS, collaboratore.get('straordinari_svolti', 0) // OVERTIME_BLOCK)
+    return min(MAX_WINDOW_LOAD, window_load) * WINDOW_LOAD_STEP + (MAX_AGE_DAYS - age) + overtime
+
+
+def sub_order_ranks(sub_order, luogo_ids):
+    '''{luogo_id: position in sub_order}; luoghi not listed come after the listed ones.'''
+    ranks = {}
+    for position, luogo_id in enumerate(sub_order):
+        ranks.setdefault(luogo_id, position)
+    for luogo_id in luogo_ids:
+        ranks.setdefault(luogo_id, len(sub_order))
+    return ranks
+
+
+def solve(donors, candidates, demands):
+    '''
+    Pick who covers what.
+
+    donors: {luogo_id: (people it can give, cost per person)}
+    candidates: list of (collaboratore_id, home luogo_id, cost, luogo_secondario_id or None),
+        best first among equal costs
+    demands: {luogo_id or AFTERNOON: (people missing, cost per person covered)}
+
+    Returns a list of (collaboratore_id, luogo_id or AFTERNOON), the most
+    essential deficits first.
+    '''
+    total_demand = sum(amount for amount, _ in demands.values())
+    if not total_demand or not donors:
+        return []
+
+    network = FlowNetwork(3)
+    source, sink, pool = 0, 1, 2
+
+    # Deficits, most essential (cheapest) first
+    targets = sorted(demands, key=lambda t: (demands[t][1], str(t)))
+    target_node = {}
+    through_pool = {}
+    for target in targets:
+        amount, cost = demands[target]
+        target_node[target] = network.add_node()
+        through_pool[target] = network.add_edge(pool, target_node[target], amount, cost)
+        network.add_edge(target_node[target], sink, amount, 0)
+
+    # Someone whose luogo_secondario is short always gets a node. Of the
+    # others only the total_demand cheapest ones can be needed, taking no
+    # more than its surplus from each donor: any other one could be swapped
+    # for a cheaper kept one that is unused and has room at its donor
+    kept = []
+    taken = {}
+    num_taken = 0
+    order = sorted(range(len(candidates)),
+                   key=lambda i: (donors.get(candidates[i][1], (0, 0))[1] + candidates[i][2], i))
+    for position in order:
+        collab_id, luogo_id, cost, secondary = candidates[position]
+        if donors.get(luogo_id, (0, 0))[0] <= 0:
+            continue
+        has_secondary = secondary in target_node and secondary != luogo_id
+        if not has_secondary:
+            if num_taken >= total_demand or taken.get(luogo_id, 0) >= donors[luogo_id][0]:
+                continue
+            taken[luogo_id] = taken.get(luogo_id, 0) + 1
+            num_taken += 1
+        kept.append((position, has_secondary))
+
+    donor_node = {}
+    routes = []
+    for position, has_secondary in kept:
+        collab_id, luogo_id, cost, secondary = candidates[position]
+        if luogo_id not in donor_node:
+            capacity, donor_cost = donors[luogo_id]
+            donor_node[luogo_id] = network.add_node()
+            network.add_edge(source, donor_node[luogo_id], capacity, donor_cost)
+
+        node = network.add_node()
+        network.add_edge(donor_node[luogo_id], node, 1, cost)
+        pooled = network.add_edge(node, pool, 1, SECONDARY_BONUS)
+        direct = None
+        if has_secondary:
+            direct = network.add_edge(node, target_node[secondary], 1, demands[secondary][1])
+        routes.append((cost, position, collab_id, pooled, direct, secondary))
+
+    network.min_cost_flow(source, sink)
+
+    assignments = {target: [] for target in targets}
+    pooled_people = []
+    for cost, position, collab_id, pooled, direct, secondary in sorted(routes):
+        if direct is not None and network.flow_on(direct):
+            assignments[secondary].append(collab_id)
+        elif network.flow_on(pooled):
+            pooled_people.append(collab_id)
+
+    # Which pooled person covers which deficit does not change the cost:
+    # hand the best ones to the most essential deficits
+    pooled_people.reverse()
+    for target in targets:
+        for _ in range(network.flow_on(through_pool[target])):
+            assignments[target].append(pooled_people.pop())
+
+    return [(collab_id, target) for target in targets for collab_id in assignments[target]]
@@ -0,0 +1,65 @@
+// Lists of records loaded a page at a time from /api/<collection>, see app.py
+
+function testo(valore) {
+    const div = document.createElement('div');
+    div.textContent = valore ?? '';
+    return div.innerHTML;
+}
+
+function maiuscola(valore) {
+    return valore ? valore.charAt(0).toUpperCase() + valore.slice(1) : '';
+}
+
+function formElimina(url, conferma) {
+    return `<form method="POST" action="${url}" class="d-inline">
+                <button type="submit" class="btn btn-danger btn-sm" onclick="return confirm('${conferma}')">Elimina</button>
+            </form>`;
+}
+
+// opzioni: url of the API, ids of the list, of the filters form and of the
+// "load more" button, text for an empty list, and scheda(record) returning
+// the HTML of one record
+function elenco(opzioni) {
+    const contenitore = document.getElementById(opzioni.contenitore);
+    const filtri = document.getElementById(opzioni.filtri);
+    const altri = document.getElementById(opzioni.altri);
+    let cursore = null;
+
+    function carica(daCapo) {
+        const parametri = new URLSearchParams();
+        for (const [chiave, valore] of new FormData(filtri)) {
+            if (valore) {
+                parametri.set(chiave, valore);
+            }
+        }
+        if (!daCapo && cursore) {
+            parametri.set('cursore', cursore);
+        }
+        altri.disabled = true;
+        fetch(opzioni.url + '?' + parametri)
+        .then(response => response.json().then(data => ({ok: response.ok, data: data})))
+        .then(({ok, data}) => {
+            altri.disabled = false;
+            if (!ok) {
+                alert('Errore: ' + data.message);
+                return;
+            }
+            if (daCapo) {
+                contenitore.innerHTML = '';
+            }
+            contenitore.insertAdjacentHTML('beforeend', data.elementi.map(opzioni.scheda).join(''));
+            if (!contenitore.children.length) {
+                contenitore.innerHTML = `<p class="text-muted">${opzioni.vuoto}</p>`;
+            }
+            cursore = data.cursore;
+            altri.style.display = cursore ? '' : 'none';
+        });
+    }
+
+    filtri.addEventListener('submit', event => {
+        event.preventDefault();
+        carica(true);
+    });
+    altri.addEventListener('click', () => carica(false));
+    carica(true);
+}
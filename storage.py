@@ -0,0 +1,1365 @@
+#!/usr/bin/env python3
+'''
+Storage backends of the dataset.
+
+The dataset is a handful of named collections, addressed by the name of
+their historical JSON file ('collaboratori.json', 'assenze.json', ...):
+most are lists of records with an integer 'id', two (orari_pomeriggio,
+sub_order) are documents stored whole. A backend offers:
+
+    load(filename)                      the whole collection, cached
+    save(filename, data)                replace the whole collection
+    insert(filename, record)            add a record, returns it with a new id
+    insert_many(filename, records)      add several records in one write
+    update(filename, record_id, changes)
+    delete(filename, record_id)
+    digest(filename)                    hex digest of the content
+    query(filename, where, between, order, descending, after, limit)
+                                        one page of records, filtered and
+                                        sorted on indexed columns
+    modified(filename)                  time of the last change
+    revision(filename)                  token that changes with every write,
+                                        without reading any record
+
+JsonStorage keeps one JSON file per collection, like the app always did,
+plus an append-only journal of the record changes next to each one.
+The collections that grow without limit (PARTITIONED: assenze) are split
+by month instead, data/assenze/2026-01.json and so on, and the months
+long gone are gzip-compressed by compact(). Each month can be read on its
+own like a collection, partition_filename('assenze.json', '2026-01'), so
+whoever needs one date never parses the whole history. Loading the whole
+collection gives the records in the order they were inserted, as the
+single file did.
+SQLiteStorage keeps everything in one SQLite database in WAL mode: one
+table per record collection with the fields the engine filters on as
+indexed columns and the whole record as JSON next to them, so that adding,
+changing or deleting a record is one small transaction instead of a
+rewrite of the whole file, and concurrent workers are serialized by
+SQLite.
+
+Every write is safe across threads and processes: JsonStorage replaces
+files atomically and holds flock() on data/.dataset.lock (shared to read,
+exclusive to write), SQLite locks the database itself. locked() holds the
+write lock across several operations, for a read-modify-write.
+
+Ids handed out by insert() are never reused, not even after deleting the
+last record: SQLite tables use AUTOINCREMENT, JSON collections keep their
+last id in id_sequences.json.
+
+Run `python storage.py migrate` once to copy data/*.json into
+data/dataset.sqlite3; from then on dataset.py uses the database.
+`python storage.py compact` folds the JSON journals into their files and
+compresses the old partitions.
+'''
+
+import argparse
+import bisect
+import contextlib
+import gzip
+import hashlib
+import json
+import logging
+import os
+import queue
+import re
+import sqlite3
+import threading
+from datetime import date
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+try:
+    import fcntl
+except ImportError:
+    # No flock (Windows): the locks only hold within the process
+    fcntl = None
+
+DATABASE_FILENAME = 'dataset.sqlite3'
+SEQUENCES_FILENAME = 'id_sequences.json'
+JOURNAL_SUFFIX = '.journal'
+LOCK_FILENAME = '.dataset.lock'
+
+GZIP_SUFFIX = '.gz'
+
+# A journal longer than this is folded into a new snapshot
+COMPACT_BYTES = 1 << 20
+
+# Record collections: filename -> (table, columns copied out of the record for indexing)
+TABLES = {
+    'luoghi.json': ('luoghi', ()),
+    'collaboratori.json': ('collaboratori', ('luogo_id',)),
+    'assenze.json': ('assenze', ('collaboratore_id', 'data')),
+    'turnazioni.json': ('turnazioni', ('collaboratore_id', 'giorno_settimana', 'anno', 'mese')),
+    'coperture_fisse.json': ('coperture_fisse', ('collaboratore_id', 'giorno_settimana')),
+    'storico.json': ('storico', ('collaboratore_id', 'data', 'ufficializzazione')),
+}
+
+# table -> indexed column groups
+INDEXES = {
+    'collaboratori': (('luogo_id',),),
+    'assenze': (('collaboratore_id',), ('data',)),
+    'turnazioni': (('collaboratore_id',), ('giorno_settimana',), ('anno', 'mese')),
+    'coperture_fisse': (('collaboratore_id',), ('giorno_settimana',)),
+    'storico': (('collaboratore_id', 'data'), ('data',), ('ufficializzazione',)),
+}
+
+# Documents stored whole, everything that is not in TABLES
+DOCUMENTS = ('orari_pomeriggio.json', 'sub_order.json')
+
+# Record collections of TABLES split by the month of a date field: filename -> field
+PARTITIONED = {
+    'assenze.json': 'data',
+}
+# Partition of the records without a valid date
+UNDATED = '0000-00'
+# [id, month] of the records of a partitioned collection in insertion
+# order, next to its months; only there when that is not the order of the ids
+ORDER_FILENAME = 'order.json'
+# compact() compresses the partitions of the months ended this long ago
+COMPRESS_AFTER_MONTHS = 3
+
+_MONTH = re.compile(r'\d{4}-\d{2}')
+# Files of a partition in the directory of its collection
+_PARTITION_FILE = re.compile(r'(\d{4}-\d{2})\.json(?:\.gz|\.journal)?$')
+
+
+def month_of(value):
+    '''Partition ('YYYY-MM') of an ISO date string or a date.'''
+    if isinstance(value, date):
+        value = value.isoformat()
+    if isinstance(value, str) and _MONTH.match(value):
+        return value[:7]
+    return UNDATED
+
+
+def partition_filename(filename, month):
+    '''Name of the partition of a PARTITIONED collection with one month, read-only.'''
+    return f"{filename[:-len('.json')]}/{month}.json"
+
+
+def _order_filename(filename):
+    return f"{filename[:-len('.json')]}/{ORDER_FILENAME}"
+
+
+def _id_key(record):
+    return record.get('id') or 0
+
+
+def _insertion_order(parts, order):
+    '''
+    Records of every month in the order they were inserted: those written by
+    the last save() in their order, the ones inserted since after them, by
+    id. A record matches its id in its month first, then its id in any
+    month, for when an update moved it.
+    '''
+    ranks = {}
+    for rank, (record_id, month) in enumerate(order):
+        ranks.setdefault((record_id, month), []).append(rank)
+    keys = {}
+    for month, state in parts:
+        for position, record in enumerate(state.data):
+            waiting = ranks.get((record.get('id'), month))
+            if waiting:
+                keys[month, position] = waiting.pop(0)
+    leftover = {}
+    for (record_id, _), waiting in sorted(ranks.items(), key=lambda item: item[1][:1]):
+        leftover.setdefault(record_id, []).extend(waiting)
+    rows = []
+    for month, state in parts:
+        for position, record in enumerate(state.data):
+            key = keys.get((month, position))
+            if key is None:
+                waiting = leftover.get(record.get('id'))
+                key = waiting.pop(0) if waiting else len(order) + _id_key(record)
+            rows.append((key, record))
+    rows.sort(key=lambda row: row[0])
+    return [record for _, record in rows]
+
+
+def _partition_parent(filename):
+    '''(collection, month) of a partition filename, None for anything else.'''
+    directory, _, name = filename.rpartition('/')
+    match = _PARTITION_FILE.match(name)
+    if directory and f"{directory}.json" in PARTITIONED and match and name == f"{match.group(1)}.json":
+        return f"{directory}.json", match.group(1)
+    return None
+
+
+def _is_old(month, today=None):
+    if month == UNDATED:
+        return False
+    today = today or date.today()
+    year, number = map(int, month.split('-'))
+    return (today.year * 12 + today.month) - (year * 12 + number) >= COMPRESS_AFTER_MONTHS
+
+
+def _digest(raw):
+    return hashlib.sha256(raw).hexdigest()
+
+
+def _dumps(data):
+    return json.dumps(data, ensure_ascii=False, indent=2)
+
+
+def _next_id(records, last_id):
+    return max([last_id] + [record['id'] for record in records if isinstance(record.get('id'), int)]) + 1
+
+
+def _check_query(filename, where, between, order, after):
+    '''Refuse a query on something else than the indexed columns of a record collection.'''
+    if filename not in TABLES:
+        raise ValueError(f"{filename} non è una collezione di elementi")
+    _, columns = TABLES[filename]
+    used = list(where or {}) + ([between[0]] if between else []) + [order]
+    for column in used:
+        if column != 'id' and column not in columns:
+            raise ValueError(f"Colonna non indicizzata in {filename}: {column}")
+    if after is not None and (not isinstance(after, (list, tuple)) or len(after) != 2
+                              or not isinstance(after[1], int)):
+        raise ValueError("Cursore non valido")
+
+
+def _matches(record, where, between):
+    if any(record.get(column) != value for column, value in where.items()):
+        return False
+    if between is not None:
+        column, low, high = between
+        value = record.get(column)
+        if value is None or (low is not None and value < low) or (high is not None and value > high):
+            return False
+    return True
+
+
+def _page(matches, limit, order):
+    '''(first `limit` matches, cursor after the last of them or None if there are no more).'''
+    page = matches[:limit]
+    after = [page[-1].get(order), page[-1]['id']] if len(matches) > limit else None
+    return page, after
+
+
+class _DirectoryLock:
+    '''
+    Readers-writer lock over a data directory: an RLock among the threads
+    of a process, flock() on a lock file among processes. Nested holds join
+    the outermost one. A shared hold cannot become exclusive: flock() would
+    drop it before taking the other, and someone could write in between, so
+    whatever may write takes the exclusive lock from the start.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._file = None
+        self._pid = None
+        self._depth = 0
+        self._exclusive = False
+
+    def _flock(self, operation):
+        '''flock() with 'LOCK_SH', 'LOCK_EX' or 'LOCK_UN'.'''
+        if fcntl is None:
+            return
+        # A lock file inherited through fork() would share its locks with the parent
+        if self._file is None or self._pid != os.getpid():
+            self._file = open(self.path, 'a+b')
+            self._pid = os.getpid()
+        fcntl.flock(self._file.fileno(), getattr(fcntl, operation))
+
+    @contextlib.contextmanager
+    def hold(self, exclusive):
+        with self._lock:
+            if self._depth == 0:
+                self._flock('LOCK_EX' if exclusive else 'LOCK_SH')
+                self._exclusive = exclusive
+            elif exclusive and not self._exclusive:
+                raise RuntimeError("Scrittura dentro una lettura: serve il lock esclusivo fin dall'inizio")
+            self._depth += 1
+            try:
+                yield
+            finally:
+                self._depth -= 1
+                if self._depth == 0:
+                    self._flock('LOCK_UN')
+
+
+class _Journal:
+    '''
+    Append-only log of the changes to one collection, one JSON object per
+    line. Writers that wait for their line to reach the disk while another
+    fsync is running share the next fsync instead of issuing one each.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._pid = None
+        self._write_lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        # Lines written, and lines known to be on disk
+        self._written = 0
+        self._synced = 0
+
+    def append(self, line):
+        '''Write one line; returns (ticket for sync(), size of the journal after it).'''
+        with self._write_lock:
+            if self._file is not None and (self._pid != os.getpid() or not self._is_current()):
+                # Inherited through fork(), or dropped by another process's compaction
+                self._file.close()
+                self._file = None
+            if self._file is None:
+                self._file = open(self.path, 'ab')
+                self._pid = os.getpid()
+            self._file.write(line)
+            self._file.flush()
+            self._written += 1
+            return self._written, self._file.tell()
+
+    def _is_current(self):
+        try:
+            return os.stat(self.path).st_ino == os.fstat(self._file.fileno()).st_ino
+        except FileNotFoundError:
+            return False
+
+    def sync(self, ticket):
+        '''Wait until the line of `ticket` is on disk.'''
+        with self._sync_lock:
+            if self._synced >= ticket:
+                return
+            with self._write_lock:
+                target, file = self._written, self._file
+            if file is not None:
+                os.fsync(file.fileno())
+            self._synced = target
+
+    def remove(self):
+        '''Drop the journal, once its content is safely in the snapshot.'''
+        with self._sync_lock, self._write_lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+            self._synced = self._written
+
+
+class _State:
+    '''What a JsonStorage knows of a collection, and up to where it read its files.'''
+
+    __slots__ = ('stamp', 'offset', 'data', 'hasher', 'last_id', 'indexes')
+
+    def __init__(self, stamp, offset, data, hasher, last_id=0):
+        self.stamp = stamp
+        self.offset = offset
+        self.data = data
+        self.hasher = hasher
+        self.last_id = last_id
+        # Built by query() on first use: key -> (sort keys, records)
+        self.indexes = {}
+
+    @property
+    def digest(self):
+        return self.hasher.hexdigest()
+
+
+def _stamp(stat):
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+def _write_atomic(path, raw):
+    '''Write a file so that readers see either the old content or the new one, never a part.'''
+    temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(temporary, 'wb') as f:
+            f.write(raw)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, path)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+
+
+def _apply(records, last_id, change):
+    '''Apply one journal line to a list of records; returns the new last id.'''
+    if change['op'] == 'insert':
+        record = change['record']
+        if record['id'] > last_id:
+            records.append(record)
+            return record['id']
+        # Already in the snapshot: a compaction stopped before dropping the journal
+        positions = [i for i, existing in enumerate(records) if existing.get('id') == record['id']]
+        for i in positions:
+            records[i] = record
+        if not positions:
+            records.append(record)
+    elif change['op'] == 'update':
+        for i, existing in enumerate(records):
+            if existing.get('id') == change['id']:
+                records[i] = dict(existing, **change['changes'])
+                records[i]['id'] = change['id']
+    elif change['op'] == 'delete':
+        records[:] = [existing for existing in records if existing.get('id') != change['id']]
+    return last_id
+
+
+class JsonStorage:
+    '''
+    One JSON file per collection in data_dir, parsed again only when it changes.
+
+    The record collections (TABLES) are a snapshot, <name>.json, plus a
+    journal, <name>.json.journal: insert(), update() and delete() append one
+    line to the journal, however big the collection is, and loading replays
+    the lines added since the last load on top of what was already read.
+    Once a journal passes compact_bytes a background thread folds it into a
+    new snapshot. Replaying a line again is harmless, so a compaction
+    interrupted between writing the snapshot and dropping the journal loses
+    nothing.
+
+    A PARTITIONED collection is a directory of such collections, one per
+    month, <name>/YYYY-MM.json (.json.gz once compressed). Their ids come
+    from id_sequences.json, taken before the record is written. A
+    partitioned collection found as a single file, from an older data
+    directory or written by hand, is split on first use.
+    '''
+
+    def __init__(self, data_dir, on_change=None, compact_bytes=COMPACT_BYTES):
+        self.data_dir = os.path.abspath(data_dir)
+        self.compact_bytes = compact_bytes
+        self._on_change = on_change or (lambda: None)
+        # Shared while reading the files, exclusive while writing them
+        self._lock = _DirectoryLock(os.path.join(self.data_dir, LOCK_FILENAME))
+        self._mutex = threading.Lock()
+        # absolute path of the snapshot -> _State
+        self._cache = {}
+        # filename -> _Journal
+        self._journals = {}
+        self._compactions = queue.Queue()
+        self._pending_compactions = set()
+        self._compactor = None
+        # filename of a partitioned collection -> ([(month, partition _State)], whole _State)
+        self._combined = {}
+
+    def _path(self, filename):
+        return os.path.join(self.data_dir, filename)
+
+    def _journal(self, filename):
+        with self._mutex:
+            journal = self._journals.get(filename)
+            if journal is None:
+                journal = self._journals[filename] = _Journal(self._path(filename) + JOURNAL_SUFFIX)
+            return journal
+
+    def _read(self, path):
+        '''(stamp, raw bytes) of a file, the stamp taken from the file that was read.'''
+        with open(path, 'rb') as f:
+            stamp, raw = _stamp(os.fstat(f.fileno())), f.read()
+        if path.endswith(GZIP_SUFFIX):
+            raw = gzip.decompress(raw)
+        return stamp, raw
+
+    def _snapshot(self, path):
+        '''Path of the snapshot of a collection: the compressed one if that is what there is.'''
+        if not os.path.exists(path) and os.path.exists(path + GZIP_SUFFIX):
+            return path + GZIP_SUFFIX
+        return path
+
+    def _document(self, filename):
+        path = self._path(filename)
+        stamp = _stamp(os.stat(path))
+        cached = self._cache.get(path)
+        if cached is not None and cached.stamp == stamp:
+            return cached
+
+        with self._lock.hold(exclusive=False):
+            stamp, raw = self._read(path)
+            state = _State(stamp, 0, json.loads(raw.decode('utf-8')), hashlib.sha256(raw))
+            self._cache[path] = state
+        self._on_change()
+        return state
+
+    def _sequence(self, filename):
+        try:
+            return self._document(SEQUENCES_FILENAME).data.get(filename, 0)
+        except FileNotFoundError:
+            return 0
+
+    def _stamps(self, path):
+        '''Stamp of a snapshot (None if missing) and size of its journal.'''
+        try:
+            stamp = _stamp(os.stat(self._snapshot(path)))
+        except FileNotFoundError:
+            stamp = None
+        try:
+            size = os.stat(path + JOURNAL_SUFFIX).st_size
+        except FileNotFoundError:
+            size = 0
+        return stamp, size
+
+    def _records(self, filename, missing_ok=False):
+        '''State of a record collection: the snapshot, then the journal lines not applied yet.'''
+        path = self._path(filename)
+        journal_path = path + JOURNAL_SUFFIX
+        stamp, size = self._stamps(path)
+        state = self._cache.get(path)
+        if state is not None and state.stamp == stamp and state.offset == size:
+            return state
+
+        with self._lock.hold(exclusive=False):
+            # Nobody writes from here on: look again
+            stamp, size = self._stamps(path)
+            state = self._cache.get(path)
+            if state is not None and state.stamp == stamp and state.offset == size:
+                return state
+
+            if state is None or state.stamp != stamp or state.offset > size:
+                if stamp is not None:
+                    stamp, raw = self._read(self._snapshot(path))
+                    data = json.loads(raw.decode('utf-8'))
+                elif size or missing_ok:
+                    raw, data = b'', []
+                else:
+                    raise FileNotFoundError(f"{path} non trovato")
+                state = _State(stamp, 0, data, hashlib.sha256(raw),
+                               _next_id(data, self._sequence(filename)) - 1)
+
+            if size > state.offset:
+                with open(journal_path, 'rb') as f:
+                    f.seek(state.offset)
+                    tail = f.read()
+                # A line still being written by someone else is read next time
+                tail = tail[:tail.rfind(b'\n') + 1]
+                if tail:
+                    records, last_id = list(state.data), state.last_id
+                    for line in tail.splitlines():
+                        last_id = _apply(records, last_id, json.loads(line.decode('utf-8')))
+                    hasher = state.hasher.copy()
+                    hasher.update(tail)
+                    state = _State(state.stamp, state.offset + len(tail), records, hasher, last_id)
+
+            self._cache[path] = state
+        self._on_change()
+        return state
+
+    def _entry(self, filename):
+        if filename in PARTITIONED:
+            return self._partitioned(filename)
+        parent = _partition_parent(filename)
+        if parent is not None:
+            self._unsplit(parent[0])
+            return self._records(filename, missing_ok=True)
+        if filename in TABLES:
+            return self._records(filename)
+        return self._document(filename)
+
+    def load(self, filename):
+        return self._entry(filename).data
+
+    def digest(self, filename):
+        return self._entry(filename).digest
+
+    def _files(self, filename):
+        '''Every file a collection may be stored in.'''
+        path = self._path(filename)
+        files = [path, path + GZIP_SUFFIX, path + JOURNAL_SUFFIX]
+        if filename in PARTITIONED:
+            directory = self._directory(filename)
+            try:
+                files += [directory] + [os.path.join(directory, name) for name in sorted(os.listdir(directory))]
+            except FileNotFoundError:
+                pass
+        return files
+
+    def modified(self, filename):
+        '''POSIX time of the last write to a collection, 0 if it does not exist.'''
+        times = [0]
+        for name in self._files(filename):
+            try:
+                times.append(os.stat(name).st_mtime)
+            except FileNotFoundError:
+                pass
+        return max(times)
+
+    def revision(self, filename):
+        '''Hex token that changes whenever a file of the collection does; only stats the files.'''
+        combined = hashlib.sha256()
+        for name in self._files(filename):
+            try:
+                stat = os.stat(name)
+            except FileNotFoundError:
+                continue
+            combined.update(f"{name}:{_stamp(stat)}\n".encode('utf-8'))
+        return combined.hexdigest()
+
+    def _directory(self, filename):
+        return self._path(filename[:-len('.json')])
+
+    def _months(self, filename):
+        try:
+            names = os.listdir(self._directory(filename))
+        except FileNotFoundError:
+            return []
+        return sorted({match.group(1) for match in map(_PARTITION_FILE.match, names) if match})
+
+    def partitions(self, filename):
+        '''Months ('YYYY-MM') with a partition of a PARTITIONED collection, oldest first.'''
+        self._unsplit(filename)
+        return self._months(filename)
+
+    def _unsplit(self, filename):
+        '''Split a partitioned collection still stored as one file into its months.'''
+        path = self._path(filename)
+        if not any(os.path.exists(name) for name in (path, path + JOURNAL_SUFFIX)):
+            return
+        with self._lock.hold(exclusive=True):
+            if not any(os.path.exists(name) for name in (path, path + JOURNAL_SUFFIX)):
+                return
+            state = self._records(filename)
+            self._save_partitions(filename, state.data, state.last_id)
+            # If this stops halfway, the next call splits the same file again
+            if os.path.exists(path):
+                os.remove(path)
+            self._journal(filename).remove()
+            self._cache.pop(path, None)
+
+    def _partitioned(self, filename):
+        '''State of a whole partitioned collection, put together from its months.'''
+        self._unsplit(filename)
+        with self._lock.hold(exclusive=False):
+            parts = [(month, self._records(partition_filename(filename, month), missing_ok=True))
+                     for month in self._months(filename)]
+            try:
+                order = self._document(_order_filename(filename))
+            except FileNotFoundError:
+                order = None
+        cached = self._combined.get(filename)
+        if (cached is not None and len(cached[0]) == len(parts) and order is cached[1]
+                and all(month == old_month and state is old_state
+                        for (month, state), (old_month, old_state) in zip(parts, cached[0]))):
+            return cached[2]
+        hasher = hashlib.sha256()
+        for month, state in parts:
+            hasher.update(f"{month}:{state.digest}\n".encode('utf-8'))
+        if order is None:
+            # Inserted one after another: the ids are the order
+            data = sorted((record for _, state in parts for record in state.data), key=_id_key)
+        else:
+            hasher.update(f"{ORDER_FILENAME}:{order.digest}\n".encode('utf-8'))
+            data = _insertion_order(parts, order.data)
+        whole = _State(None, 0, data, hasher, self._sequence(filename))
+        self._combined[filename] = (parts, order, whole)
+        return whole
+
+    def _sorted(self, state, order):
+        '''(sort keys, records) of a collection by (order, id), records without `order` left out.'''
+        index = state.indexes.get(order)
+        if index is None:
+            rows = sorted((((record.get(order), record['id']), record) for record in state.data
+                           if record.get(order) is not None and isinstance(record.get('id'), int)),
+                          key=lambda row: row[0])
+            index = state.indexes[order] = ([key for key, _ in rows], [record for _, record in rows])
+        return index
+
+    def _postings(self, state, order, column):
+        '''{value of column: (sort keys, records)}, each sorted like _sorted(state, order).'''
+        index = state.indexes.get((order, column))
+        if index is None:
+            index = {}
+            for key, record in zip(*self._sorted(state, order)):
+                keys, records = index.setdefault(record.get(column), ([], []))
+                keys.append(key)
+                records.append(record)
+            state.indexes[(order, column)] = index
+        return index
+
+    def query(self, filename, where=None, between=None, order='id', descending=False, after=None, limit=50):
+        '''
+        One page of a record collection, without going through all of it:
+        the records with where[column] == value for every column and
+        between = (column, low, high) in the range (bounds included, None
+        for open), sorted by (order, id), the first `limit` after the sort
+        key `after`. Returns (records, cursor for the next page or None).
+        Every column must be one of TABLES. The sorted lists and the
+        postings of each value are built once per version of the collection.
+        '''
+        _check_query(filename, where, between, order, after)
+        where = dict(where or {})
+        if filename in PARTITIONED and order == PARTITIONED[filename]:
+            return self._query_partitions(filename, where, between, order, descending, after, limit)
+        state = self._entry(filename) if filename in PARTITIONED else self._records(filename, missing_ok=True)
+        return _page(self._matches(state, where, between, order, descending, after, limit), limit, order)
+
+    def _query_partitions(self, filename, where, between, order, descending, after, limit):
+        '''query() sorted by the partition field: only the months in the range are read, in order.'''
+        self._unsplit(filename)
+        months = self._months(filename)
+        if between is not None and between[0] == order:
+            months = [month for month in months
+                      if (between[1] is None or month >= month_of(between[1]))
+                      and (between[2] is None or month <= month_of(between[2]))]
+        if after is not None:
+            cursor = month_of(after[0])
+            months = [month for month in months if (month <= cursor if descending else month >= cursor)]
+        matches = []
+        with self._lock.hold(exclusive=False):
+            for month in (reversed(months) if descending else months):
+                state = self._records(partition_filename(filename, month), missing_ok=True)
+                matches += self._matches(state, where, between, order, descending, after, limit - len(matches))
+                if len(matches) > limit:
+                    break
+        return _page(matches, limit, order)
+
+    def _matches(self, state, where, between, order, descending, after, limit):
+        '''Up to limit + 1 records of a state for query(), in order.'''
+        keys, records = self._sorted(state, order)
+        # Walk the shortest list among the equality filters
+        for column, value in where.items():
+            posting = self._postings(state, order, column).get(value, ([], []))
+            if len(posting[0]) < len(keys):
+                keys, records = posting
+
+        low, high = 0, len(keys)
+        try:
+            if between is not None and between[0] == order:
+                if between[1] is not None:
+                    low = bisect.bisect_left(keys, (between[1],))
+                if between[2] is not None:
+                    high = bisect.bisect_right(keys, (between[2], float('inf')))
+            if after is not None:
+                if descending:
+                    high = min(high, bisect.bisect_left(keys, tuple(after)))
+                else:
+                    low = max(low, bisect.bisect_right(keys, tuple(after)))
+        except TypeError:
+            raise ValueError("Cursore non valido") from None
+
+        matches = []
+        for position in (range(high - 1, low - 1, -1) if descending else range(low, high)):
+            if _matches(records[position], where, between):
+                matches.append(records[position])
+                if len(matches) > limit:
+                    break
+        return matches
+
+    def locked(self):
+        '''
+        Hold the write lock of the directory across several operations, for
+        a read-modify-write: other threads and processes wait to write, and
+        to read what changed.
+        '''
+        return self._lock.hold(exclusive=True)
+
+    def save(self, filename, data):
+        with self._lock.hold(exclusive=True):
+            if filename in PARTITIONED:
+                self._unsplit(filename)
+                self._save_partitions(filename, data, _next_id(data, self._sequence(filename)) - 1)
+            elif filename in TABLES:
+                try:
+                    last_id = self._records(filename).last_id
+                except FileNotFoundError:
+                    last_id = 0
+                self._fold(filename, data, _next_id(data, last_id) - 1)
+            else:
+                path = self._path(filename)
+                # If the write fails the next load() reads the file again
+                self._cache.pop(path, None)
+                raw = _dumps(data).encode('utf-8')
+                _write_atomic(path, raw)
+                self._cache[path] = _State(_stamp(os.stat(path)), 0, data, hashlib.sha256(raw))
+        self._on_change()
+
+    def _set_sequence(self, filename, last_id):
+        try:
+            sequences = self._document(SEQUENCES_FILENAME).data
+        except FileNotFoundError:
+            sequences = {}
+        if sequences.get(filename, 0) != last_id:
+            self.save(SEQUENCES_FILENAME, dict(sequences, **{filename: last_id}))
+
+    def _fold(self, filename, data, last_id, compress=False):
+        '''Make `data` the snapshot of a record collection (or partition) and drop its journal.'''
+        path = self._path(filename)
+        self._cache.pop(path, None)
+        if _partition_parent(filename) is None:
+            # The last id must survive the journal lines that recorded it
+            self._set_sequence(filename, last_id)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        raw = _dumps(data).encode('utf-8')
+        target, stale = (path + GZIP_SUFFIX, path) if compress else (path, path + GZIP_SUFFIX)
+        _write_atomic(target, gzip.compress(raw, mtime=0) if compress else raw)
+        if os.path.exists(stale):
+            os.remove(stale)
+        self._journal(filename).remove()
+        self._cache[path] = _State(_stamp(os.stat(target)), 0, data, hashlib.sha256(raw), last_id)
+
+    def _save_partitions(self, filename, data, last_id):
+        '''Make `data` the content of a partitioned collection, month by month.'''
+        by_month = {}
+        for record in data:
+            by_month.setdefault(month_of(record.get(PARTITIONED[filename])), []).append(record)
+        self._set_sequence(filename, last_id)
+        for month in self._months(filename):
+            if month not in by_month:
+                self._drop(partition_filename(filename, month))
+        for month, records in sorted(by_month.items()):
+            self._fold(partition_filename(filename, month), records, _next_id(records, 0) - 1)
+        # Keep the order of `data` where the ids alone would not give it back
+        by_id = sorted((record for _, records in sorted(by_month.items()) for record in records), key=_id_key)
+        order_path = self._path(_order_filename(filename))
+        if any(record is not original for record, original in zip(by_id, data)):
+            self.save(_order_filename(filename),
+                      [[record.get('id'), month_of(record.get(PARTITIONED[filename]))] for record in data])
+        elif os.path.exists(order_path):
+            self._cache.pop(order_path, None)
+            os.remove(order_path)
+
+    def _drop(self, filename):
+        '''Remove a partition, snapshot and journal.'''
+        path = self._path(filename)
+        self._cache.pop(path, None)
+        for name in (path, path + GZIP_SUFFIX):
+            if os.path.exists(name):
+                os.remove(name)
+        self._journal(filename).remove()
+
+    def _append(self, filename, state, *changes):
+        '''Write changes to the journal in one write and apply them to the cached state, without waiting for the disk.'''
+        lines = b''.join((json.dumps(change, ensure_ascii=False, separators=(',', ':')) + '\n').encode('utf-8')
+                         for change in changes)
+        ticket, size = self._journal(filename).append(lines)
+        records = list(state.data)
+        last_id = state.last_id
+        for change in changes:
+            last_id = _apply(records, last_id, change)
+        path = self._path(filename)
+        if size == state.offset + len(lines):
+            hasher = state.hasher.copy()
+            hasher.update(lines)
+            self._cache[path] = _State(state.stamp, size, records, hasher, last_id)
+        else:
+            # Someone else wrote to the journal too: replay it on the next load
+            self._cache.pop(path, None)
+        return ticket, size
+
+    def _commit(self, filename, ticket, size):
+        self._journal(filename).sync(ticket)
+        self._on_change()
+        if size > self.compact_bytes:
+            self._request_compaction(filename)
+
+    def insert(self, filename, record):
+        if filename in PARTITIONED:
+            return self._insert_partitioned(filename, record)
+        with self._lock.hold(exclusive=True):
+            state = self._records(filename, missing_ok=True)
+            record = dict(record, id=state.last_id + 1)
+            ticket, size = self._append(filename, state, {'op': 'insert', 'record': record})
+        self._commit(filename, ticket, size)
+        return record
+
+    def insert_many(self, filename, records):
+        '''Add records with one journal write and one fsync; returns them with their new ids.'''
+        if filename in PARTITIONED:
+            return [self.insert(filename, record) for record in records]
+        if not records:
+            return []
+        with self._lock.hold(exclusive=True):
+            state = self._records(filename, missing_ok=True)
+            records = [dict(record, id=state.last_id + position) for position, record in enumerate(records, 1)]
+            ticket, size = self._append(filename, state, *({'op': 'insert', 'record': record} for record in records))
+        self._commit(filename, ticket, size)
+        return records
+
+    def update(self, filename, record_id, changes):
+        if filename in PARTITIONED:
+            return self._update_partitioned(filename, record_id, changes)
+        with self._lock.hold(exclusive=True):
+            state = self._records(filename, missing_ok=True)
+            if not any(record.get('id') == record_id for record in state.data):
+                return False
+            ticket, size = self._append(filename, state, {'op': 'update', 'id': record_id, 'changes': changes})
+        self._commit(filename, ticket, size)
+        return True
+
+    def delete(self, filename, record_id):
+        if filename in PARTITIONED:
+            return self._delete_partitioned(filename, record_id)
+        with self._lock.hold(exclusive=True):
+            state = self._records(filename, missing_ok=True)
+            if not any(record.get('id') == record_id for record in state.data):
+                return False
+            ticket, size = self._append(filename, state, {'op': 'delete', 'id': record_id})
+        self._commit(filename, ticket, size)
+        return True
+
+    def _partition_for(self, filename, record):
+        '''Filename and state of the partition a record belongs in, its directory created.'''
+        os.makedirs(self._directory(filename), exist_ok=True)
+        partition = partition_filename(filename, month_of(record.get(PARTITIONED[filename])))
+        return partition, self._records(partition, missing_ok=True)
+
+    def _locate(self, filename, record_id):
+        '''
+        Filename and state of the partition holding a record, (None, None) if
+        there is none. Looks from the newest month back: the records changed
+        are mostly recent ones.
+        '''
+        for month in reversed(self._months(filename)):
+            partition = partition_filename(filename, month)
+            state = self._records(partition, missing_ok=True)
+            if any(record.get('id') == record_id for record in state.data):
+                return partition, state
+        return None, None
+
+    def _insert_partitioned(self, filename, record):
+        self._unsplit(filename)
+        with self._lock.hold(exclusive=True):
+            record = dict(record, id=self._sequence(filename) + 1)
+            # The id is taken before the record is written: a crash in between skips it, never reuses it
+            self._set_sequence(filename, record['id'])
+            partition, state = self._partition_for(filename, record)
+            ticket, size = self._append(partition, state, {'op': 'insert', 'record': record})
+        self._commit(partition, ticket, size)
+        return record
+
+    def _update_partitioned(self, filename, record_id, changes):
+        self._unsplit(filename)
+        with self._lock.hold(exclusive=True):
+            partition, state = self._locate(filename, record_id)
+            if partition is None:
+                return False
+            record = dict(next(record for record in state.data if record.get('id') == record_id), **changes)
+            record['id'] = record_id
+            target, target_state = self._partition_for(filename, record)
+            if target == partition:
+                writes = [(partition,) + self._append(partition, state,
+                                                      {'op': 'update', 'id': record_id, 'changes': changes})]
+            else:
+                # A new date moves the record to another month: on disk there before it leaves the old one
+                ticket, size = self._append(target, target_state, {'op': 'insert', 'record': record})
+                self._journal(target).sync(ticket)
+                writes = [(target, ticket, size),
+                          (partition,) + self._append(partition, state, {'op': 'delete', 'id': record_id})]
+        for partition, ticket, size in writes:
+            self._commit(partition, ticket, size)
+        return True
+
+    def _delete_partitioned(self, filename, record_id):
+        self._unsplit(filename)
+        with self._lock.hold(exclusive=True):
+            partition, state = self._locate(filename, record_id)
+            if partition is None:
+                return False
+            ticket, size = self._append(partition, state, {'op': 'delete', 'id': record_id})
+        self._commit(partition, ticket, size)
+        return True
+
+    def compact(self, filename):
+        '''
+        Fold the journal of a record collection into a new snapshot. For a
+        partitioned one, every month: the old ones end up compressed, the
+        empty ones removed.
+        '''
+        if filename in PARTITIONED:
+            for month in self.partitions(filename):
+                self.compact(partition_filename(filename, month))
+            return
+        parent = _partition_parent(filename)
+        path = self._path(filename)
+        with self._lock.hold(exclusive=True):
+            try:
+                state = self._records(filename, missing_ok=parent is not None)
+            except FileNotFoundError:
+                return
+            if parent is not None and not state.data:
+                self._drop(filename)
+                return
+            compress = parent is not None and _is_old(parent[1])
+            if (state.offset or os.path.exists(path + JOURNAL_SUFFIX)
+                    or compress != os.path.exists(path + GZIP_SUFFIX)):
+                self._fold(filename, state.data, state.last_id, compress=compress)
+
+    def _request_compaction(self, filename):
+        with self._mutex:
+            if filename in self._pending_compactions:
+                return
+            self._pending_compactions.add(filename)
+            if self._compactor is None:
+                self._compactor = threading.Thread(target=self._compact_loop, name='journal-compactor', daemon=True)
+                self._compactor.start()
+        self._compactions.put(filename)
+
+    def _compact_loop(self):
+        while True:
+            filename = self._compactions.get()
+            try:
+                with self._mutex:
+                    self._pending_compactions.discard(filename)
+                try:
+                    self.compact(filename)
+                except Exception:
+                    # The journal stays and keeps working, the next write asks again
+                    metrics.COMPACTION_FAILURES.inc(collection=filename)
+                    logger.exception("Compattazione di %s non riuscita", filename)
+            finally:
+                self._compactions.task_done()
+
+    def flush(self):
+        '''Wait until the compactions requested so far are done.'''
+        self._compactions.join()
+
+
+class SQLiteStorage:
+    '''All the collections in one SQLite database, see the module docstring.'''
+
+    def __init__(self, path, on_change=None):
+        self.path = os.path.abspath(path)
+        self._on_change = on_change or (lambda: None)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # filename -> (revision, data, digest)
+        self._cache = {}
+        self._create_schema()
+
+    def _connection(self):
+        # sqlite3 connections belong to one thread, and must not survive a fork
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def _create_schema(self):
+        connection = self._connection()
+        with _transaction(connection):
+            for table, columns in TABLES.values():
+                column_defs = ''.join(f", {column}" for column in columns)
+                connection.execute(f"CREATE TABLE IF NOT EXISTS {table} "
+                                   f"(id INTEGER PRIMARY KEY AUTOINCREMENT{column_defs}, body TEXT NOT NULL)")
+                for group in INDEXES.get(table, ()):
+                    connection.execute(f"CREATE INDEX IF NOT EXISTS {table}_{'_'.join(group)} "
+                                       f"ON {table} ({', '.join(group)})")
+            connection.execute("CREATE TABLE IF NOT EXISTS documents (name TEXT PRIMARY KEY, body TEXT NOT NULL)")
+            # Bumped in the same transaction as every write, tells every process when to reload
+            connection.execute("CREATE TABLE IF NOT EXISTS revisions (name TEXT PRIMARY KEY, revision INTEGER NOT NULL)")
+
+    def _bump(self, connection, filename):
+        connection.execute("INSERT INTO revisions (name, revision) VALUES (?, 1) "
+                           "ON CONFLICT (name) DO UPDATE SET revision = revision + 1", (filename,))
+
+    def _revision(self, connection, filename):
+        row = connection.execute("SELECT revision FROM revisions WHERE name = ?", (filename,)).fetchone()
+        return row[0] if row else 0
+
+    def _entry(self, filename):
+        connection = self._connection()
+        parent = _partition_parent(filename)
+        # A partition changes with its collection
+        versioned = parent[0] if parent is not None else filename
+        revision = self._revision(connection, versioned)
+        with self._lock:
+            cached = self._cache.get(filename)
+            if cached is not None and cached[0] == revision:
+                return cached
+
+        with _transaction(connection, write=False):
+            # Read the revision again inside the snapshot the rows come from
+            revision = self._revision(connection, versioned)
+            if parent is not None:
+                bodies = self._partition_bodies(connection, *parent)
+                data = [json.loads(body) for body in bodies]
+                raw = '\n'.join(bodies).encode('utf-8')
+            elif filename in TABLES:
+                table, _ = TABLES[filename]
+                bodies = [row[0] for row in connection.execute(f"SELECT body FROM {table} ORDER BY id")]
+                data = [json.loads(body) for body in bodies]
+                raw = '\n'.join(bodies).encode('utf-8')
+            else:
+                row = connection.execute("SELECT body FROM documents WHERE name = ?", (filename,)).fetchone()
+                if row is None:
+                    raise FileNotFoundError(f"{filename} non presente in {self.path}")
+                data = json.loads(row[0])
+                raw = row[0].encode('utf-8')
+
+        entry = (revision, data, _digest(raw))
+        with self._lock:
+            self._cache[filename] = entry
+        self._on_change()
+        return entry
+
+    def _partition_bodies(self, connection, filename, month):
+        '''Bodies of the records of one month, through the index of the date field.'''
+        table, _ = TABLES[filename]
+        column = PARTITIONED[filename]
+        if month != UNDATED:
+            # '-' < '.': the dates of the month and nothing else
+            return [row[0] for row in connection.execute(
+                f"SELECT body FROM {table} WHERE {column} >= ? AND {column} < ? ORDER BY id",
+                (f"{month}-", f"{month}."))]
+        return [row[0] for row in connection.execute(f"SELECT {column}, body FROM {table} ORDER BY id")
+                if month_of(row[0]) == UNDATED]
+
+    def load(self, filename):
+        return self._entry(filename)[1]
+
+    def digest(self, filename):
+        return self._entry(filename)[2]
+
+    def partitions(self, filename):
+        '''Months ('YYYY-MM') with records of a PARTITIONED collection, oldest first.'''
+        table, _ = TABLES[filename]
+        column = PARTITIONED[filename]
+        rows = self._connection().execute(f"SELECT DISTINCT substr({column}, 1, 7) FROM {table}")
+        return sorted({month_of(row[0]) for row in rows})
+
+    def revision(self, filename):
+        '''Token that changes with every write to a collection (or to the collection of a partition).'''
+        parent = _partition_parent(filename)
+        return str(self._revision(self._connection(), parent[0] if parent is not None else filename))
+
+    def modified(self, filename):
+        '''POSIX time of the last write to the database, whatever collection it touched.'''
+        times = [0]
+        for name in (self.path, self.path + '-wal'):
+            try:
+                times.append(os.stat(name).st_mtime)
+            except FileNotFoundError:
+                pass
+        return max(times)
+
+    def query(self, filename, where=None, between=None, order='id', descending=False, after=None, limit=50):
+        '''One page of a record collection, see JsonStorage.query(): a WHERE on the indexed columns.'''
+        _check_query(filename, where, between, order, after)
+        table, _ = TABLES[filename]
+        conditions, values = [f"{order} IS NOT NULL"], []
+        for column, value in (where or {}).items():
+            conditions.append(f"{column} = ?")
+            values.append(value)
+        if between is not None:
+            column, low, high = between
+            if low is not None:
+                conditions.append(f"{column} >= ?")
+                values.append(low)
+            if high is not None:
+                conditions.append(f"{column} <= ?")
+                values.append(high)
+        if after is not None:
+            conditions.append(f"({order}, id) {'<' if descending else '>'} (?, ?)")
+            values.extend(after)
+        direction = 'DESC' if descending else 'ASC'
+        rows = self._connection().execute(
+            f"SELECT body FROM {table} WHERE {' AND '.join(conditions)} "
+            f"ORDER BY {order} {direction}, id {direction} LIMIT ?", values + [limit + 1])
+        return _page([json.loads(row[0]) for row in rows], limit, order)
+
+    @contextlib.contextmanager
+    def locked(self):
+        '''
+        Run several operations in one write transaction, for a
+        read-modify-write: all of them are committed, or none.
+        '''
+        connection = self._connection()
+        if connection.in_transaction:
+            yield
+            return
+        try:
+            with _transaction(connection):
+                yield
+        except BaseException:
+            # What was cached inside the transaction may have been rolled back
+            with self._lock:
+                self._cache.clear()
+            raise
+
+    def _row(self, filename, record):
+        '''(column names, values) of the table row of a record, body included.'''
+        _, columns = TABLES[filename]
+        names = ('id',) + columns + ('body',)
+        values = [record.get('id')] + [record.get(column) for column in columns]
+        values.append(json.dumps(record, ensure_ascii=False))
+        return names, values
+
+    def save(self, filename, data):
+        connection = self._connection()
+        with _transaction(connection):
+            if filename in TABLES:
+                table, _ = TABLES[filename]
+                connection.execute(f"DELETE FROM {table}")
+                for record in data:
+                    if record.get('id') is None:
+                        self._insert(connection, filename, record)
+                    else:
+                        names, values = self._row(filename, record)
+                        connection.execute(f"INSERT INTO {table} ({', '.join(names)}) "
+                                           f"VALUES ({', '.join('?' * len(names))})", values)
+            else:
+                connection.execute("INSERT OR REPLACE INTO documents (name, body) VALUES (?, ?)",
+                                   (filename, json.dumps(data, ensure_ascii=False)))
+            self._bump(connection, filename)
+        self._on_change()
+
+    def _insert(self, connection, filename, record):
+        table, _ = TABLES[filename]
+        names, values = self._row(filename, dict(record, id=None))
+        cursor = connection.execute(f"INSERT INTO {table} ({', '.join(names[1:])}) "
+                                    f"VALUES ({', '.join('?' * (len(names) - 1))})", values[1:])
+        record = dict(record, id=cursor.lastrowid)
+        connection.execute(f"UPDATE {table} SET body = ? WHERE id = ?",
+                           (json.dumps(record, ensure_ascii=False), record['id']))
+        return record
+
+    def insert(self, filename, record):
+        connection = self._connection()
+        with _transaction(connection):
+            record = self._insert(connection, filename, record)
+            self._bump(connection, filename)
+        self._on_change()
+        return record
+
+    def insert_many(self, filename, records):
+        '''Add records in one transaction; returns them with their new ids.'''
+        if not records:
+            return []
+        connection = self._connection()
+        with _transaction(connection):
+            records = [self._insert(connection, filename, record) for record in records]
+            self._bump(connection, filename)
+        self._on_change()
+        return records
+
+    def update(self, filename, record_id, changes):
+        table, _ = TABLES[filename]
+        connection = self._connection()
+        with _transaction(connection):
+            row = connection.execute(f"SELECT body FROM {table} WHERE id = ?", (record_id,)).fetchone()
+            if row is None:
+                return False
+            record = dict(json.loads(row[0]), **changes)
+            record['id'] = record_id
+            names, values = self._row(filename, record)
+            assignments = ', '.join(f"{name} = ?" for name in names[1:])
+            connection.execute(f"UPDATE {table} SET {assignments} WHERE id = ?", values[1:] + [record_id])
+            self._bump(connection, filename)
+        self._on_change()
+        return True
+
+    def delete(self, filename, record_id):
+        table, _ = TABLES[filename]
+        connection = self._connection()
+        with _transaction(connection):
+            deleted = connection.execute(f"DELETE FROM {table} WHERE id = ?", (record_id,)).rowcount
+            if deleted:
+                self._bump(connection, filename)
+        if deleted:
+            self._on_change()
+        return bool(deleted)
+
+
+class _transaction:
+    '''
+    BEGIN ... COMMIT, or ROLLBACK on error, on an autocommit connection.
+    Writers take the write lock upfront so they never deadlock on upgrading.
+    Inside SQLiteStorage.locked() the operations join its transaction.
+    '''
+
+    def __init__(self, connection, write=True):
+        self.connection = connection
+        self.write = write
+        self.nested = False
+
+    def __enter__(self):
+        self.nested = self.connection.in_transaction
+        if not self.nested:
+            self.connection.execute("BEGIN IMMEDIATE" if self.write else "BEGIN")
+        return self.connection
+
+    def __exit__(self, exc_type, exc, tb):
+        if not self.nested:
+            self.connection.execute("COMMIT" if exc_type is None else "ROLLBACK")
+        return False
+
+
+def migrate_json_to_sqlite(data_dir, database=None, force=False):
+    '''
+    Copy every data/*.json collection into a new SQLite database.
+
+    Records keep their ids; a record whose id is already taken gets a new
+    one after the highest. Returns {filename: (records copied, ids
+    changed)}. Refuses to overwrite an existing database unless force.
+    '''
+    database = database or os.path.join(data_dir, DATABASE_FILENAME)
+    if os.path.exists(database):
+        if not force:
+            raise FileExistsError(f"Il database {database} esiste già")
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(database + suffix):
+                os.remove(database + suffix)
+
+    source = JsonStorage(data_dir)
+    target = SQLiteStorage(database)
+    report = {}
+    for filename in list(TABLES) + list(DOCUMENTS):
+        try:
+            data = source.load(filename)
+        except FileNotFoundError:
+            continue
+        if filename not in TABLES:
+            target.save(filename, data)
+            report[filename] = (1, 0)
+            continue
+
+        # Keep the first record of every id, renumber the later duplicates
+        seen = set()
+        last_id = max([record['id'] for record in data if isinstance(record.get('id'), int)], default=0)
+        records = []
+        changed = 0
+        for record in data:
+            if not isinstance(record.get('id'), int) or record['id'] in seen:
+                last_id += 1
+                record = dict(record, id=last_id)
+                changed += 1
+            seen.add(record['id'])
+            records.append(record)
+        target.save(filename, records)
+        report[filename] = (len(records), changed)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Storage of the dataset")
+    parser.add_argument('command', choices=['migrate', 'compact'],
+                        help="migrate: copy data/*.json into the SQLite database; "
+                             "compact: fold the journals into data/*.json, compress the old partitions")
+    parser.add_argument('--data-dir', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data'),
+                        help="directory with the JSON data files (default: data/)")
+    parser.add_argument('--database', default=None, help=f"database file (default: <data-dir>/{DATABASE_FILENAME})")
+    parser.add_argument('--force', action='store_true', help="overwrite an existing database")
+    args = parser.parse_args()
+
+    if args.command == 'compact':
+        storage = JsonStorage(args.data_dir)
+        for filename in TABLES:
+            storage.compact(filename)
+        print(f"Journal compattati e partizioni vecchie compresse in {args.data_dir}")
+        return
+
+    try:
+        report = migrate_json_to_sqlite(args.data_dir, args.database, force=args.force)
+    except FileExistsError as e:
+        parser.exit(1, f"{e}: usa --force per ricrearlo\n")
+    for filename, (count, changed) in report.items():
+        note = f", {changed} id duplicati rinumerati" if changed else ""
+        print(f"{filename}: {count} elementi{note}")
+    print(f"Migrazione completata: {args.database or os.path.join(args.data_dir, DATABASE_FILENAME)}")
+
+
+if __name__ == '__main__':
+    main()
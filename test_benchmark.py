@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+"""
+Scaling benchmark suite: report layout, exponents and comparison
+"""
+
+from benchmark import PHASES, build_dataset, compare_reports, run_suite, scaling_exponents
+
+
+def test_full_year_turnazioni_and_years_of_assenze():
+    one_year = build_dataset(100, 10, seed=1)
+    data = build_dataset(100, 10, seed=1, history_years=3, full_year_turnazioni=True)
+
+    assert len(data['turnazioni']) == 12 * len(one_year['turnazioni'])
+    assert len({t['mese'] for t in data['turnazioni']}) == 12
+    assert len(data['assenze']) > 2 * len(one_year['assenze'])
+
+
+def test_suite_report_times_every_phase():
+    report = run_suite([(10, 5), (40, 8)], history_years=1, repeat=1)
+
+    assert [(r['collaboratori'], r['luoghi']) for r in report['results']] == [(10, 5), (40, 8)]
+    assert all(set(r['seconds']) == set(PHASES) for r in report['results'])
+    assert set(report['scaling']) == set(PHASES)
+
+
+def test_exponents_and_regressions():
+    def result(size, seconds):
+        return {'collaboratori': size, 'luoghi': 5, 'seconds': dict.fromkeys(PHASES, seconds)}
+
+    old = {'results': [result(1000, 0.01), result(2000, 0.02)]}
+    new = {'results': [result(1000, 0.01), result(2000, 0.08)]}
+
+    assert scaling_exponents(old['results'])['render'] == 1.0
+    assert scaling_exponents(new['results'])['render'] == 3.0
+    flagged = {(size, phase) for size, _, phase, _, _, _, regression in compare_reports(old, new) if regression}
+    assert flagged == {(2000, phase) for phase in PHASES}
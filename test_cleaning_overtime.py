@@ -1,104 +1,68 @@
 #!/usr/bin/env python3
 """
-Simple test script to verify cleaning overtime logic
+Cleaning overtime, and the coverage of the luoghi substitutes leave
 """
 
-from generator import Generator
-from datetime import datetime
+import contextlib
+import io
 import json
 
-def test_cleaning_overtime():
-    """Test the cleaning overtime assignment for today (2026-01-13)"""
-
-    # Today is Monday, 2026-01-13
-    # Collaboratore ID 2 (Elia Egizio) is absent - they normally work at Bandini 2 (luogo_id=2)
-    # So someone should be assigned 20 minutes of cleaning overtime for Bandini 2
-
-    print("=" * 60)
-    print("TESTING CLEANING OVERTIME LOGIC")
-    print("=" * 60)
-    print()
-
-    generator = Generator()
-
-    day = 13
-    month = 1
-    year = 2026
-    weekday = 'lunedi'
-
-    print(f"Generating schedule for {weekday}, {day}/{month}/{year}")
-    print()
-
-    # Generate the schedule
-    result = generator.generate(day, month, year, weekday)
-
-    print("=" * 60)
-    print("SCHEDULE OUTPUT:")
-    print("=" * 60)
-    print(result)
-    print()
-
-    # Read the final schedule to check cleaning overtime
-    with open("final_schedule_after_substitutions.json", "r") as f:
-        schedule = json.load(f)
-
-    print("=" * 60)
-    print("CLEANING OVERTIME ASSIGNMENTS:")
-    print("=" * 60)
-
-    if 'cleaning_overtime' in schedule and schedule['cleaning_overtime']:
-        for cleaning in schedule['cleaning_overtime']:
-            collab = generator._get_collaboratore_by_id(cleaning['collaboratore_id'])
-            print(f"✓ {collab['cognome']} {collab['nome']}:")
-            print(f"  - Location: {cleaning['location_name']}")
-            print(f"  - Overtime: {cleaning['overtime_minutes']} minutes")
-            print(f"  - New total straordinari: {collab['straordinari_svolti']} minutes")
-            print()
-    else:
-        print("No cleaning overtime assignments found")
-        print()
-
-    print("=" * 60)
-    print("LOCATION STAFFING:")
-    print("=" * 60)
-
-    # Check each location's normal vs actual staffing
-    locations_normal = {}
-    for collab in generator.collaboratori:
-        luogo_id = collab.get('luogo_id')
-        if luogo_id:
-            if luogo_id not in locations_normal:
-                locations_normal[luogo_id] = []
-            locations_normal[luogo_id].append(collab)
-
-    for luogo_id, collabs in locations_normal.items():
-        luogo = generator._get_luogo_by_id(luogo_id)
-        print(f"\n{luogo['nome']} (ID: {luogo_id}):")
-        print(f"  Normal staff count: {len(collabs)}")
-        print(f"  No cleaning needed: {luogo.get('no_cleaning_needed', False)}")
-
-        # Count present at location (use string key)
-        present_count = 0
-        luogo_key = str(luogo_id)
-        if luogo_key in schedule:
-            for assignment in schedule[luogo_key]:
-                collab_id = assignment['collaboratore_id']
-                collab = generator._get_collaboratore_by_id(collab_id)
-                if collab and collab.get('luogo_id') == luogo_id:
-                    present_count += 1
-
-        print(f"  Present at end of day: {present_count}")
-        print(f"  Missing: {len(collabs) - present_count}")
-
-        if len(collabs) - present_count > 0 and not luogo.get('no_cleaning_needed', False):
-            print(f"  → Cleaning overtime needed: ✓")
-        else:
-            print(f"  → Cleaning overtime needed: ✗")
-
-    print()
-    print("=" * 60)
-    print("TEST COMPLETE")
-    print("=" * 60)
-
-if __name__ == '__main__':
-    test_cleaning_overtime()
+import dataset
+from generator import MORNING_COVERAGE_LIMIT, Generator
+
+
+def _write(tmp_path, name, data):
+    (tmp_path / name).write_text(json.dumps(data), encoding='utf-8')
+
+
+def test_substitutes_leave_their_luogo_short_and_it_gets_cleaned(tmp_path, monkeypatch):
+    """Luogo 1 can give one of its two people: the second deficit stays open and is cleaned for"""
+    monkeypatch.chdir(tmp_path)
+    orario = {'inizio': '07:54', 'fine': '14:57'}
+    _write(tmp_path, 'luoghi.json', [
+        {'id': luogo_id, 'nome': f"Luogo {luogo_id}", 'descrizione': '', 'min_collaboratori': 1,
+         'no_cleaning_needed': False}
+        for luogo_id in (1, 2, 3)
+    ])
+    _write(tmp_path, 'collaboratori.json', [
+        {'id': collab_id, 'nome': f"Nome{collab_id}", 'cognome': f"Cognome{collab_id}", 'luogo_id': luogo_id,
+         'fisso_nel_luogo': False, 'orari_settimanali': {'martedi': orario},
+         'ultima_sostituzione': None, 'straordinari_svolti': collab_id, 'no_overtime_allowed': False}
+        for collab_id, luogo_id in ((1, 1), (2, 1), (3, 2), (4, 3))
+    ])
+    for name in ('turnazioni.json', 'coperture_fisse.json', 'sub_order.json'):
+        _write(tmp_path, name, [])
+    _write(tmp_path, 'orari_pomeriggio.json', {})
+    for collab_id in (3, 4):
+        dataset.insert('assenze.json', {'collaboratore_id': collab_id, 'data': "2026-01-13", 'tutto_giorno': True,
+                                        'ora_inizio': None, 'ora_fine': None}, str(tmp_path))
+
+    generator = Generator(data_dir=str(tmp_path))
+    with contextlib.redirect_stdout(io.StringIO()):
+        schedule = generator.generate_schedule(13, 1, 2026, 'martedi')
+        generator.assign_cleaning_overtime(schedule, 'martedi')
+
+    # Only one person moves: luogo 1 keeps its minimum, luogo 2 or 3 stays short
+    moved = [a.collaboratore_id for _, assignments in schedule.items() for a in assignments if a.is_substitute]
+    assert len(moved) == 1
+    counts = generator._occupancy(schedule).counts_at(MORNING_COVERAGE_LIMIT)
+    assert counts[1] == 1
+    assert sorted(counts[luogo_id] for luogo_id in (2, 3)) == [0, 1]
+    assert sum(generator.missing_by_luogo(schedule).values()) == 1
+
+    # One cleaning for the person luogo 1 gave, one for the luogo left empty
+    empty = 2 if counts[2] == 0 else 3
+    assert sorted(cleaning.location_id for cleaning in schedule.cleaning_overtime) == sorted([1, empty])
+
+
+def test_afternoon_substitutes_are_not_back_home_at_the_end_of_the_day():
+    """Repo data, as before the occupancy matrix: on Fridays the afternoon substitutes leave Ingresso and Laboratori to clean"""
+    generator = Generator(seed=1)
+    for day in (9, 16):
+        with contextlib.redirect_stdout(io.StringIO()):
+            schedule = generator.generate(day, 1, 2026, 'venerdi').schedule
+        assert schedule.afternoon_subs
+        occupancy = generator._occupancy(schedule)
+        for assignment in schedule.afternoon_subs:
+            assert assignment.collaboratore_id not in occupancy.who_is_at(assignment.original_luogo_id, assignment.end - 1)
+        assert sorted(cleaning.location_name for cleaning in schedule.cleaning_overtime) == ['Ingresso', 'Laboratori']
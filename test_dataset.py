@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+"""
+Read-through cache of the data files
+"""
+
+import json
+import os
+
+import dataset
+
+
+def test_load_is_cached_until_the_file_changes(tmp_path):
+    path = tmp_path / "luoghi.json"
+    path.write_text(json.dumps([{'id': 1}]), encoding='utf-8')
+
+    first = dataset.load('luoghi.json', str(tmp_path))
+    assert dataset.load('luoghi.json', str(tmp_path)) is first
+
+    # Another process rewrites the file
+    path.write_text(json.dumps([{'id': 1}, {'id': 2}]), encoding='utf-8')
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+
+    assert dataset.load('luoghi.json', str(tmp_path)) == [{'id': 1}, {'id': 2}]
+
+
+def test_save_updates_the_cache_and_the_version(tmp_path):
+    version = dataset.version()
+    data = [{'id': 3}]
+    dataset.save('turnazioni.json', data, str(tmp_path))
+
+    assert dataset.version() != version
+    assert dataset.load('turnazioni.json', str(tmp_path)) is data
+    assert json.loads((tmp_path / "turnazioni.json").read_text(encoding='utf-8')) == data
@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+"""
+generate() returns its result in memory; debug dumps only go to a sink
+"""
+
+import contextlib
+import io
+import json
+import os
+
+from benchmark import build_dataset, write_dataset
+from debug_sink import DirectoryDebugSink
+from generator import Generator
+
+
+def test_generate_writes_nothing_unless_given_a_sink(tmp_path, monkeypatch):
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    write_dataset(build_dataset(40, 15, absence_rate=0.2, seed=2), str(data_dir))
+    monkeypatch.chdir(tmp_path)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = Generator(data_dir=str(data_dir), seed=1).generate(13, 1, 2026, 'martedi')
+    assert os.listdir(tmp_path) == ["data"]
+    assert result.schedule.cleaning_overtime is not None
+    assert result.to_dict()['substitutions_text'] == result.substitutions_text
+
+    sink = DirectoryDebugSink(str(tmp_path))
+    with contextlib.redirect_stdout(io.StringIO()):
+        Generator(data_dir=str(data_dir), debug_sink=sink, seed=1).generate(13, 1, 2026, 'martedi')
+    sink.close()
+
+    assert sorted(os.listdir(tmp_path)) == [
+        "data", "debug_output.json", "final_schedule.json",
+        "final_schedule_after_substitutions.json", "parsed_schedule.json"
+    ]
+    parsed = json.loads((tmp_path / "parsed_schedule.json").read_text())
+    assert parsed == {"substitutions_text": result.substitutions_text}
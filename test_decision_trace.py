@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+"""
+Decision trace: leveled ring buffer filled by the engine
+"""
+
+from benchmark import build_dataset, write_dataset
+from decision_trace import DEBUG, INFO, WARNING, DecisionTrace
+from generator import Generator
+
+
+def test_ring_buffer_keeps_the_latest_events_at_or_above_its_level():
+    trace = DecisionTrace(level=INFO, capacity=3)
+    trace.record(DEBUG, 'ignored')
+    for n in range(5):
+        trace.record(INFO, 'step', n=n)
+    trace.record(WARNING, 'last')
+
+    assert [(e['event'], e['fields']) for e in trace.events()] == [
+        ('step', {'n': 3}), ('step', {'n': 4}), ('last', {})
+    ]
+    assert trace.recorded == 6 and trace.dropped == 3
+    assert trace.lines()[-1].split()[1:] == ['WARNING', 'last']
+
+
+def test_trace_explains_the_generation_without_changing_it(tmp_path):
+    write_dataset(build_dataset(60, 25, absence_rate=0.2, seed=4), str(tmp_path))
+
+    plain = Generator(data_dir=str(tmp_path), seed=9).generate(13, 1, 2026, 'martedi')
+    trace = DecisionTrace(level=DEBUG)
+    traced = Generator(data_dir=str(tmp_path), seed=9, trace=trace).generate(13, 1, 2026, 'martedi')
+
+    assert traced.schedule.to_dict() == plain.schedule.to_dict()
+    events = trace.events()
+    picked = [e['fields'] for e in events if e['event'] == 'substitute_picked']
+    assert {f['collaboratore_id'] for f in picked} == plain.schedule.substitute_ids()
+    assert all(f['reason'] in ('luogo_secondario', 'never_substituted', 'oldest_ultima_sostituzione')
+               for f in picked)
+    assert any(e['event'] == 'absent' for e in events)
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""
+Date-range generation on a synthetic dataset
+"""
+
+import copy
+from datetime import date
+
+from benchmark import build_dataset, write_dataset
+from generator import Generator
+
+
+def test_generate_range_carries_substitutions_forward(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    dataset = build_dataset(60, 25, date(2026, 1, 12), absence_rate=0.15, seed=1)
+    write_dataset(dataset, str(tmp_path))
+    generator = Generator(data_dir=str(tmp_path))
+    loaded = copy.deepcopy(generator.collaboratori)
+
+    records = list(generator.generate_range(date(2026, 1, 12), date(2026, 1, 18)))
+
+    # Monday to Friday only: nobody works on the weekend
+    assert [record['data'] for record in records] == [
+        "2026-01-12", "2026-01-13", "2026-01-14", "2026-01-15", "2026-01-16"
+    ]
+    # The loaded records are left untouched and no scratch file is written
+    assert generator.collaboratori == loaded
+    assert not (tmp_path / "final_schedule.json").exists()
+
+    # A substitute of the first day is only picked again if nobody older is left
+    first_day = records[0]['schedule']
+    substitutes = {
+        assignment['collaboratore_id']
+        for key, assignments in first_day.items() if key != 'cleaning_overtime'
+        for assignment in assignments if assignment.get('is_substitute')
+    }
+    assert substitutes
+    second_day = records[1]['schedule']
+    picked_again = {
+        assignment['collaboratore_id']
+        for key, assignments in second_day.items() if key != 'cleaning_overtime'
+        for assignment in assignments if assignment.get('is_substitute')
+    } & substitutes
+    assert not picked_again
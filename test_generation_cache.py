@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Seeded generation and the LRU of generation results
+"""
+
+import contextlib
+import io
+from datetime import date
+
+import dataset
+from benchmark import build_dataset, write_dataset
+from generation_cache import GenerationCache, cache_key
+from generator import Generator, data_version
+
+
+def test_lru_evicts_the_least_recently_used():
+    cache = GenerationCache(max_entries=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+
+    assert cache.get('b') is None
+    assert cache.get('a') == 1 and cache.get('c') == 3
+    assert len(cache) == 2
+    assert cache.get_or_compute('c', lambda: 4) == 3
+
+
+def test_same_seed_and_data_give_the_same_schedule(tmp_path, monkeypatch):
+    """The key follows the content of the data, and a seed makes the tie-breaks repeatable"""
+    monkeypatch.chdir(tmp_path)
+    write_dataset(build_dataset(80, 30, date(2026, 1, 12), absence_rate=0.2, seed=5), str(tmp_path))
+
+    def generate(seed):
+        generator = Generator(data_dir=str(tmp_path), seed=seed)
+        with contextlib.redirect_stdout(io.StringIO()):
+            return generator.generate_schedule(13, 1, 2026, 'martedi').to_dict()
+
+    assert generate(7) == generate(7)
+
+    version = data_version(str(tmp_path))
+    assert cache_key("2026-01-13", 7, version) == cache_key("2026-01-13", 7, data_version(str(tmp_path)))
+    assert cache_key("2026-01-13", 7, version) != cache_key("2026-01-13", 8, version)
+
+    collaboratori = dataset.load('collaboratori.json', str(tmp_path))
+    dataset.save('collaboratori.json', collaboratori[:-1], str(tmp_path))
+    assert data_version(str(tmp_path)) != version
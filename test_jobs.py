@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Background job queue: progress, cancellation, the cap and restarts
+"""
+
+import sqlite3
+import threading
+import time
+
+from jobs import CANCELLED, DONE, QUEUED, RUNNING, JobQueue
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timeout"
+        time.sleep(0.01)
+
+
+def test_progress_result_and_cancellation(tmp_path):
+    release = threading.Event()
+
+    def count(params, report):
+        for done in range(1, params['n'] + 1):
+            report(done, params['n'])
+        return {'contati': params['n']}
+
+    def forever(params, report):
+        while True:
+            report(0)
+            release.wait(0.01)
+
+    path = str(tmp_path / "jobs.sqlite3")
+    queue = JobQueue(path, {'conta': count, 'infinito': forever}, max_running=1, poll_seconds=0.01)
+    finished = queue.submit('conta', {'n': 3})
+    endless = queue.submit('infinito', {})
+    waiting = queue.submit('conta', {'n': 1})
+    queue.start()
+    try:
+        wait_for(lambda: queue.get(endless)['status'] == RUNNING)
+        # One job at a time: the last one waits behind the endless one
+        assert queue.get(waiting)['status'] == QUEUED
+        assert queue.cancel(waiting) and queue.get(waiting)['status'] == CANCELLED
+        assert queue.cancel(endless)
+        wait_for(lambda: queue.get(endless)['status'] == CANCELLED)
+    finally:
+        queue.stop()
+
+    # Another process sharing the file sees the same jobs
+    job = JobQueue(path, {}).get(finished)
+    assert (job['status'], job['fatti'], job['totale'], job['risultato']) == (DONE, 3, 3, {'contati': 3})
+    assert not queue.cancel(finished)
+
+
+def test_jobs_whose_lease_ran_out_start_over(tmp_path):
+    path = str(tmp_path / "jobs.sqlite3")
+    queue = JobQueue(path, {'eco': lambda params, report: params}, poll_seconds=0.01, lease_seconds=5)
+    stale = queue.submit('eco', {'x': 1})
+    leased = queue.submit('eco', {'x': 2})
+
+    # Left running by a process that is gone, and by one still renewing its lease
+    with sqlite3.connect(path) as connection:
+        connection.execute("UPDATE jobs SET status = ?, owner = ?, updated = ? WHERE id = ?",
+                           (RUNNING, 'gone', time.time() - 60, stale))
+        connection.execute("UPDATE jobs SET status = ?, owner = ?, updated = ? WHERE id = ?",
+                           (RUNNING, 'alive', time.time(), leased))
+
+    queue.start()
+    try:
+        wait_for(lambda: queue.get(stale)['status'] == DONE)
+    finally:
+        queue.stop()
+    assert queue.get(stale)['risultato'] == {'x': 1}
+    assert queue.get(leased)['status'] == RUNNING
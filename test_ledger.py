@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Substitution ledger: window loads, undo and the fairness ranking
+"""
+
+from datetime import date
+
+import dataset
+from benchmark import build_dataset, write_dataset
+from generator import Generator, apply_official_schedule
+from ledger import LEDGER_FILENAME, Ledger, entries_for, shared_ledger, term_window, undo_changes
+from schedule import Assignment, CleaningOvertime, Schedule
+
+
+def test_window_loads_from_prefix_sums():
+    ledger = Ledger()
+    ledger.add(date(2026, 1, 20), 7, substitutions=1)
+    ledger.add(date(2025, 12, 1), 7, substitutions=1, minutes=20)
+    ledger.add(date(2026, 1, 20), 7, minutes=20)
+    ledger.add(date(2026, 1, 5), 7, substitutions=1)
+
+    assert ledger.load(7, date(2026, 1, 1), date(2026, 1, 31)) == (2, 20)
+    assert ledger.load(7, date(2025, 12, 1), date(2026, 1, 5)) == (2, 20)
+    assert ledger.load(8, date(2025, 1, 1), date(2026, 12, 31)) == (0, 0)
+    assert term_window(date(2026, 1, 20)) == (date(2025, 9, 1), date(2026, 1, 20))
+    assert term_window(date(2026, 3, 2)) == (date(2026, 2, 1), date(2026, 3, 2))
+
+
+def test_shared_ledger_is_indexed_once_per_content(tmp_path):
+    """Same list, same Ledger; appended entries extend a copy; a deletion rebuilds it"""
+    data_dir = str(tmp_path)
+    entry = lambda day, collab_id: {'ufficializzazione': 'a1', 'data': day, 'collaboratore_id': collab_id,
+                                    'tipo': 'sostituzione', 'luogo_id': 1, 'minuti': 0, 'precedente': None}
+    dataset.insert_many(LEDGER_FILENAME, [entry("2026-01-12", 1), entry("2026-01-13", 2)], data_dir)
+    first = shared_ledger(dataset.load(LEDGER_FILENAME, data_dir), data_dir)
+    assert shared_ledger(dataset.load(LEDGER_FILENAME, data_dir), data_dir) is first
+
+    dataset.insert(LEDGER_FILENAME, entry("2026-01-14", 1), data_dir)
+    extended = shared_ledger(dataset.load(LEDGER_FILENAME, data_dir), data_dir)
+    assert extended is not first and first.load(1, date(2026, 1, 1), date(2026, 1, 31)) == (1, 0)
+    assert extended.load(1, date(2026, 1, 1), date(2026, 1, 31)) == (2, 0)
+
+    dataset.delete(LEDGER_FILENAME, 1, data_dir)
+    rebuilt = shared_ledger(dataset.load(LEDGER_FILENAME, data_dir), data_dir)
+    assert rebuilt.loads(date(2026, 1, 1), date(2026, 1, 31)) == {1: (1, 0), 2: (1, 0)}
+
+
+def test_undo_restores_the_records():
+    collaboratori = {
+        1: {'id': 1, 'ultima_sostituzione': "2026-01-02", 'straordinari_svolti': 40},
+        2: {'id': 2, 'ultima_sostituzione': None, 'straordinari_svolti': 0},
+    }
+    before = {collab_id: dict(record) for collab_id, record in collaboratori.items()}
+    schedule = Schedule()
+    schedule.add(3, Assignment(1, 480, 840, is_substitute=True))
+    schedule.add_cleaning_overtime(CleaningOvertime(2, 3, "Bar", 20))
+    schedule.add_cleaning_overtime(CleaningOvertime(2, 4, "Aula", 20))
+
+    entries = entries_for(schedule, "2026-01-13", collaboratori, 'a1')
+    apply_official_schedule(collaboratori, schedule, "2026-01-13")
+    assert [entry['precedente'] for entry in entries] == ["2026-01-02", 0, 20]
+
+    for collab_id, changes in undo_changes(entries, [], collaboratori).items():
+        collaboratori[collab_id].update(changes)
+    assert collaboratori == before
+
+
+def test_fairness_window_skips_who_substituted_recently(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write_dataset(build_dataset(60, 20, date(2026, 1, 13), absence_rate=0.2, seed=3), str(tmp_path))
+
+    def substitutes(**options):
+        schedule = Generator(data_dir=str(tmp_path), seed=1, **options).generate(13, 1, 2026, 'martedi').schedule
+        return schedule.substitute_ids()
+
+    picked = substitutes()
+
+    def substituted(*days):
+        for collab_id in picked:
+            for day in days:
+                dataset.insert(LEDGER_FILENAME, {'ufficializzazione': day, 'data': day, 'collaboratore_id': collab_id,
+                                                 'tipo': 'sostituzione', 'luogo_id': None, 'minuti': 0,
+                                                 'precedente': None}, str(tmp_path))
+
+    # Substitutions older than the window do not count
+    substituted("2025-11-10")
+    assert substitutes(fairness='30d') == picked
+    assert len(substitutes(fairness='term') & picked) < len(picked)
+
+    # Everybody picked today substituted twice this month
+    substituted("2026-01-07", "2026-01-09")
+    assert substitutes() == picked
+    assert len(substitutes(fairness='30d') & picked) < len(picked)
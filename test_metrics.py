@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""
+Prometheus text exposition of the engine and route metrics
+"""
+
+import metrics
+from app import app
+from benchmark import build_dataset, write_dataset
+from generator import Generator
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = metrics.Histogram('test_latency_seconds', "Test latency", ('route',), buckets=(0.1, 1))
+    for value in (0.05, 0.5, 5):
+        histogram.observe(value, route='/x')
+
+    lines = histogram.render()
+    assert lines[:2] == ["# HELP test_latency_seconds Test latency", "# TYPE test_latency_seconds histogram"]
+    assert lines[2:5] == [
+        'test_latency_seconds_bucket{route="/x",le="0.1"} 1',
+        'test_latency_seconds_bucket{route="/x",le="1"} 2',
+        'test_latency_seconds_bucket{route="/x",le="+Inf"} 3',
+    ]
+    assert lines[-1] == 'test_latency_seconds_count{route="/x"} 3'
+
+
+def test_generation_and_routes_show_up_at_metrics(tmp_path):
+    write_dataset(build_dataset(60, 25, absence_rate=0.2, seed=4), str(tmp_path))
+    generations = metrics.GENERATIONS.value(solver='greedy')
+    populate_calls = metrics.PHASE_SECONDS.count(phase='populate_absences')
+
+    result = Generator(data_dir=str(tmp_path), seed=1).generate(13, 1, 2026, 'martedi')
+
+    assert metrics.GENERATIONS.value(solver='greedy') == generations + 1
+    assert metrics.PHASE_SECONDS.count(phase='populate_absences') == populate_calls + 1
+    assert metrics.SUBSTITUTES.value(kind='morning') >= len(result.schedule.substitute_ids()) > 0
+
+    client = app.test_client()
+    client.get('/')
+    response = client.get('/metrics')
+    text = response.get_data(as_text=True)
+    assert response.mimetype == 'text/plain'
+    assert 'http_request_duration_seconds_count{route="/",method="GET",status="200"}' in text
+    assert 'generator_phase_seconds_count{phase="substitution"}' in text
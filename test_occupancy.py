@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Occupancy matrix queries on a hand-built schedule
+"""
+
+from generator import MORNING_COVERAGE_LIMIT, LuogoCoverage
+from occupancy import Occupancy
+from schedule import Assignment, Schedule, parse_time
+
+
+def build_occupancy():
+    # Collaboratore 1 and 2 work at luogo 1, 3 at luogo 2, 4 at luogo 3, 5 is absent from luogo 3
+    home = {1: 1, 2: 1, 3: 2, 4: 3, 5: 3}
+    schedule = Schedule()
+    schedule.add(1, Assignment(1, parse_time("07:30"), parse_time("14:30")))
+    schedule.add(1, Assignment(2, parse_time("07:30"), parse_time("14:30")))
+    schedule.add(2, Assignment(3, parse_time("10:00"), parse_time("17:00")))
+    schedule.add(3, Assignment(4, parse_time("07:30"), parse_time("14:30")))
+    # 2 covers luogo 2 in the morning and goes back to luogo 1 at 10:00
+    schedule.add(2, Assignment(2, parse_time("07:30"), parse_time("14:30"), partial_end=parse_time("10:00"),
+                               is_substitute=True, original_luogo_id=1))
+    # 4 moves to the afternoon in place of 5
+    schedule.add_afternoon_sub(Assignment(4, parse_time("11:00"), parse_time("18:00"), is_substitute=True,
+                                          is_afternoon_sub=True, replaces_id=5, original_luogo_id=3))
+    return Occupancy(schedule, [1, 2, 3], home)
+
+
+def test_who_is_where():
+    occupancy = build_occupancy()
+
+    assert occupancy.counts_at(parse_time("08:20")) == {1: 1, 2: 1, 3: 0}
+    assert occupancy.who_is_at(1, parse_time("10:30")) == [1, 2]
+    assert occupancy.where_is(2, parse_time("09:00")) == 2
+    assert occupancy.where_is(2, parse_time("11:00")) == 1
+    assert occupancy.where_is(4, parse_time("08:00")) is None
+    assert occupancy.starts_after(parse_time("09:00")) == 2
+
+
+def test_end_of_day_and_gaps():
+    occupancy = build_occupancy()
+
+    assert occupancy.present_at_end() == {1: 2, 2: 1, 3: 1}
+    gaps = occupancy.gaps({1: 1, 2: 1, 3: 1}, parse_time("07:00"), parse_time("12:00"))
+    assert gaps == {
+        1: [(parse_time("07:00"), parse_time("07:30"))],
+        2: [(parse_time("07:00"), parse_time("07:30"))],
+        3: [(parse_time("07:00"), parse_time("11:00"))],
+    }
+
+
+def test_coverage_counts_like_the_matrix():
+    """LuogoCoverage uses the same half-open test as counts_at(): leaving at 08:20 is not there at 08:20"""
+    schedule = Schedule()
+    schedule.add(1, Assignment(1, parse_time("07:00"), MORNING_COVERAGE_LIMIT))
+    schedule.add(1, Assignment(2, parse_time("07:00"), MORNING_COVERAGE_LIMIT + 1))
+    schedule.add(1, Assignment(3, MORNING_COVERAGE_LIMIT + 1, parse_time("14:00")))
+    coverage = LuogoCoverage([{'id': 1, 'min_collaboratori': 1}])
+    for _, assignments in schedule.items():
+        for assignment in assignments:
+            coverage.add(1, assignment.start, assignment.end)
+
+    assert Occupancy(schedule, [1], {}).counts_at(MORNING_COVERAGE_LIMIT) == {1: 1}
+    assert coverage.balance(1) == 0
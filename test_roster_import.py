@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+CSV import of the staff roster
+"""
+
+import io
+
+import dataset
+from roster_import import import_roster
+
+ROSTER = """Nome (P = Part Time),Assegnazione,Lunedi,Martedi,Mercoledì,Giovedi,Venerdi,Fisso
+Rossi Maria (P),Palestra,7:54 - 14:57,7:54 - 14:57 (novembre 10:48 - 18:00),assente,7:54 - 14:57,7:54 - 14:57 (gennaio 10:48 - 18:00),sì
+Bianchi Luca,Pendolo,7:30 - 14:42,7:30 - 14:42,7:30 - 14:42,7:30 - 14:42,7:30 - 14:42 in Portineria,
+Verdi,Bar,7:30 - 14:42,,,,,
+Neri Anna,Bar,7:30 - 14:42,25:00 - 14:42,7:30 - 14:42 (brumaio 10:00 - 18:00),,,
+Gialli Paolo,palestra,8:00 - 15:12,8:00 - 15:12,8:00 - 15:12,8:00 - 15:12,8:00 - 15:12 al bar,no
+"""
+
+
+def test_import_checks_every_row_and_writes_once_per_collection(tmp_path, monkeypatch):
+    data_dir = str(tmp_path)
+    dataset.insert('luoghi.json', {'nome': 'Bar', 'descrizione': '', 'min_collaboratori': 1}, data_dir)
+    writes = []
+    insert_many = dataset.insert_many
+    monkeypatch.setattr(dataset, 'insert_many',
+                        lambda filename, records, data_dir=None: writes.append(filename) or insert_many(filename, records, data_dir))
+
+    report = import_roster(io.StringIO(ROSTER, newline=''), anno=2025, data_dir=data_dir)
+
+    assert report['errori'] == [
+        [4, "nome mancante o senza cognome"],
+        [5, "Martedi: orario non valido '25:00'; Mercoledi: mese sconosciuto 'brumaio'"],
+    ]
+    assert (report['collaboratori'], report['luoghi'], report['turnazioni'], report['coperture_fisse']) == (3, 3, 2, 2)
+    assert writes == ['luoghi.json', 'collaboratori.json', 'turnazioni.json', 'coperture_fisse.json']
+
+    luoghi = {luogo['nome']: luogo['id'] for luogo in dataset.load('luoghi.json', data_dir)}
+    assert set(luoghi) == {'Bar', 'Palestra', 'Pendolo', 'Portineria'}
+    rossi, bianchi, gialli = dataset.load('collaboratori.json', data_dir)
+    assert (rossi['cognome'], rossi['nome'], rossi['fisso_nel_luogo']) == ('Rossi', 'Maria', True)
+    assert rossi['orari_settimanali']['lunedi'] == {'inizio': '07:54', 'fine': '14:57'}
+    assert 'mercoledi' not in rossi['orari_settimanali']
+    assert gialli['luogo_id'] == luoghi['Palestra'] and not gialli['fisso_nel_luogo']
+    # The school year starts in September: January is in the next year
+    assert [(t['collaboratore_id'], t['giorno_settimana'], t['mese'], t['anno'], t['ora_ingresso_alternativa'])
+            for t in dataset.load('turnazioni.json', data_dir)] == [
+        (rossi['id'], 'martedi', 'novembre', 2025, '10:48'), (rossi['id'], 'venerdi', 'gennaio', 2026, '10:48')]
+    assert [(c['collaboratore_id'], c['luogo_coperto_id']) for c in dataset.load('coperture_fisse.json', data_dir)] == [
+        (bianchi['id'], luoghi['Portineria']), (gialli['id'], luoghi['Bar'])]
+
+    # The same file again adds nothing
+    again = import_roster(io.StringIO(ROSTER, newline=''), anno=2025, data_dir=data_dir, batch_size=1)
+    assert again['collaboratori'] == 0 and len(again['errori']) == 5
+    assert len(dataset.load('collaboratori.json', data_dir)) == 3
+
+
+def test_import_endpoint_streams_the_upload(tmp_path, monkeypatch):
+    import app
+    monkeypatch.setattr(app, 'DATA_DIR', str(tmp_path))
+    client = app.app.test_client()
+
+    checked = client.post('/importa?anno=2025&prova=1', data=ROSTER.encode('utf-8-sig'), content_type='text/csv')
+    assert checked.json['collaboratori'] == 3 and [line for line, _ in checked.json['errori']] == [4, 5]
+    assert not (tmp_path / 'collaboratori.json').exists()
+
+    uploaded = client.post('/importa', data={'anno': '2025', 'file': (io.BytesIO(ROSTER.encode('utf-8')), 'orari.csv')},
+                           content_type='multipart/form-data')
+    assert uploaded.status_code == 200 and 'Riga 5' in uploaded.get_data(as_text=True)
+    assert len(dataset.load('collaboratori.json', str(tmp_path))) == 3
+
+    assert client.post('/importa', data=b'Nome,Luogo\n', content_type='text/csv').status_code == 400
+
+    # curl --data-binary sends a form content type: the body is still the CSV
+    header, row = ROSTER.splitlines()[0], "Azzurri Rita,Bar,7:30 - 14:42,,,,,"
+    posted = client.post('/importa?anno=2025', data=f"{header}\n{row}\n".encode('utf-8'),
+                         content_type='application/x-www-form-urlencoded')
+    assert posted.status_code == 200 and posted.json['collaboratori'] == 1
+
+    # A line that is not UTF-8, past the first batch, is only that line's error
+    rows = [f"Cognome{n} Nome{n},Bar,7:30 - 14:42,,,,,\n".encode('utf-8') for n in range(600)]
+    rows.insert(550, b"Rosso \xff\xfe,Bar,7:30 - 14:42,,,,,\n")
+    broken = client.post('/importa', data=f"{header}\n".encode('utf-8') + b''.join(rows), content_type='text/csv')
+    assert broken.status_code == 200 and broken.json['collaboratori'] == 600
+    assert broken.json['errori'] == [[552, "riga non in UTF-8"]]
+    assert len(dataset.load('collaboratori.json', str(tmp_path))) == 604
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+Round trip of the Schedule model through its JSON form
+"""
+
+import json
+
+from schedule import Assignment, CleaningOvertime, Schedule
+
+
+def build_schedule():
+    schedule = Schedule()
+    schedule.add(1, Assignment(10, 474, 897))
+    schedule.add(1, Assignment(11, 648, 1080, partial_end=560))
+    schedule.add(2, Assignment(12, 474, 897, is_substitute=True, replaces_id=13, original_luogo_id=3))
+    schedule.add_afternoon_sub(Assignment(14, 474, 1080, is_substitute=True, is_afternoon_sub=True,
+                                          replaces_id=15, original_luogo_id=2))
+    schedule.add_cleaning_overtime(CleaningOvertime(10, 3, "Bandini 2", 20))
+    return schedule
+
+
+def test_schedule_json_round_trip():
+    """to_dict() survives json.dumps/loads (string keys) and from_dict() rebuilds the same schedule"""
+    schedule = build_schedule()
+    data = schedule.to_dict()
+
+    assert data[1][1] == {'collaboratore_id': 11, 'start': "10:48", 'end': "18:00", 'partial_end': "09:20"}
+    assert data['afternoon_subs'][0]['is_afternoon_sub'] is True
+
+    restored = Schedule.from_dict(json.loads(json.dumps(data)))
+
+    assert json.loads(json.dumps(restored.to_dict())) == json.loads(json.dumps(data))
+    assert restored.present_ids() == {10, 11, 12}
+    assert restored.substitute_ids() == {12, 14}
+    assert restored.assignments(2)[0].original_luogo_id == 3
+    assert restored.cleaning_overtime[0].overtime_minutes == 20
+
+
+def test_empty_schedule_has_no_special_keys():
+    """afternoon_subs and cleaning_overtime only appear once something was assigned"""
+    schedule = Schedule()
+    schedule.add(1, Assignment(10, 474, 897))
+
+    assert set(schedule.to_dict()) == {1}
+    assert Schedule.from_dict({}).cleaning_overtime is None
@@ -0,0 +1,23 @@
+#!/usr/bin/env python3
+"""
+Server-side store of the generated schedules
+"""
+
+from schedule_store import ScheduleStore
+
+
+def test_entries_are_shared_taken_once_and_expire(tmp_path):
+    path = str(tmp_path / "schedules.sqlite3")
+    store, other_worker = ScheduleStore(path), ScheduleStore(path)
+    value = {'schedule': {'3': [{'collaboratore_id': 12}]}, 'date': "2026-01-13"}
+
+    entry_id = store.put(value)
+    assert len(entry_id) < 16
+    assert other_worker.get(entry_id) == value
+    assert other_worker.take(entry_id) == value
+    assert store.take(entry_id) is None and store.get(entry_id) is None
+    assert store.get(None) is None
+
+    expired = ScheduleStore(path, ttl=-1)
+    assert expired.get(expired.put(value)) is None
+    assert len(store) == 0
@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+"""
+Monte Carlo simulator on a synthetic dataset
+"""
+
+from datetime import date
+
+from benchmark import build_dataset, write_dataset
+from simulator import simulate
+
+
+def test_simulation_is_reproducible_across_worker_counts(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write_dataset(build_dataset(40, 15, date(2026, 1, 12), seed=2), str(tmp_path))
+
+    kwargs = dict(scenarios=24, seed=7, default_rate=0.3, overload_threshold=1, data_dir=str(tmp_path))
+    one = simulate(date(2026, 1, 12), date(2026, 1, 16), workers=1, **kwargs)
+    two = simulate(date(2026, 1, 12), date(2026, 1, 16), workers=2, **kwargs)
+
+    assert one == two
+    assert one['school_days'] == 5
+    assert one['shortage'] and one['overloaded']
+    for row in one['shortage']:
+        assert 0 < row['per_day'] <= row['in_range'] <= 1
+    assert one['overtime_minutes']['mean'] <= one['overtime_minutes']['max']
+
+    # A different seed samples different scenarios
+    assert simulate(date(2026, 1, 12), date(2026, 1, 16), workers=1, **dict(kwargs, seed=8)) != one
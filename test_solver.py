@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Min-cost-flow substitution solver
+"""
+
+import contextlib
+import io
+from datetime import date
+
+from benchmark import build_dataset, write_dataset
+from generator import Generator
+from solver import AFTERNOON, PRIORITY_STEP, solve
+
+
+def test_solve_prefers_secondary_and_respects_donor_surplus():
+    """Luogo 1 can give one person and luogo 2 two; luogo 10 misses two people, the afternoon one"""
+    donors = {1: (1, 0), 2: (2, 30)}
+    candidates = [
+        (11, 1, 0, None),
+        (12, 1, 0, None),
+        (21, 2, 50, 10),
+        (22, 2, 300, None),
+    ]
+    demands = {10: (2, PRIORITY_STEP), AFTERNOON: (1, 2 * PRIORITY_STEP)}
+
+    assignments = solve(donors, candidates, demands)
+
+    assert sorted(assignments, key=str) == sorted([(21, 10), (11, 10), (22, AFTERNOON)], key=str)
+
+
+def test_solve_fills_the_most_essential_deficits_when_people_are_short():
+    """With one person to give, the cheaper (more essential) deficit gets it"""
+    donors = {1: (1, 0)}
+    candidates = [(11, 1, 0, None), (12, 1, 0, None)]
+    demands = {10: (1, 3 * PRIORITY_STEP), 20: (1, PRIORITY_STEP)}
+
+    assert solve(donors, candidates, demands) == [(11, 20)]
+
+
+def test_flow_solver_leaves_no_more_shortages_than_greedy(tmp_path, monkeypatch):
+    """On a synthetic short-staffed day the flow solver covers at least what the greedy one does"""
+    monkeypatch.chdir(tmp_path)
+    write_dataset(build_dataset(120, 60, absence_rate=0.15, seed=3), str(tmp_path))
+
+    missing = {}
+    for mode in ('greedy', 'flow'):
+        generator = Generator(data_dir=str(tmp_path), solver=mode)
+        with contextlib.redirect_stdout(io.StringIO()):
+            schedule = generator.generate_schedule(13, 1, 2026, 'martedi')
+        missing[mode] = sum(generator.missing_by_luogo(schedule).values())
+
+        # Nobody substitutes twice
+        moved = [a.collaboratore_id for _, assignments in schedule.items() for a in assignments if a.is_substitute]
+        moved += [a.collaboratore_id for a in schedule.afternoon_subs]
+        assert len(moved) == len(set(moved))
+
+    assert missing['flow'] <= missing['greedy']
@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""
+Storage backends: record operations, id sequences, the SQLite migration
+and concurrent writers
+"""
+
+import json
+import multiprocessing
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+
+import pytest
+
+import dataset
+import metrics
+from benchmark import build_dataset, write_dataset
+from generator import Generator
+from storage import DATABASE_FILENAME, JsonStorage, SQLiteStorage, migrate_json_to_sqlite, partition_filename
+
+
+@pytest.fixture(params=['json', 'sqlite'])
+def backend(request, tmp_path):
+    if request.param == 'json':
+        return JsonStorage(str(tmp_path))
+    return SQLiteStorage(str(tmp_path / DATABASE_FILENAME))
+
+
+def test_ids_are_never_reused(backend):
+    first = backend.insert('assenze.json', {'collaboratore_id': 1, 'data': "2026-01-12"})
+    second = backend.insert('assenze.json', {'collaboratore_id': 2, 'data': "2026-01-13"})
+    assert backend.delete('assenze.json', second['id'])
+    third = backend.insert('assenze.json', {'collaboratore_id': 3, 'data': "2026-01-14"})
+
+    assert (first['id'], second['id'], third['id']) == (1, 2, 3)
+    assert backend.update('assenze.json', 1, {'data': "2026-02-01"})
+    assert not backend.update('assenze.json', 2, {'data': "2026-02-01"})
+    assert not backend.delete('assenze.json', 2)
+    assert backend.load('assenze.json') == [
+        {'collaboratore_id': 1, 'data': "2026-02-01", 'id': 1},
+        {'collaboratore_id': 3, 'data': "2026-01-14", 'id': 3},
+    ]
+
+
+def test_query_pages_match_a_full_scan(backend):
+    for i in range(40):
+        backend.insert('assenze.json', {'collaboratore_id': i % 3, 'data': f"2026-01-{i % 20 + 1:02d}"})
+    backend.delete('assenze.json', 7)
+    expected = sorted((record for record in backend.load('assenze.json')
+                       if record['collaboratore_id'] == 1 and "2026-01-05" <= record['data'] <= "2026-01-15"),
+                      key=lambda record: (record['data'], record['id']), reverse=True)
+
+    pages, after = [], None
+    while True:
+        page, after = backend.query('assenze.json', where={'collaboratore_id': 1},
+                                    between=('data', "2026-01-05", "2026-01-15"),
+                                    order='data', descending=True, after=after, limit=3)
+        pages.append(page)
+        if after is None:
+            break
+    assert [record for page in pages for record in page] == expected
+    assert all(len(page) == 3 for page in pages[:-1])
+    assert backend.query('assenze.json', limit=100)[0] == sorted(backend.load('assenze.json'),
+                                                                 key=lambda record: record['id'])
+    with pytest.raises(ValueError):
+        backend.query('assenze.json', where={'tutto_giorno': True})
+
+
+def test_api_pages_and_not_modified(tmp_path, monkeypatch):
+    import app
+    monkeypatch.setattr(app, 'DATA_DIR', str(tmp_path))
+    for day in range(1, 6):
+        dataset.insert('assenze.json', {'collaboratore_id': 1, 'data': f"2026-03-{day:02d}"}, str(tmp_path))
+    client = app.app.test_client()
+
+    first = client.get('/api/assenze?limite=3&dal=2026-03-02')
+    assert [record['data'] for record in first.json['elementi']] == ["2026-03-05", "2026-03-04", "2026-03-03"]
+    second = client.get(f"/api/assenze?limite=3&dal=2026-03-02&cursore={first.json['cursore']}")
+    assert [record['data'] for record in second.json['elementi']] == ["2026-03-02"]
+    assert second.json['cursore'] is None
+
+    assert client.get('/api/assenze', headers={'If-None-Match': first.headers['ETag']}).status_code == 304
+    dataset.insert('assenze.json', {'collaboratore_id': 2, 'data': "2026-03-09"}, str(tmp_path))
+    assert client.get('/api/assenze', headers={'If-None-Match': first.headers['ETag']}).status_code == 200
+    assert client.get('/api/assenze?dal=ieri').status_code == 400
+
+
+def test_sqlite_writes_are_seen_by_other_connections(tmp_path):
+    path = str(tmp_path / DATABASE_FILENAME)
+    reader, writer = SQLiteStorage(path), SQLiteStorage(path)
+    reader.save('orari_pomeriggio.json', {})
+    assert reader.load('luoghi.json') == []
+    digest = reader.digest('luoghi.json')
+
+    writer.insert('luoghi.json', {'nome': "Bar"})
+
+    assert reader.load('luoghi.json') == [{'nome': "Bar", 'id': 1}]
+    assert reader.digest('luoghi.json') != digest
+    assert reader.load('orari_pomeriggio.json') == {}
+    with sqlite3.connect(path) as connection:
+        assert connection.execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
+
+
+def test_migration_keeps_ids_and_renumbers_duplicates(tmp_path, monkeypatch):
+    assenze = [{'id': 1, 'collaboratore_id': 5, 'data': "2026-01-12"},
+               {'id': 4, 'collaboratore_id': 6, 'data': "2026-01-12"},
+               {'id': 4, 'collaboratore_id': 7, 'data': "2026-01-13"}]
+    (tmp_path / "assenze.json").write_text(json.dumps(assenze), encoding='utf-8')
+    (tmp_path / "sub_order.json").write_text(json.dumps([2, 1]), encoding='utf-8')
+
+    report = migrate_json_to_sqlite(str(tmp_path))
+
+    assert report == {'assenze.json': (3, 1), 'sub_order.json': (1, 0)}
+    with pytest.raises(FileExistsError):
+        migrate_json_to_sqlite(str(tmp_path))
+
+    # With the database in place the dataset reads from it
+    monkeypatch.delenv('DATASET_BACKEND', raising=False)
+    dataset.clear()
+    assert isinstance(dataset.storage(str(tmp_path)), SQLiteStorage)
+    assert [a['id'] for a in dataset.load('assenze.json', str(tmp_path))] == [1, 4, 5]
+    assert dataset.insert('assenze.json', {'collaboratore_id': 8}, str(tmp_path))['id'] == 6
+    assert dataset.partitions('assenze.json', str(tmp_path)) == ["0000-00", "2026-01"]
+    assert [a['id'] for a in dataset.load(partition_filename('assenze.json', "2026-01"), str(tmp_path))] == [1, 4, 5]
+    assert dataset.load('sub_order.json', str(tmp_path)) == [2, 1]
+
+
+def test_json_journal_replay_and_compaction(tmp_path):
+    snapshot = tmp_path / "turnazioni.json"
+    snapshot.write_text(json.dumps([{'id': 1, 'collaboratore_id': 5, 'data': "2026-01-12"}]), encoding='utf-8')
+    writer = JsonStorage(str(tmp_path), compact_bytes=10 ** 6)
+    writer.insert('turnazioni.json', {'collaboratore_id': 6, 'data': "2026-01-13"})
+    writer.update('turnazioni.json', 1, {'data': "2026-01-14"})
+    writer.delete('turnazioni.json', 2)
+    writer.insert('turnazioni.json', {'collaboratore_id': 7, 'data': "2026-01-15"})
+    expected = [{'id': 1, 'collaboratore_id': 5, 'data': "2026-01-14"},
+                {'collaboratore_id': 7, 'data': "2026-01-15", 'id': 3}]
+
+    # The writes only went to the journal, and another reader replays it
+    assert json.loads(snapshot.read_text(encoding='utf-8'))[0]['data'] == "2026-01-12"
+    assert len((tmp_path / "turnazioni.json.journal").read_text(encoding='utf-8').splitlines()) == 4
+    assert JsonStorage(str(tmp_path)).load('turnazioni.json') == expected
+
+    # A compaction that stops before dropping the journal replays to the same content
+    journal = (tmp_path / "turnazioni.json.journal").read_bytes()
+    writer.compact('turnazioni.json')
+    assert not (tmp_path / "turnazioni.json.journal").exists()
+    (tmp_path / "turnazioni.json.journal").write_bytes(journal)
+    reader = JsonStorage(str(tmp_path))
+    assert reader.load('turnazioni.json') == expected
+    assert reader.insert('turnazioni.json', {'collaboratore_id': 8})['id'] == 4
+
+    # Past the threshold the background compactor folds the journal
+    small = JsonStorage(str(tmp_path), compact_bytes=1)
+    small.insert('turnazioni.json', {'collaboratore_id': 9})
+    small.flush()
+    assert not (tmp_path / "turnazioni.json.journal").exists()
+    assert [a['id'] for a in json.loads(snapshot.read_text(encoding='utf-8'))] == [1, 3, 4, 5]
+
+    # A failing background compaction keeps the journal and is counted
+    failures = metrics.COMPACTION_FAILURES.value(collection='turnazioni.json')
+    small.compact = lambda filename: 1 / 0
+    small.insert('turnazioni.json', {'collaboratore_id': 10})
+    small.flush()
+    assert metrics.COMPACTION_FAILURES.value(collection='turnazioni.json') == failures + 1
+    assert small.load('turnazioni.json')[-1]['collaboratore_id'] == 10
+
+
+def test_a_read_lock_is_never_upgraded_to_a_write(tmp_path):
+    storage = JsonStorage(str(tmp_path))
+    with storage._lock.hold(exclusive=False):
+        with pytest.raises(RuntimeError):
+            storage.insert('turnazioni.json', {'collaboratore_id': 5})
+    # The write lock taken first covers the reads inside it
+    with storage.locked():
+        storage.insert('turnazioni.json', {'collaboratore_id': 5})
+        assert [t['collaboratore_id'] for t in storage.load('turnazioni.json')] == [5]
+
+
+def test_assenze_are_stored_by_month(tmp_path):
+    this_month = date.today().isoformat()
+    (tmp_path / "assenze.json").write_text(json.dumps([
+        {'id': 1, 'collaboratore_id': 5, 'data': "2020-03-02"},
+        {'id': 2, 'collaboratore_id': 6, 'data': this_month},
+    ]), encoding='utf-8')
+    storage = JsonStorage(str(tmp_path))
+
+    # A single file is split on first use, ids carry on
+    assert storage.partitions('assenze.json') == ["2020-03", this_month[:7]]
+    assert not (tmp_path / "assenze.json").exists()
+    assert storage.insert('assenze.json', {'collaboratore_id': 7, 'data': this_month})['id'] == 3
+    # A new date moves the record to its month
+    assert storage.update('assenze.json', 2, {'data': "2020-03-09"})
+    assert [a['id'] for a in storage.load(partition_filename('assenze.json', "2020-03"))] == [1, 2]
+    assert [a['id'] for a in storage.load('assenze.json')] == [1, 2, 3]
+
+    # Old months are compressed, the current one stays as it is
+    storage.compact('assenze.json')
+    assert (tmp_path / "assenze" / "2020-03.json.gz").exists()
+    assert (tmp_path / "assenze" / f"{this_month[:7]}.json").exists()
+    reader = JsonStorage(str(tmp_path))
+    assert [a['data'] for a in reader.load(partition_filename('assenze.json', "2020-03"))] == ["2020-03-02", "2020-03-09"]
+    assert reader.delete('assenze.json', 1)
+    assert reader.insert('assenze.json', {'collaboratore_id': 8, 'data': "2020-03-10"})['id'] == 4
+
+
+def test_assenze_load_in_insertion_order(tmp_path):
+    (tmp_path / "assenze.json").write_text(json.dumps([
+        {'id': 5, 'collaboratore_id': 1, 'data': "2026-01-12"},
+        {'id': 2, 'collaboratore_id': 2, 'data': "2025-11-03"},
+        {'id': 4, 'collaboratore_id': 3, 'data': "2026-01-12"},
+        {'id': 4, 'collaboratore_id': 4, 'data': "2025-11-03"},
+    ]), encoding='utf-8')
+    storage = JsonStorage(str(tmp_path))
+
+    # The order of the file survives the split, new records come last
+    storage.insert('assenze.json', {'collaboratore_id': 5, 'data': "2025-11-04"})
+    assert storage.update('assenze.json', 2, {'data': "2026-01-13"})
+    assert [a['collaboratore_id'] for a in JsonStorage(str(tmp_path)).load('assenze.json')] == [1, 2, 3, 4, 5]
+
+    # Saved in the order of the ids (and months, for the two 4s), nothing else is kept
+    storage.save('assenze.json', sorted(storage.load('assenze.json'), key=lambda a: (a['id'], a['data'])))
+    assert not (tmp_path / "assenze" / "order.json").exists()
+    assert [a['collaboratore_id'] for a in JsonStorage(str(tmp_path)).load('assenze.json')] == [2, 4, 3, 1, 5]
+
+
+def test_generator_reads_only_the_month_it_generates(tmp_path):
+    write_dataset(build_dataset(60, 10, date(2026, 1, 13), absence_rate=0.1, seed=2, history_years=2),
+                  str(tmp_path))
+    expected = Generator(data_dir=str(tmp_path), seed=0).generate(13, 1, 2026, 'martedi').substitutions_text
+
+    dataset.clear()
+    months = dataset.partitions('assenze.json', str(tmp_path))
+    assert len(months) > 12
+    for month in months:
+        if month != "2026-01":
+            (tmp_path / "assenze" / f"{month}.json").write_text("non è JSON", encoding='utf-8')
+    dataset.clear()
+    assert Generator(data_dir=str(tmp_path), seed=0).generate(13, 1, 2026, 'martedi').substitutions_text == expected
+
+
+def _open(kind, data_dir):
+    if kind == 'json':
+        # Small journals, so that compactions run among the writes
+        return JsonStorage(data_dir, compact_bytes=2000)
+    return SQLiteStorage(f"{data_dir}/{DATABASE_FILENAME}")
+
+
+def _write(kind, data_dir, worker, rounds):
+    storage = _open(kind, data_dir)
+    ids = []
+    for _ in range(rounds):
+        ids.append(storage.insert('assenze.json', {'collaboratore_id': worker, 'data': "2026-02-02"})['id'])
+        with storage.locked():
+            first = storage.load('collaboratori.json')[0]
+            storage.update('collaboratori.json', first['id'],
+                           {'straordinari_svolti': first['straordinari_svolti'] + 1})
+    if kind == 'json':
+        storage.flush()
+    return ids
+
+
+def _generate(data_dir, rounds):
+    for _ in range(rounds):
+        Generator(data_dir=data_dir, seed=0).generate(13, 1, 2026, 'martedi')
+    return rounds
+
+
+@pytest.mark.parametrize('kind', ['json', 'sqlite'])
+def test_concurrent_writers_and_generators(kind, tmp_path):
+    write_dataset(build_dataset(40, 10, date(2026, 1, 13), seed=1), str(tmp_path))
+    if kind == 'sqlite':
+        migrate_json_to_sqlite(str(tmp_path))
+    dataset.clear()
+    before = _open(kind, str(tmp_path))
+    assenze = len(before.load('assenze.json'))
+    straordinari = before.load('collaboratori.json')[0]['straordinari_svolti']
+    writers, rounds = 4, 25
+
+    with ProcessPoolExecutor(writers + 2, mp_context=multiprocessing.get_context('fork')) as pool:
+        generated = [pool.submit(_generate, str(tmp_path), 5) for _ in range(2)]
+        written = [pool.submit(_write, kind, str(tmp_path), worker, rounds) for worker in range(writers)]
+        ids = [i for future in written for i in future.result()]
+        assert [future.result() for future in generated] == [5, 5]
+
+    # No id handed out twice, no write lost
+    after = _open(kind, str(tmp_path))
+    assert len(set(ids)) == writers * rounds
+    assert len(after.load('assenze.json')) == assenze + writers * rounds
+    assert after.load('collaboratori.json')[0]['straordinari_svolti'] == straordinari + writers * rounds